@@ -0,0 +1,75 @@
+"""
+Benchmark loading drive events into a gsuite_utils.activity_store.DriveActivityStore, and the time of its
+queries, e.g. the external shares of the documents of a user over a week and the per-actor counts.
+
+Usage: python benchmarks/bench_activity_store.py [NUMBER_OF_EVENTS] [DATABASE_FILE]
+"""
+from __future__ import print_function
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from gsuite_utils.activity_store import DriveActivityStore
+from gsuite_utils.gdrive import format_rfc3339
+
+EVENTS = ['view', 'edit', 'download', 'change_user_access', 'change_document_visibility']
+USERS = 2000
+DOCS = 200000
+
+
+def synthetic_activities(count):
+    rnd = random.Random(0)
+    start = datetime(2020, 1, 1)
+    for i in range(count):
+        name = rnd.choice(EVENTS)
+        owner = 'user{}@example.com'.format(rnd.randrange(USERS))
+        parameters = [{'name': 'doc_id', 'value': 'doc{}'.format(rnd.randrange(DOCS))},
+                      {'name': 'doc_title', 'value': 'Document {}'.format(i)},
+                      {'name': 'doc_type', 'value': 'document'},
+                      {'name': 'owner', 'value': owner},
+                      {'name': 'primary_event', 'boolValue': True}]
+        if name.startswith('change_'):
+            parameters.append({'name': 'visibility_change', 'value': rnd.choice(['external', 'internal', 'none'])})
+        yield {
+            'id': {'time': format_rfc3339(start + timedelta(seconds=i * 30)), 'uniqueQualifier': str(i)},
+            'actor': {'email': 'user{}@example.com'.format(rnd.randrange(USERS))},
+            'events': [{'name': name, 'parameters': parameters}],
+        }
+
+
+def timed(name, func, repeat=20):
+    t = time.time()
+    for _ in range(repeat):
+        result = func()
+    print('{:<45} {:>8.2f} ms  ({} results)'.format(name, (time.time() - t) * 1000 / repeat, len(result)))
+
+
+def main(count=1000000, path=None):
+    tmp = None
+    if path is None:
+        tmp = tempfile.mkdtemp()
+        path = os.path.join(tmp, 'drive.db')
+    store = DriveActivityStore(path)
+    t = time.time()
+    inserted = store.add_activities(synthetic_activities(count))
+    secs = time.time() - t
+    print('{} events stored in {:.1f} s ({:.0f} events/s)'.format(inserted, secs, inserted / secs))
+
+    timed('external shares of a user over a week', lambda: store.external_shares(
+        'user1@example.com', '2020-01-06T00:00:00.000Z', '2020-01-13T00:00:00.000Z'))
+    timed('events of an actor, latest 100', lambda: store.events(actor='user2@example.com', limit=100))
+    timed('events of a document', lambda: store.events(doc_id='doc3'))
+    timed('per-actor counts over a week', lambda: store.actor_counts('2020-01-06', '2020-01-13'))
+    timed('per-actor downloads, all time', lambda: store.actor_counts(event='download'), repeat=3)
+    store.close()
+    if tmp is not None:
+        for name in os.listdir(tmp):
+            os.remove(os.path.join(tmp, name))
+        os.rmdir(tmp)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000, sys.argv[2] if len(sys.argv) > 2 else None)
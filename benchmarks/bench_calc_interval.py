@@ -0,0 +1,69 @@
+"""
+Benchmark parsing the start and end of calendar events, as done by GCalendar.calc_interval.
+
+Compares the previous approach, trying each expected format with strptime until one works, with
+gsuite_utils.timeparse.parse_event_time.
+
+Usage: python benchmarks/bench_calc_interval.py [NUMBER_OF_EVENTS]
+"""
+from __future__ import print_function
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from gsuite_utils.timeparse import event_duration_seconds, parse_event_time
+
+# Formats tried in turn by the previous calc_interval
+LEGACY_FORMATS = ['%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%d']
+
+
+def legacy_duration_seconds(start_time, end_time):
+    for f in LEGACY_FORMATS:
+        try:
+            end_dt = datetime.strptime(end_time, f)
+            start_dt = datetime.strptime(start_time, f)
+            return (end_dt - start_dt).seconds
+        except Exception:
+            pass
+    return None
+
+
+def synthetic_events(count):
+    """Working hours meetings on the half hour of a year, with several timezones and some all-day events"""
+    rnd = random.Random(0)
+    start = datetime(2020, 1, 1)
+    offsets = ['+10:00', '+00:00', '-05:00']
+    events = []
+    for _ in range(count):
+        day = start + timedelta(days=rnd.randrange(365))
+        if rnd.random() < 0.05:
+            events.append((day.strftime('%Y-%m-%d'), (day + timedelta(days=1)).strftime('%Y-%m-%d')))
+            continue
+        begin = day + timedelta(hours=rnd.randrange(8, 17), minutes=rnd.choice((0, 30)))
+        end = begin + timedelta(minutes=rnd.choice((30, 60, 90)))
+        offset = rnd.choice(offsets)
+        events.append((begin.strftime('%Y-%m-%dT%H:%M:%S') + offset, end.strftime('%Y-%m-%dT%H:%M:%S') + offset))
+    return events
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    events = synthetic_events(count)
+
+    for name, func in (('strptime per format', legacy_duration_seconds),
+                       ('parse_event_time', event_duration_seconds)):
+        parse_event_time.cache_clear()
+        t = time.time()
+        for start_time, end_time in events:
+            func(start_time, end_time)
+        secs = time.time() - t
+        print('{:<20} {:>8.2f} us/event'.format(name, secs / count * 1e6))
+
+    # the previous approach dropped whole days of multi-day events
+    print('2-day event: strptime per format {} s, parse_event_time {} s'.format(
+        legacy_duration_seconds('2020-01-01', '2020-01-03'), event_duration_seconds('2020-01-01', '2020-01-03')))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
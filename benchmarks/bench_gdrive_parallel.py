@@ -0,0 +1,52 @@
+"""
+Benchmark sequential vs time-sliced parallel fetching of Drive activities against the local fake Reports API.
+
+Usage: python benchmarks/bench_gdrive_parallel.py [NUMBER_OF_ACTIVITIES] [LATENCY_SECS]
+"""
+from __future__ import print_function
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+
+from gsuite_utils.gdrive import format_rfc3339, iter_gdrive_activities, iter_gdrive_activities_parallel
+from gsuite_utils.retry import RetryPolicy
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    end = start + timedelta(days=30)
+    step = (end - start) / count
+
+    with FakeGoogleServer() as server:
+        for i in range(count):
+            server.api.add_activity(format_rfc3339(start + step * i), 'user@example.com', 'edit', {'doc_id': str(i)})
+        server.api.latency = latency
+
+        def service_factory():
+            return ServiceRegistry(httplib2.Http(), root_url=server.root_url).get('admin', 'reports_v1')
+
+        runs = [
+            ('sequential', lambda: iter_gdrive_activities(
+                service_factory(), format_rfc3339(start), format_rfc3339(end), retry_policy=RetryPolicy())),
+        ]
+        for workers in (4, 16):
+            runs.append(('parallel x{}'.format(workers), lambda w=workers: iter_gdrive_activities_parallel(
+                service_factory, format_rfc3339(start), format_rfc3339(end), window=timedelta(days=1),
+                max_workers=w, retry_policy=RetryPolicy())))
+
+        for name, fetch in runs:
+            t = time.time()
+            fetched = sum(1 for _ in fetch())
+            secs = time.time() - t
+            print('{:<14} {:>8} activities {:>8.2f} s {:>10.0f} activities/s'.format(
+                name, fetched, secs, fetched / secs))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
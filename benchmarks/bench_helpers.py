@@ -0,0 +1,198 @@
+"""
+Benchmark suite of the helpers against the local fake Google APIs, without network access.
+
+Covers add_group_members (sequential and batched), group_info on large groups, Drive activity exports and
+the conversion of calendar events, reporting throughput and latency percentiles of the API calls.
+
+Usage: python benchmarks/bench_helpers.py [--quick] [--latency SECS] [--json FILE] [--baseline FILE]
+                                          [--check {all,requests,throughput}]
+
+With --baseline, exits with status 1 if a benchmark sent more HTTP requests than in the baseline, e.g. the
+--json output of a previous run, or if its throughput fell more than --tolerance below the baseline one.
+The request counts do not depend on the machine, unlike the throughput: --check requests reports the
+throughput drops as warnings only, e.g. in CI against a baseline recorded on another machine.
+"""
+from __future__ import print_function
+import argparse
+import io
+import json
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+
+from gsuite_utils.gdrive import export_activities, format_rfc3339, iter_gdrive_activities
+from gsuite_utils.ggroups import GGroupsAndSettings
+from gsuite_utils.retry import RetryPolicy
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.telemetry import Telemetry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+from gsuite_utils.timeentries import TaskRules, TimeEntryTable
+
+SIZES = {
+    'quick': {'members': (200, 1000), 'sequential_members': 200, 'group_members': 2000, 'activities': 5000,
+              'calendars': 20, 'events_per_calendar': 250},
+    'full': {'members': (1000, 10000), 'sequential_members': 1000, 'group_members': 10000, 'activities': 50000,
+             'calendars': 100, 'events_per_calendar': 1000},
+}
+
+
+class OfflineGroups(GGroupsAndSettings):
+    """GGroupsAndSettings talking to the fake with unauthorized http objects"""
+
+    @staticmethod
+    def _auth(*args):
+        return httplib2.Http()
+
+
+def groups_helper(server):
+    return OfflineGroups(None, None, services=ServiceRegistry(httplib2.Http(), root_url=server.root_url),
+                         retry_policy=RetryPolicy(), telemetry=Telemetry())
+
+
+def bench_add_group_members(server, count, batch):
+    group = 'add-{}-{}@example.com'.format(count, 'batch' if batch else 'seq')
+    server.api.add_group(group)
+    helper = groups_helper(server)
+    emails = ['user{}@example.com'.format(i) for i in range(count)]
+    t = time.time()
+    assert helper.add_group_members(group, emails, batch=batch), helper.logs[:3]
+    return count, time.time() - t, helper.telemetry
+
+
+def bench_group_info(server, count):
+    group = 'large-{}@example.com'.format(count)
+    server.api.add_group(group, members=[{'email': 'user{}@example.com'.format(i)} for i in range(count)])
+    helper = groups_helper(server)
+    t = time.time()
+    info = helper.group_info(group)
+    assert len(info['members']) == count
+    return count, time.time() - t, helper.telemetry
+
+
+def bench_gdrive_export(server, count, output_format):
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    if not server.api.activities:
+        for i in range(count):
+            server.api.add_activity(format_rfc3339(start + timedelta(seconds=i)), 'user@example.com', 'edit',
+                                    {'doc_id': str(i), 'doc_title': 'Document {}'.format(i), 'doc_type': 'document'})
+    service = ServiceRegistry(httplib2.Http(), root_url=server.root_url).get('admin', 'reports_v1')
+    t = time.time()
+    exported = export_activities(iter_gdrive_activities(service, retry_policy=RetryPolicy()), io.StringIO(),
+                                 output_format)
+    assert exported == count
+    return count, time.time() - t, None
+
+
+def bench_calendar_conversion(server, calendars, per_calendar):
+    calendar_ids = ['cal{}@example.com'.format(c) for c in range(calendars)]
+    start = datetime(2020, 1, 1)
+    for c in calendar_ids:
+        for i in range(per_calendar):
+            begin = start + timedelta(hours=i * 5)
+            server.api.add_calendar_event(
+                c, '{}-{}'.format(c, i), begin.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                (begin + timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%SZ'), summary='Meeting {}'.format(i % 10))
+    events = ServiceRegistry(httplib2.Http(), root_url=server.root_url).get('calendar', 'v3').events()
+    rules = TaskRules([('Meeting [0-4]', 'T-1')], default_taskid='T-0')
+
+    t = time.time()
+    table = TimeEntryTable()
+    for c in calendar_ids:
+        request = events.list(calendarId=c, singleEvents=True, maxResults=2500)
+        while request is not None:
+            response = request.execute()
+            table.add_events(c, response.get('items', []), rules)
+            request = events.list_next(request, response)
+    table.aggregate()
+    assert len(table) == calendars * per_calendar
+    return len(table), time.time() - t, None
+
+
+def run(sizes, latency):
+    runs = []
+    for count in sizes['members']:
+        runs.append(('add_group_members batch {}'.format(count),
+                     lambda s, n=count: bench_add_group_members(s, n, True)))
+    n = sizes['sequential_members']
+    runs.append(('add_group_members sequential {}'.format(n), lambda s, n=n: bench_add_group_members(s, n, False)))
+    n = sizes['group_members']
+    runs.append(('group_info {} members'.format(n), lambda s, n=n: bench_group_info(s, n)))
+    for output_format in ('jsonl', 'csv'):
+        runs.append(('gdrive export {} {}'.format(sizes['activities'], output_format),
+                     lambda s, f=output_format: bench_gdrive_export(s, sizes['activities'], f)))
+    runs.append(('calendar conversion {}x{}'.format(sizes['calendars'], sizes['events_per_calendar']),
+                 lambda s: bench_calendar_conversion(s, sizes['calendars'], sizes['events_per_calendar'])))
+
+    results = {}
+    with FakeGoogleServer() as server:
+        server.api.latency = latency
+        for name, bench in runs:
+            del server.api.requests[:]
+            items, secs, telemetry = bench(server)
+            result = {'items': items, 'seconds': secs, 'items_per_second': items / secs,
+                      'requests': len(server.api.requests)}
+            if telemetry is not None:
+                # latency of the API calls taking most of the time
+                m = max(telemetry.summary().values(), key=lambda m: m['total_seconds'])
+                result.update(('call_' + p, m[p]) for p in ('p50', 'p95', 'p99'))
+            results[name] = result
+            print('{:<40} {:>7} items {:>8.2f} s {:>10.0f} items/s {:>6} requests {}'.format(
+                name, items, secs, result['items_per_second'], result['requests'],
+                ' '.join('{} {:.1f}ms'.format(p, result['call_' + p] * 1000)
+                         for p in ('p50', 'p95', 'p99') if 'call_' + p in result)))
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """
+    :return: list of (name, throughput, baseline throughput) of the benchmarks slower than the baseline
+    """
+    return [(name, r['items_per_second'], baseline[name]['items_per_second'])
+            for name, r in results.items()
+            if name in baseline and r['items_per_second'] < baseline[name]['items_per_second'] * (1 - tolerance)]
+
+
+def request_regressions(results, baseline):
+    """
+    :return: list of (name, requests, baseline requests) of the benchmarks sending more requests than the baseline
+    """
+    return [(name, r['requests'], baseline[name]['requests'])
+            for name, r in results.items() if name in baseline and r['requests'] > baseline[name]['requests']]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the helpers against the local fake Google APIs')
+    parser.add_argument('--quick', action='store_true', help='Smaller sizes, e.g. for CI')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to each HTTP request (default: 0)')
+    parser.add_argument('--json', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Results of a previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.5,
+                        help='Fraction of the baseline throughput which may be lost (default: 0.5)')
+    parser.add_argument('--check', choices=['all', 'requests', 'throughput'], default='all',
+                        help='Regressions failing the run; the others are printed as warnings (default: all)')
+    args = parser.parse_args(argv)
+
+    results = run(SIZES['quick' if args.quick else 'full'], args.latency)
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        failed = False
+        for check, found, line in (
+                ('requests', request_regressions(results, baseline), '{} {} requests, baseline {} requests'),
+                ('throughput', regressions(results, baseline, args.tolerance),
+                 '{} {:.0f} items/s, baseline {:.0f} items/s')):
+            fatal = args.check in ('all', check)
+            for r in found:
+                print(('REGRESSION: ' if fatal else 'WARNING: ') + line.format(*r))
+            failed = failed or (fatal and bool(found))
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Benchmark the per-call overhead of building API services in GGroupsAndSettings.
+
+Usage: python benchmarks/bench_services.py [NUMBER_OF_CALLS]
+"""
+from __future__ import print_function
+import sys
+import timeit
+
+import httplib2
+from apiclient import discovery
+
+from gsuite_utils.services import ServiceRegistry
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    http = httplib2.Http()
+    registry = ServiceRegistry(http)
+
+    def rebuild():
+        # what `_members_service()` did before the registry: one discovery.build per call
+        return discovery.build('admin', 'directory_v1', http=http).members()
+
+    def cached():
+        return registry.collection('admin', 'directory_v1', 'members')
+
+    for name, func in (('discovery.build per call', rebuild), ('ServiceRegistry', cached)):
+        secs = timeit.timeit(func, number=number)
+        print('{:<26} {:>10.1f} us/call'.format(name, secs / number * 1e6))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""
+Benchmark memory and time to convert and aggregate a year of calendar events for hundreds of users,
+as a list of per-event objects vs a gsuite_utils.timeentries.TimeEntryTable; and the time to match distinct
+summaries against the task rules, with the rules combined into one regular expression vs TaskRules.
+
+Usage: python benchmarks/bench_time_entries.py [NUMBER_OF_USERS] [EVENTS_PER_DAY]
+"""
+from __future__ import print_function
+import random
+import re
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from gsuite_utils.timeentries import TaskRules, TimeEntryTable
+from gsuite_utils.timeparse import parse_event_time
+
+SUMMARIES = ['Daily standup', 'Sprint planning', 'Interview - backend', '1:1', 'Lunch', 'Customer call',
+             'Architecture review', 'All hands meeting']
+
+RULES = [
+    ('standup|planning|review', 'T-100'),
+    ('interview', 'T-200'),
+    ('customer', 'T-300'),
+]
+
+
+class LegacyTimeEntry(object):
+    """One object per event, as the TimeEntryData list built by retrieve_gcalendar_event_data"""
+
+    def __init__(self, year, month, day, interval, comment, taskid, person):
+        self.year = year
+        self.month = month
+        self.day = day
+        self.interval = interval
+        self.comment = comment
+        self.taskid = taskid
+        self.person = person
+
+
+def synthetic_events(users, per_day):
+    rnd = random.Random(0)
+    start = datetime(2020, 1, 1)
+    for u in range(users):
+        person = 'user{}@example.com'.format(u)
+        events = []
+        for d in range(365):
+            day = start + timedelta(days=d)
+            if day.weekday() >= 5:
+                continue
+            for _ in range(per_day):
+                begin = day + timedelta(hours=rnd.randrange(8, 17), minutes=rnd.choice((0, 30)))
+                end = begin + timedelta(minutes=rnd.choice((15, 30, 60)))
+                events.append({
+                    'summary': rnd.choice(SUMMARIES),
+                    'start': {'dateTime': begin.strftime('%Y-%m-%dT%H:%M:%S') + '+10:00'},
+                    'end': {'dateTime': end.strftime('%Y-%m-%dT%H:%M:%S') + '+10:00'},
+                })
+        yield person, events
+
+
+def legacy(events_by_person):
+    entries = []
+    for person, events in events_by_person:
+        for event in events:
+            start = parse_event_time(event['start']['dateTime'])
+            end = parse_event_time(event['end']['dateTime'])
+            secs = int((end - start).total_seconds())
+            taskid = 'T-0'
+            for word, t in (('standup', 'T-100'), ('planning', 'T-100'), ('review', 'T-100'),
+                            ('interview', 'T-200'), ('customer', 'T-300')):
+                if word in event['summary'].lower():
+                    taskid = t
+                    break
+            entries.append(LegacyTimeEntry(start.year, start.month, start.day, secs, event['summary'], taskid, person))
+    totals = {}
+    for e in entries:
+        key = (e.year, e.month, e.day, e.person, e.taskid)
+        totals[key] = totals.get(key, 0) + e.interval
+    return entries, totals
+
+
+def columnar(events_by_person):
+    rules = TaskRules(RULES, default_taskid='T-0')
+    table = TimeEntryTable()
+    for person, events in events_by_person:
+        table.add_events(person, events, rules)
+    return table, table.aggregate()
+
+
+def combined_regex(rules):
+    """Rules compiled into a single expression, each alternative prefixed with .*? to keep the table order"""
+    taskids = {'r{}'.format(i): taskid for i, (_, taskid) in enumerate(rules)}
+    regex = re.compile('(?:{})'.format('|'.join(
+        '.*?(?P<r{}>{})'.format(i, pattern) for i, (pattern, _) in enumerate(rules))), re.DOTALL | re.IGNORECASE)
+
+    def match(summary):
+        m = regex.match(summary)
+        return taskids[m.lastgroup] if m else 'T-0'
+    return match
+
+
+def bench_rules(count):
+    """Match distinct summaries, so the TaskRules cache does not help"""
+    rules = RULES + [(r'\bproject-{}\b'.format(i), 'T-{}'.format(1000 + i)) for i in range(50)]
+    rnd = random.Random(0)
+    summaries = ['{} #{}'.format(rnd.choice(SUMMARIES + ['Work on project-{}'.format(rnd.randrange(60))]), i)
+                 for i in range(count)]
+    print('{} distinct summaries, {} rules'.format(count, len(rules)))
+    results = []
+    for name, match in (('combined regex', combined_regex(rules)),
+                        ('TaskRules', TaskRules(rules, default_taskid='T-0').match)):
+        t = time.time()
+        results.append([match(summary) for summary in summaries])
+        print('{:<16} {:>6.2f} s'.format(name, time.time() - t))
+    assert results[0] == results[1]
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    per_day = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    events_by_person = list(synthetic_events(users, per_day))
+    count = sum(len(events) for _, events in events_by_person)
+    print('{} users, {} events'.format(users, count))
+
+    for name, func in (('list of objects', legacy), ('TimeEntryTable', columnar)):
+        parse_event_time.cache_clear()
+        t = time.time()
+        entries, totals = func(events_by_person)
+        secs = time.time() - t
+        del entries, totals
+
+        # measured in a second run, as tracing allocations slows it down
+        parse_event_time.cache_clear()
+        tracemalloc.start()
+        entries, totals = func(events_by_person)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('{:<16} {:>6.2f} s {:>8.1f} MB retained, {} groups'.format(name, secs, size / 1e6, len(totals)))
+        del entries, totals
+
+    bench_rules(100000)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+from __future__ import print_function
+import itertools
+import sqlite3
+import threading
+
+from gsuite_utils.gdrive import EXPORT_FIELDS, EXPORT_PARAMETERS, flatten_activity
+
+# Sharing parameters of drive events stored with the exported columns, for the queries of shares
+SHARE_PARAMETERS = ('visibility', 'visibility_change', 'target_user')
+
+# Columns of a stored drive event
+STORE_FIELDS = EXPORT_FIELDS + list(SHARE_PARAMETERS)
+
+# Number of events inserted per transaction
+INSERT_BATCH_SIZE = 50000
+
+
+class DriveActivityStore(object):
+    """Indexed local copy of flattened drive events, in SQLite.
+
+    Events are indexed by actor, document, owner and time, and counted per actor, day and event name as they
+    are inserted, so the per-actor counts do not scan the events. Events already stored are ignored, so
+    overlapping exports can be loaded again.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: SQLite database file; ':memory:' for a store of the process only
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS activities (time TEXT NOT NULL, unique_id TEXT NOT NULL,'
+                ' event_index INTEGER NOT NULL, actor TEXT, event TEXT, doc_id TEXT, doc_title TEXT, doc_type TEXT,'
+                ' owner TEXT, primary_event INTEGER, visibility TEXT, visibility_change TEXT, target_user TEXT)')
+            self._db.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS activities_key ON activities (time, unique_id, event_index)')
+            for column in ('actor', 'doc_id', 'owner'):
+                self._db.execute('CREATE INDEX IF NOT EXISTS activities_{0} ON activities ({0}, time)'.format(column))
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS actor_counts (actor TEXT NOT NULL, day TEXT NOT NULL, event TEXT NOT NULL,'
+                ' count INTEGER NOT NULL, PRIMARY KEY (day, actor, event))')
+            # events of the batch being inserted
+            self._db.execute(
+                'CREATE TEMP TABLE stage (time TEXT NOT NULL, unique_id TEXT NOT NULL, event_index INTEGER NOT NULL,'
+                ' {}, PRIMARY KEY (time, unique_id, event_index))'.format(', '.join(STORE_FIELDS[2:])))
+
+    def add_activities(self, activities, batch_size=INSERT_BATCH_SIZE):
+        """Store the events of the activities, `batch_size` events per transaction.
+        :param activities: iterable of activities, e.g. from `iter_gdrive_activities`
+        :return: number of events stored; the ones already stored are not counted
+        """
+        rows = self._rows(activities)
+        inserted = 0
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                return inserted
+            with self._lock, self._db:
+                inserted += self._insert(batch)
+
+    def _insert(self, batch):
+        """Insert the new events of the batch and add them to the per-actor counts, in the current transaction
+        :return: number of new events
+        """
+        self._db.executemany('INSERT OR IGNORE INTO stage VALUES ({})'.format(
+            ', '.join('?' * (len(STORE_FIELDS) + 1))), batch)
+        self._db.execute(
+            'DELETE FROM stage WHERE EXISTS (SELECT 1 FROM activities a WHERE a.time = stage.time'
+            ' AND a.unique_id = stage.unique_id AND a.event_index = stage.event_index)')
+        self._db.execute(
+            'INSERT OR REPLACE INTO actor_counts (actor, day, event, count)'
+            ' SELECT s.actor, s.day, s.event, s.count + COALESCE(c.count, 0) FROM ('
+            '  SELECT COALESCE(actor, \'\') AS actor, substr(time, 1, 10) AS day, COALESCE(event, \'\') AS event,'
+            '  COUNT(*) AS count FROM stage GROUP BY 1, 2, 3) s'
+            ' LEFT JOIN actor_counts c ON c.day = s.day AND c.actor = s.actor AND c.event = s.event')
+        inserted = self._db.execute('INSERT INTO activities SELECT * FROM stage').rowcount
+        self._db.execute('DELETE FROM stage')
+        return inserted
+
+    @staticmethod
+    def _rows(activities):
+        parameters = EXPORT_PARAMETERS | frozenset(SHARE_PARAMETERS)
+        for activity in activities:
+            for i, row in enumerate(flatten_activity(activity, parameters)):
+                if row['primary_event'] is not None:
+                    row['primary_event'] = int(row['primary_event'] in (True, 'true'))
+                yield (row['time'], row['unique_id'] or '', i) + tuple(row[k] for k in STORE_FIELDS[2:])
+
+    def events(self, actor=None, doc_id=None, owner=None, event=None, start_time=None, end_time=None,
+               limit=None):
+        """
+        :param start_time: RFC3339 timestamp; events at or after it
+        :param end_time: RFC3339 timestamp; events before it
+        :param limit: optional maximum number of events
+        :return: list of events in `dict` of STORE_FIELDS, newest first, in the order of their activity
+        """
+        return self._query(
+            {'actor': actor, 'doc_id': doc_id, 'owner': owner, 'event': event}, start_time, end_time, limit=limit)
+
+    def external_shares(self, owner=None, start_time=None, end_time=None):
+        """
+        :param owner: optional email address of the owner of the documents
+        :return: list of the events making documents visible outside of the domain, newest first
+        """
+        return self._query({'owner': owner, 'visibility_change': 'external'}, start_time, end_time)
+
+    def _query(self, filters, start_time=None, end_time=None, limit=None):
+        conditions, args = [], []
+        for column, value in filters.items():
+            if value is not None:
+                conditions.append('{} = ?'.format(column))
+                args.append(value)
+        if start_time:
+            conditions.append('time >= ?')
+            args.append(start_time)
+        if end_time:
+            conditions.append('time < ?')
+            args.append(end_time)
+        query = 'SELECT {} FROM activities'.format(', '.join(STORE_FIELDS))
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY time DESC, event_index'
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, args).fetchall()
+        return [dict(zip(STORE_FIELDS, row)) for row in rows]
+
+    def actor_counts(self, start_date=None, end_date=None, event=None):
+        """
+        :param start_date: 'YYYY-MM-DD'; events on or after this day (UTC)
+        :param end_date: 'YYYY-MM-DD'; events before this day (UTC)
+        :param event: optional event name, e.g. 'download'
+        :return: `dict` of {actor: number of events}
+        """
+        conditions, args = ['day >= ?', 'day < ?'], [start_date or '', end_date or '9999']
+        if event is not None:
+            conditions.append('event = ?')
+            args.append(event)
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT actor, SUM(count) FROM actor_counts WHERE {} GROUP BY actor'.format(' AND '.join(conditions)),
+                args).fetchall()
+        return {actor or None: count for actor, count in rows}
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM activities').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
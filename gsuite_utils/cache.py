@@ -0,0 +1,89 @@
+from __future__ import print_function
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# Cached payload of a group, its settings or its members
+CacheEntry = namedtuple('CacheEntry', ['payload', 'etag', 'fresh'])
+
+
+class StateCache(object):
+    """On-disk cache of group state, keyed by (kind, group email address).
+
+    Entries younger than `ttl` seconds are used without any request. Older entries are revalidated
+    with `If-None-Match` using their etag, and entries older than `max_age` seconds are evicted.
+    """
+
+    def __init__(self, path, ttl=3600, max_age=7 * 24 * 3600, clock=time.time):
+        """
+        :param path: SQLite database file; ':memory:' for a cache of the process only
+        :param ttl: seconds during which an entry is used without revalidation
+        :param max_age: seconds after which an entry is evicted
+        """
+        self.ttl = ttl
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                ' kind TEXT NOT NULL, group_email TEXT NOT NULL, etag TEXT, fetched_at REAL NOT NULL,'
+                ' payload TEXT NOT NULL, PRIMARY KEY (kind, group_email))')
+        self.evict()
+
+    def get(self, kind, group_email_address):
+        """
+        :param kind: 'group', 'settings' or 'members'
+        :param group_email_address: email address of the group
+        :return: `CacheEntry`; None if not cached or evicted
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT payload, etag, fetched_at FROM state WHERE kind = ? AND group_email = ?',
+                (kind, group_email_address.lower())).fetchone()
+        if row is None:
+            return None
+        age = self._clock() - row[2]
+        if age > self.max_age:
+            return None
+        return CacheEntry(json.loads(row[0]), row[1], age <= self.ttl)
+
+    def put(self, kind, group_email_address, payload, etag=None):
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO state (kind, group_email, etag, fetched_at, payload) VALUES (?, ?, ?, ?, ?)',
+                (kind, group_email_address.lower(), etag, self._clock(), json.dumps(payload)))
+
+    def touch(self, kind, group_email_address):
+        """Mark an entry as fresh again, e.g. after a `304 Not Modified`
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE state SET fetched_at = ? WHERE kind = ? AND group_email = ?',
+                (self._clock(), kind, group_email_address.lower()))
+
+    def invalidate(self, group_email_address, *kinds):
+        """
+        :param group_email_address: email address of the group
+        :param kinds: kinds of entries to drop; all the entries of the group if none given
+        """
+        with self._lock, self._db:
+            if not kinds:
+                self._db.execute('DELETE FROM state WHERE group_email = ?', (group_email_address.lower(),))
+            for kind in kinds:
+                self._db.execute(
+                    'DELETE FROM state WHERE group_email = ? AND (kind = ? OR kind LIKE ?)',
+                    (group_email_address.lower(), kind, kind + ':%'))
+
+    def evict(self):
+        """Drop the entries older than `max_age`
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM state WHERE fetched_at < ?', (self._clock() - self.max_age,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,90 @@
+from __future__ import print_function
+import json
+import sqlite3
+import threading
+from datetime import timezone
+
+from gsuite_utils.timeparse import parse_event_time
+
+
+def event_start_key(event):
+    """
+    :param event: event of the Calendar API
+    :return: start of the event as 'YYYY-MM-DDTHH:MM:SS' in UTC, comparable as a string;
+        all-day events start at midnight UTC of their date.
+    """
+    start = event.get('start', {})
+    if 'dateTime' in start:
+        dt = parse_event_time(start['dateTime'])
+        if dt.tzinfo is not None:
+            dt = dt.astimezone(timezone.utc)
+        return dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return start.get('date', '') + 'T00:00:00'
+
+
+class CalendarEventStore(object):
+    """Local copy of calendar events and the sync token of each calendar, in SQLite."""
+
+    def __init__(self, path):
+        """
+        :param path: SQLite database file; ':memory:' for a store of the process only
+        """
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS sync_tokens (calendar_id TEXT PRIMARY KEY, token TEXT NOT NULL)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS events (calendar_id TEXT NOT NULL, event_id TEXT NOT NULL,'
+                ' start TEXT NOT NULL, payload TEXT NOT NULL, PRIMARY KEY (calendar_id, event_id))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS events_start ON events (calendar_id, start)')
+
+    def get_sync_token(self, calendar_id):
+        with self._lock:
+            row = self._db.execute(
+                'SELECT token FROM sync_tokens WHERE calendar_id = ?', (calendar_id,)).fetchone()
+        return row[0] if row else None
+
+    def apply_changes(self, calendar_id, events, sync_token=None):
+        """Store changed events and remove cancelled ones in one transaction.
+        :param calendar_id: ID of the calendar
+        :param events: list of events returned by events().list
+        :param sync_token: optional nextSyncToken to be saved with the changes
+        """
+        with self._lock, self._db:
+            for event in events:
+                if event.get('status') == 'cancelled':
+                    self._db.execute(
+                        'DELETE FROM events WHERE calendar_id = ? AND event_id = ?', (calendar_id, event['id']))
+                else:
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO events (calendar_id, event_id, start, payload) VALUES (?, ?, ?, ?)',
+                        (calendar_id, event['id'], event_start_key(event), json.dumps(event)))
+            if sync_token is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO sync_tokens (calendar_id, token) VALUES (?, ?)', (calendar_id, sync_token))
+
+    def clear(self, calendar_id):
+        """Drop the events and the sync token of a calendar, e.g. when the sync token expired
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM events WHERE calendar_id = ?', (calendar_id,))
+            self._db.execute('DELETE FROM sync_tokens WHERE calendar_id = ?', (calendar_id,))
+
+    def events(self, calendar_id, start_date, end_date):
+        """
+        :param calendar_id: ID of the calendar
+        :param start_date: naive `datetime` in UTC; events starting at or after it
+        :param end_date: naive `datetime` in UTC; events starting before it
+        :return: list of events ordered by start time
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT payload FROM events WHERE calendar_id = ? AND start >= ? AND start < ? ORDER BY start',
+                (calendar_id, start_date.strftime('%Y-%m-%dT%H:%M:%S'), end_date.strftime('%Y-%m-%dT%H:%M:%S'))
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,9 +1,23 @@
 from __future__ import print_function
+import httplib2
 import os
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
 
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
+from oauth2client.service_account import ServiceAccountCredentials
+
+# Access tokens expiring within this margin are refreshed before being used
+EXPIRY_MARGIN = timedelta(seconds=60)
+
+# Access tokens expiring within this margin are refreshed by the background refresher
+REFRESH_AHEAD = timedelta(minutes=5)
+
+# Seconds between two checks of the background refresher
+REFRESH_INTERVAL = 30
 
 
 def get_credentials(local_credential_file, client_secret_file, scopes, application_name):
@@ -30,3 +44,176 @@ def get_credentials(local_credential_file, client_secret_file, scopes, applicati
         credentials = tools.run_flow(flow, store)
         print('Storing credentials to ' + credential_path)
     return credentials
+
+
+def get_service_account_credentials(service_account_file, scopes, subject=None):
+    """Gets service account credentials, without any user interaction.
+
+    :param service_account_file: JSON key file of the service account
+    :param scopes: scope or list of scopes
+    :param subject: optional email address of the user to impersonate with domain-wide delegation
+    :return: ServiceAccountCredentials
+    """
+    credentials = ServiceAccountCredentials.from_json_keyfile_name(service_account_file, scopes)
+    return credentials.create_delegated(subject) if subject else credentials
+
+
+def _utcnow():
+    # oauth2client keeps token_expiry as a naive datetime in UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CredentialManager(object):
+    """Loads each credential once per process and hands out authorized http objects.
+
+    httplib2.Http is not thread-safe, so each thread gets its own authorized http object per credential,
+    kept for the life of the thread to reuse its keep-alive connections. All the threads share the same
+    credentials, and an access token about to expire is refreshed by one thread while the others wait for it.
+    Service account credentials are kept per impersonated subject, so many subjects can be used at once.
+    """
+
+    def __init__(self, http_factory=httplib2.Http, clock=_utcnow):
+        """
+        :param http_factory: function returning a new unauthorized http object
+        :param clock: function returning the current naive `datetime` in UTC
+        """
+        self._http_factory = http_factory
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._credentials = {}
+        self._refresh_locks = {}
+        self._local = threading.local()
+        self._refresher = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _scopes_key(scopes):
+        return scopes if isinstance(scopes, str) else tuple(scopes)
+
+    def _load(self, key, load):
+        with self._lock:
+            credentials = self._credentials.get(key)
+            if credentials is None:
+                credentials = self._credentials[key] = load()
+                self._refresh_locks[key] = threading.Lock()
+        return credentials
+
+    def _http(self, key, credentials):
+        pool = getattr(self._local, 'pool', None)
+        if pool is None:
+            pool = self._local.pool = {}
+        http = pool.get(key)
+        if http is None:
+            http = pool[key] = credentials.authorize(self._http_factory())
+        self._refresh(key, credentials, EXPIRY_MARGIN)
+        return http
+
+    def credentials(self, local_credential_file, client_secret_file, scopes, application_name):
+        """
+        Same as `get_credentials`, but the credential file is read once per process.
+        :return: Credentials, the obtained credential
+        """
+        key = ('user', local_credential_file, client_secret_file, self._scopes_key(scopes))
+        return self._load(key, lambda: get_credentials(
+            local_credential_file, client_secret_file, scopes, application_name))
+
+    def http(self, local_credential_file, client_secret_file, scopes, application_name):
+        """
+        :return: authorized httplib2.Http of the current thread, with a valid access token
+        """
+        key = ('user', local_credential_file, client_secret_file, self._scopes_key(scopes))
+        return self._http(key, self.credentials(local_credential_file, client_secret_file, scopes, application_name))
+
+    def service_account_credentials(self, service_account_file, scopes, subject=None):
+        """
+        Same as `get_service_account_credentials`, but the key file is read once per process and the
+        credentials of each subject are created once.
+        :return: ServiceAccountCredentials
+        """
+        scopes_key = self._scopes_key(scopes)
+        base = self._load(('service_account', service_account_file, scopes_key, None),
+                          lambda: get_service_account_credentials(service_account_file, scopes))
+        if not subject:
+            return base
+        return self._load(('service_account', service_account_file, scopes_key, subject),
+                          lambda: base.create_delegated(subject))
+
+    def service_account_http(self, service_account_file, scopes, subject=None):
+        """
+        :param service_account_file: JSON key file of the service account
+        :param scopes: scope or list of scopes
+        :param subject: optional email address of the user to impersonate with domain-wide delegation
+        :return: authorized httplib2.Http of the current thread, with a valid access token
+        """
+        key = ('service_account', service_account_file, self._scopes_key(scopes), subject or None)
+        return self._http(key, self.service_account_credentials(service_account_file, scopes, subject))
+
+    def _needs_refresh(self, credentials, margin):
+        if not credentials.access_token:
+            return True
+        expiry = credentials.token_expiry
+        return expiry is not None and expiry - margin <= self._clock()
+
+    def _refresh(self, key, credentials, margin):
+        if not self._needs_refresh(credentials, margin):
+            return
+        with self._refresh_locks[key]:
+            # another thread may have refreshed it while this one was waiting
+            if self._needs_refresh(credentials, margin):
+                # an unauthorized http object, so the expired token is not sent to the token endpoint
+                credentials.refresh(self._http_factory())
+
+    def refresh_expiring(self, margin=REFRESH_AHEAD):
+        """Refresh the access tokens in use expiring within margin
+        :param margin: `timedelta`
+        :return: number of refreshed credentials
+        """
+        with self._lock:
+            items = [(k, c) for k, c in self._credentials.items() if c.access_token]
+        refreshed = 0
+        for key, credentials in items:
+            if not self._needs_refresh(credentials, margin):
+                continue
+            try:
+                self._refresh(key, credentials, margin)
+                refreshed += 1
+            except Exception as e:
+                # the next request with these credentials refreshes them again, and reports the error
+                print('Error: unable to refresh the access token of {}: {}'.format(key[1], e), file=sys.stderr)
+        return refreshed
+
+    def start_refresher(self, interval=REFRESH_INTERVAL, margin=REFRESH_AHEAD):
+        """Refresh in a daemon thread the access tokens in use before they expire, so the workers never wait for it
+        :param interval: seconds between two checks
+        :param margin: `timedelta`; tokens expiring within it are refreshed
+        """
+        with self._lock:
+            if self._refresher is not None:
+                return
+            self._stop.clear()
+            self._refresher = threading.Thread(target=self._refresh_loop, args=(interval, margin))
+            self._refresher.daemon = True
+            self._refresher.start()
+
+    def stop_refresher(self):
+        with self._lock:
+            refresher, self._refresher = self._refresher, None
+        if refresher is not None:
+            self._stop.set()
+            refresher.join()
+
+    def _refresh_loop(self, interval, margin):
+        while not self._stop.wait(interval):
+            self.refresh_expiring(margin)
+
+    def clear(self):
+        """Forget the loaded credentials and the http objects authorized with them, e.g. after they were revoked
+        """
+        with self._lock:
+            self._credentials.clear()
+            self._refresh_locks.clear()
+        self._local = threading.local()
+
+
+# Shared by all the helpers in the process
+default_manager = CredentialManager()
@@ -1,95 +1,218 @@
 from __future__ import print_function
 
-import httplib2
+import threading
 from apiclient import discovery
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from gsuite_tools import (
-    EXPECTED_DATETIME_FORMATS,
     TimeEntryData,
     worklog_time_spent
 )
-from credentials import get_credentials
+from gsuite_utils.credentials import default_manager
+from gsuite_utils.retry import RetryPolicy, http_status
+from gsuite_utils.timeentries import TaskRules, TimeEntryTable
+from gsuite_utils.timeparse import parse_event_time
+
+SCOPES = 'https://www.googleapis.com/auth/calendar.readonly'
+
+# Maximum maxResults of events().list
+EVENTS_PAGE_SIZE = 2500
+
+# Default maximum number of calendars fetched in parallel
+DEFAULT_MAX_WORKERS = 8
 
 
 class GCalendar(object):
-    def __init__(self, credentials, client_secret):
+    def __init__(self, credentials, client_secret, service_account_file=None, subject=None):
+        """
+        :param credentials: file name of the stored credentials in ~/.credentials
+        :param client_secret: OAuth client secret file
+        :param service_account_file: optional JSON key file of a service account to use instead of
+            the OAuth client, e.g. for unattended workers
+        :param subject: email address of the user impersonated by the service account
+        """
         self.credentials = credentials
         self.client_secret = client_secret
+        self.service_account_file = service_account_file
+        self.subject = subject
         self.gcalender = self.authorize_gcalender()
+        # Calendar API quota is not the Admin SDK one, so no shared rate limiter here
+        self.retry_policy = RetryPolicy()
+        self._owner_thread = threading.current_thread()
+        self._local = threading.local()
 
     def authorize_gcalender(self):
         """
         Creates a Google Calendar API service object
         :return: a Google Calendar API service object
         """
-        credentials = get_credentials(
-            self.credentials,
-            self.client_secret,
-            'https://www.googleapis.com/auth/calendar.readonly',
-            'G Suite Utilities'
-        )
-        http = credentials.authorize(httplib2.Http())
+        if self.service_account_file:
+            http = default_manager.service_account_http(self.service_account_file, SCOPES, self.subject)
+        else:
+            http = default_manager.http(
+                self.credentials,
+                self.client_secret,
+                SCOPES,
+                'G Suite Utilities'
+            )
         return discovery.build('calendar', 'v3', http=http)
 
-    def gcalendar_events(self, start_date, end_date):
+    def gcalendar_events(self, start_date, end_date, calendar_id='primary'):
         """
-        Outputs a list of the next 'max_results' events on the user's calendar.
-        :param service: a Google Calendar API service object
+        Outputs a list of the events on the user's calendar between start_date and end_date.
+        :param start_date: naive `datetime` in UTC
+        :param end_date: naive `datetime` in UTC
+        :param calendar_id: ID of the calendar
         :return: a list
         """
         min_time = start_date.isoformat() + 'Z' # 'Z' indicates UTC time
         max_time = end_date.isoformat() + 'Z'
-        eventsResult = self.gcalender.events().list(
-            calendarId='primary',
+        events = self._calendar_service().events()
+        request = events.list(
+            calendarId=calendar_id,
             timeMin=min_time,
             timeMax=max_time,
             singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+            orderBy='startTime',
+            maxResults=EVENTS_PAGE_SIZE
+        )
+        items = []
+        while request is not None:
+            eventsResult = self.retry_policy.execute(request)
+            items.extend(eventsResult.get('items', []))
+            request = events.list_next(request, eventsResult)
+        return items
+
+    def gcalendar_events_by_calendar(self, start_date, end_date, calendar_ids, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param calendar_ids: list of calendar IDs, e.g. email addresses of the team
+        :param max_workers: maximum number of calendars fetched in parallel
+        :return: `dict` of {calendar_id: list of events}
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {c: executor.submit(self.gcalendar_events, start_date, end_date, c) for c in calendar_ids}
+        return {c: f.result() for c, f in futures.items()}
+
+    def sync_gcalendar_events(self, calendar_id, store):
+        """
+        Downloads only the events changed since the last sync of the calendar into the local store.
+        The first sync, or a sync after the token expired, downloads all the events.
+        :param calendar_id: ID of the calendar
+        :param store: `CalendarEventStore`
+        :return: number of changed events
+        """
+        sync_token = store.get_sync_token(calendar_id)
+        try:
+            return self._sync_gcalendar_events(calendar_id, store, sync_token)
+        except Exception as e:
+            # 410 Gone: the sync token is no longer valid, a full sync is required
+            if sync_token is None or http_status(e) != 410:
+                raise
+        store.clear(calendar_id)
+        return self._sync_gcalendar_events(calendar_id, store, None)
+
+    def _sync_gcalendar_events(self, calendar_id, store, sync_token):
+        events = self._calendar_service().events()
+        request = events.list(
+            calendarId=calendar_id,
+            singleEvents=True,
+            maxResults=EVENTS_PAGE_SIZE,
+            syncToken=sync_token
+        )
+        changed = 0
+        while request is not None:
+            eventsResult = self.retry_policy.execute(request)
+            items = eventsResult.get('items', [])
+            # the sync token comes with the last page, so it is saved only once all changes are stored
+            store.apply_changes(calendar_id, items, eventsResult.get('nextSyncToken'))
+            changed += len(items)
+            request = events.list_next(request, eventsResult)
+        return changed
 
-        return eventsResult.get('items', [])
+    def sync_gcalendar_events_by_calendar(self, calendar_ids, store, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param calendar_ids: list of calendar IDs, e.g. email addresses of the team
+        :param store: `CalendarEventStore`
+        :param max_workers: maximum number of calendars synced in parallel
+        :return: `dict` of {calendar_id: number of changed events}
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {c: executor.submit(self.sync_gcalendar_events, c, store) for c in calendar_ids}
+        return {c: f.result() for c, f in futures.items()}
 
-    def retrieve_gcalendar_event_data(self, start_date, end_date, tasks_info):
+    def retrieve_gcalendar_event_data(self, start_date, end_date, tasks_info, calendar_ids=None, store=None,
+                                      task_rules=None):
         """
         Retrieve calendar events' data in TimeEntryData format
+        :param calendar_ids: optional list of calendar IDs; the primary calendar if None
+        :param store: optional `CalendarEventStore`; if given only the changed events are downloaded
+        :param task_rules: optional `TaskRules` mapping the event summaries to task IDs;
+            all events go to tasks_info['InternalMeeting'] if None
         :return: list of TimeEntryData
         """
         print('Retrieving Google Calendar events ...')
-        time_entry_data_list = []
-
-        # see https://developers.google.com/google-apps/calendar/v3/reference/events/list
-        for event in self.gcalendar_events(start_date, end_date):
-            start_time_str = event['start'].get('dateTime', event['start'].get('date'))
-            end_time_str = event['end'].get('dateTime', event['end'].get('date'))
-
-            (interval, start, end) = self.calc_interval(start_time_str, end_time_str)
+        if task_rules is None:
+            task_rules = TaskRules([], default_taskid=tasks_info['InternalMeeting'])
+        table = self.retrieve_gcalendar_event_table(
+            start_date, end_date, task_rules, calendar_ids=calendar_ids, store=store, keep_comments=True)
 
-            time_entry_data_list.append(TimeEntryData(
-                year=start.year,
-                month=start.month,
-                day=start.day,
-                interval=interval,
-                comment=event['summary'],
-                taskid=tasks_info['InternalMeeting']
-            ))
+        time_entry_data_list = [TimeEntryData(
+            year=entry.day.year,
+            month=entry.day.month,
+            day=entry.day.day,
+            interval=worklog_time_spent(entry.seconds),
+            comment=entry.comment,
+            taskid=entry.taskid
+        ) for entry in table.rows()]
 
         print('{} event found'.format(len(time_entry_data_list)))
         return time_entry_data_list
 
+    def retrieve_gcalendar_event_table(self, start_date, end_date, task_rules, calendar_ids=None, store=None,
+                                       keep_comments=False):
+        """
+        Retrieve calendar events' data as a `TimeEntryTable`, one person per calendar, e.g. for aggregating
+        the events of a whole organisation with `TimeEntryTable.aggregate`
+        :param task_rules: `TaskRules` mapping the event summaries to task IDs
+        :param calendar_ids: optional list of calendar IDs; the primary calendar if None
+        :param store: optional `CalendarEventStore`; if given only the changed events are downloaded
+        :param keep_comments: keep the summary of each event
+        :return: `TimeEntryTable`
+        """
+        calendar_ids = calendar_ids or ['primary']
+
+        if store is not None:
+            self.sync_gcalendar_events_by_calendar(calendar_ids, store)
+            events_by_calendar = {c: store.events(c, start_date, end_date) for c in calendar_ids}
+        else:
+            events_by_calendar = self.gcalendar_events_by_calendar(start_date, end_date, calendar_ids)
+
+        # see https://developers.google.com/google-apps/calendar/v3/reference/events/list
+        table = TimeEntryTable(keep_comments=keep_comments)
+        for c in calendar_ids:
+            table.add_events(c, events_by_calendar[c], task_rules)
+        return table
+
+    def _calendar_service(self):
+        """Return the service of the current thread, as httplib2.Http is not thread-safe
+        """
+        if threading.current_thread() is self._owner_thread:
+            return self.gcalender
+        if getattr(self._local, 'gcalender', None) is None:
+            self._local.gcalender = self.authorize_gcalender()
+        return self._local.gcalender
+
     def calc_interval(self, start_time, end_time):
         """
-        :param start_time: start time in datetime
-        :param end_time: end time in datetime
-        :return: string hh:mm
-        """
-        for f in EXPECTED_DATETIME_FORMATS:
-            try:
-                end_dt = datetime.strptime(end_time, f)
-                start_dt = datetime.strptime(start_time, f)
-                t_delta_secs = (end_dt - start_dt).seconds
-                return (worklog_time_spent(t_delta_secs), start_dt, end_dt)
-            except Exception as e:
-                pass
-        print('Error: unable to parse {} and {}'.format(start_time, end_time))
-        return None
+        :param start_time: start time string, RFC3339 or 'YYYY-MM-DD' for all-day events
+        :param end_time: end time string, RFC3339 or 'YYYY-MM-DD' for all-day events
+        :return: (string hh:mm, start datetime, end datetime); None if unable to parse
+        """
+        try:
+            start_dt = parse_event_time(start_time)
+            end_dt = parse_event_time(end_time)
+        except ValueError:
+            print('Error: unable to parse {} and {}'.format(start_time, end_time))
+            return None
+        t_delta_secs = int((end_dt - start_dt).total_seconds())
+        return (worklog_time_spent(t_delta_secs), start_dt, end_dt)
@@ -1,8 +1,19 @@
 from __future__ import print_function
-import httplib2
+import argparse
+import csv
+import functools
+import json
+import itertools
+import os
+import shutil
 import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from apiclient import discovery
-from gsuite_utils.credentials import get_credentials
+from gsuite_utils.credentials import default_manager
+from gsuite_utils.retry import default_policy
 
 # If modifying these scopes, delete your previously saved credentials
 # at ~/.credentials/gsuite_utilities_gdrive.json
@@ -11,27 +22,54 @@ SCOPES = 'https://www.googleapis.com/auth/admin.reports.audit.readonly'
 CLIENT_SECRET_FILE = 'client_secret_gsuite_utilities.json'
 APPLICATION_NAME = 'G Suite Utilities'
 
+# Maximum maxResults of activities().list
+ACTIVITIES_PAGE_SIZE = 1000
 
-def gdrive_service():
+# Columns of an exported drive event
+EXPORT_FIELDS = [
+    'time', 'unique_id', 'actor', 'event', 'doc_id', 'doc_title', 'doc_type', 'owner', 'primary_event',
+]
+
+# Default size of the time windows fetched in parallel
+DEFAULT_WINDOW = timedelta(hours=1)
+
+# Default number of time windows fetched in parallel
+DEFAULT_MAX_WORKERS = 8
+
+# Events this much older than the last seen one are requested again by incremental syncs,
+# as the Reports API may make events available with some lag
+DEFAULT_OVERLAP = timedelta(minutes=10)
+
+# Event parameters copied to the exported columns
+EXPORT_PARAMETERS = frozenset(['doc_id', 'doc_title', 'doc_type', 'owner', 'primary_event'])
+
+
+def gdrive_service(service_account_file=None, subject=None):
     """
     Creates a Google Admin SDK Reports API service object
+    :param service_account_file: optional JSON key file of a service account to use instead of
+        the OAuth client, e.g. for unattended workers
+    :param subject: email address of the admin user impersonated by the service account
     :return: a Google Admin SDK Reports API service object
     """
-    credentials = get_credentials(
-        LOCAL_CREDENTIAL_FILE,
-        CLIENT_SECRET_FILE,
-        SCOPES,
-        APPLICATION_NAME
-    )
-    http = credentials.authorize(httplib2.Http())
+    if service_account_file:
+        http = default_manager.service_account_http(service_account_file, SCOPES, subject)
+    else:
+        http = default_manager.http(
+            LOCAL_CREDENTIAL_FILE,
+            CLIENT_SECRET_FILE,
+            SCOPES,
+            APPLICATION_NAME
+        )
     return discovery.build('admin', 'reports_v1', http=http)
 
 
-def gdrive_activities(service, max_results):
+def gdrive_activities(service, max_results, retry_policy=default_policy):
     """
     Outputs a list of the last 'max_results' google drive evetns.
     :param service: a Google Admin SDK Reports API service object
     :param max_results:
+    :param retry_policy: `RetryPolicy` of the API calls
     :return: a list
     """
 
@@ -40,43 +78,377 @@ def gdrive_activities(service, max_results):
 
     print('Getting the last {} events'.format(max_results))
 
-    results = service.activities().list(
+    results = retry_policy.execute(service.activities().list(
         applicationName='drive',
         userKey='all',
         maxResults=max_results
-    ).execute()
+    ))
 
     return results.get('items', [])
 
 
-def main():
-    service = gdrive_service()
+def iter_gdrive_activities(service, start_time=None, end_time=None, event_name=None,
+                           max_results=ACTIVITIES_PAGE_SIZE, retry_policy=default_policy):
+    """
+    Yields google drive activities, newest first, requesting the next page only when the previous one is consumed.
+    :param service: a Google Admin SDK Reports API service object
+    :param start_time: optional RFC3339 timestamp, e.g. '2020-01-01T00:00:00.000Z'; events at or after it
+    :param end_time: optional RFC3339 timestamp; events before it
+    :param event_name: optional drive event name, e.g. 'change_user_access'
+    :param max_results: number of activities per page
+    :param retry_policy: `RetryPolicy` of the API calls
+    """
+    activities = service.activities()
+    request = activities.list(
+        applicationName='drive',
+        userKey='all',
+        startTime=start_time,
+        endTime=end_time,
+        eventName=event_name,
+        maxResults=max_results
+    )
+    while request is not None:
+        response = retry_policy.execute(request)
+        for activity in response.get('items', []):
+            yield activity
+        request = activities.list_next(request, response)
+
+
+def parse_rfc3339(value):
+    """
+    :param value: RFC3339 timestamp, e.g. '2020-01-01T00:00:00.000Z'
+    :return: timezone aware `datetime`
+    """
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def format_rfc3339(dt):
+    """
+    :param dt: timezone aware `datetime`
+    :return: RFC3339 timestamp in UTC with milliseconds, as returned by the Reports API
+    """
+    dt = dt.astimezone(timezone.utc)
+    return '{}.{:03d}Z'.format(dt.strftime('%Y-%m-%dT%H:%M:%S'), dt.microsecond // 1000)
+
+
+def split_time_range(start_time, end_time, window=DEFAULT_WINDOW):
+    """
+    :param start_time: RFC3339 timestamp of the start of the range (inclusive)
+    :param end_time: RFC3339 timestamp of the end of the range (exclusive)
+    :param window: `timedelta` size of the windows
+    :return: list of (start_time, end_time) windows covering the range, newest first
+    """
+    start, end = parse_rfc3339(start_time), parse_rfc3339(end_time)
+    windows = []
+    while end > start:
+        window_start = max(start, end - window)
+        windows.append((format_rfc3339(window_start), format_rfc3339(end)))
+        end = window_start
+    return windows
+
+
+def iter_gdrive_activities_parallel(service_factory, start_time, end_time, window=DEFAULT_WINDOW,
+                                    max_workers=DEFAULT_MAX_WORKERS, event_name=None,
+                                    max_results=ACTIVITIES_PAGE_SIZE, retry_policy=default_policy):
+    """
+    Yields google drive activities of [start_time, end_time), newest first, fetching time windows in parallel.
+    At most `max_workers` windows are fetched or held in memory at once. Activities returned in two
+    windows are yielded once, keyed by their time and id.uniqueQualifier.
+    :param service_factory: function returning a new Reports API service object; one is created per thread
+    :param start_time: RFC3339 timestamp of the start of the range (inclusive)
+    :param end_time: RFC3339 timestamp of the end of the range (exclusive)
+    :param window: `timedelta` size of the windows
+    :param max_workers: maximum number of windows fetched in parallel
+    """
+    local = threading.local()
+
+    def fetch(window_start, window_end):
+        # httplib2.Http is not thread-safe, so each thread uses its own service
+        if getattr(local, 'service', None) is None:
+            local.service = service_factory()
+        activities = list(iter_gdrive_activities(
+            local.service, window_start, window_end, event_name, max_results, retry_policy))
+        activities.sort(key=lambda a: a['id']['time'], reverse=True)
+        return activities
+
+    windows = iter(split_time_range(start_time, end_time, window))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = deque(executor.submit(fetch, *w) for w in itertools.islice(windows, max_workers))
+        previous_keys = set()
+        while futures:
+            activities = futures.popleft().result()
+            for w in itertools.islice(windows, 1):
+                futures.append(executor.submit(fetch, *w))
+
+            # duplicates can only come from the adjacent window
+            keys = set()
+            for activity in activities:
+                key = (activity['id']['time'], activity['id'].get('uniqueQualifier'))
+                if key in previous_keys or key in keys:
+                    continue
+                keys.add(key)
+                yield activity
+            previous_keys = keys
+
+
+def flatten_activity(activity, parameters=EXPORT_PARAMETERS):
+    """
+    Yields one flat row per event of the activity, with the columns in EXPORT_FIELDS.
+    Missing parameters are None.
+    :param activity: an activity of the Reports API
+    :param parameters: names of the event parameters copied to the row
+    """
+    # The complete list of drive event names can be found here
+    # https://developers.google.com/admin-sdk/reports/v1/reference/activity-ref-appendix-a/drive-event-names
+    activity_id = activity.get('id', {})
+    for event in activity.get('events', []):
+        row = {
+            'time': activity_id.get('time'),
+            'unique_id': activity_id.get('uniqueQualifier'),
+            'actor': activity.get('actor', {}).get('email'),
+            'event': event.get('name'),
+            'doc_id': None,
+            'doc_title': None,
+            'doc_type': None,
+            'owner': None,
+            'primary_event': None,
+        }
+        row.update((name, None) for name in parameters if name not in row)
+        for param in event.get('parameters', []):
+            name = param['name']
+            if name in parameters:
+                if 'value' in param:
+                    row[name] = param['value']
+                elif 'intValue' in param:
+                    row[name] = param['intValue']
+                elif 'boolValue' in param:
+                    row[name] = param['boolValue']
+        yield row
 
-    activities = gdrive_activities(service, max_results=10)
 
+def export_activities(activities, fp, output_format='jsonl', header=True):
+    """
+    Writes the flattened events of the activities to a file as they are read.
+    :param activities: iterable of activities, e.g. from `iter_gdrive_activities`
+    :param fp: file object opened for writing text
+    :param output_format: 'jsonl' (newline-delimited JSON) or 'csv'
+    :param header: False to not write the csv header, e.g. when appending
+    :return: number of events written
+    """
+    if output_format == 'csv':
+        writer = csv.DictWriter(fp, fieldnames=EXPORT_FIELDS)
+        if header:
+            writer.writeheader()
+        write = writer.writerow
+    elif output_format == 'jsonl':
+        def write(row):
+            fp.write(json.dumps(row))
+            fp.write('\n')
+    else:
+        raise ValueError('Unknown output format {}'.format(output_format))
+
+    count = 0
+    for activity in activities:
+        for row in flatten_activity(activity):
+            write(row)
+            count += 1
+    return count
+
+
+def load_sync_state(path):
+    """
+    :param path: state file of the incremental sync
+    :return: `dict` of {time: RFC3339 high-water mark, seen: [[time, uniqueQualifier]]}; {} if no state saved
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_sync_state(path, state):
+    """Replace the state file atomically, so an interrupted run keeps the previous state
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def iter_new_gdrive_activities(service, state, overlap=DEFAULT_OVERLAP, event_name=None,
+                               max_results=ACTIVITIES_PAGE_SIZE, retry_policy=default_policy):
+    """
+    Yields the activities not seen by the previous sync, newest first, and updates `state` in place
+    once all of them are consumed. Activities since `overlap` before the high-water mark are requested
+    again and the ones already seen are skipped.
+    :param service: a Google Admin SDK Reports API service object
+    :param state: `dict` from `load_sync_state`
+    :param overlap: `timedelta` requested again before the high-water mark
+    """
+    start_time = None
+    if state.get('time'):
+        start_time = format_rfc3339(parse_rfc3339(state['time']) - overlap)
+    seen = set(tuple(k) for k in state.get('seen', []))
+
+    high_water_mark = state.get('time')
+    min_kept = None
+    keep = []
+    for activity in iter_gdrive_activities(
+            service, start_time=start_time, event_name=event_name, max_results=max_results,
+            retry_policy=retry_policy):
+        key = (activity['id']['time'], activity['id'].get('uniqueQualifier'))
+        if min_kept is None:
+            # activities are newest first
+            if high_water_mark is None or key[0] > high_water_mark:
+                high_water_mark = key[0]
+            min_kept = format_rfc3339(parse_rfc3339(high_water_mark) - overlap)
+        if key[0] >= min_kept:
+            keep.append(key)
+        if key not in seen:
+            yield activity
+
+    if min_kept is not None:
+        state['time'] = high_water_mark
+        state['seen'] = [list(k) for k in keep]
+
+
+def print_activities(activities):
     for activity in activities:
-        # The complete list of drive event names can be found here
-        # https://developers.google.com/admin-sdk/reports/v1/reference/activity-ref-appendix-a/drive-event-names
-
-        gdrive_event_params = activity['events'][0]['parameters']
-        ret = {}
-        for i in gdrive_event_params:
-            if 'value' in i.keys():
-                ret[i['name']] = i['value']
-            elif 'intValue' in i.keys():
-                ret[i['name']] = i['intValue']
-            elif 'boolValue' in i.keys():
-                ret[i['name']] = i['boolValue']
-
-        print('--------------------------------------------------------')
-        print('time     : {}'.format(activity['id']['time']))
-        print('actor    : {}'.format(activity['actor']['email']))
-        print('event    : {}'.format(activity['events'][0]['name']))
-        print('doc_title: {}'.format(ret['doc_title']))
-        print('doc_type : {}'.format(ret['doc_type']))
-        print('doc_id   : {}'.format(ret['doc_id']))
-        print('owner    : {}'.format(ret['owner']))
-        print('primary_event: {}'.format(ret['primary_event']))
+        # only the first event of each activity is printed
+        row = next(flatten_activity(activity), None)
+        if row is not None:
+            print('--------------------------------------------------------')
+            print('time     : {}'.format(row['time']))
+            print('actor    : {}'.format(row['actor']))
+            print('event    : {}'.format(row['event']))
+            print('doc_title: {}'.format(row['doc_title']))
+            print('doc_type : {}'.format(row['doc_type']))
+            print('doc_id   : {}'.format(row['doc_id']))
+            print('owner    : {}'.format(row['owner']))
+            print('primary_event: {}'.format(row['primary_event']))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Retrieve Google Drive audit events')
+    parser.add_argument('-n', '--max-events', type=int, default=10,
+                        help='Number of the last activities to retrieve; 0 for all (default: 10)')
+    parser.add_argument('--start-time', help='RFC3339 timestamp, e.g. 2020-01-01T00:00:00.000Z')
+    parser.add_argument('--end-time', help='RFC3339 timestamp, e.g. 2020-02-01T00:00:00.000Z')
+    parser.add_argument('--event-name', help='Drive event name, e.g. change_user_access')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of time windows of [--start-time, --end-time) fetched in parallel (default: 1)')
+    parser.add_argument('--window-minutes', type=int, default=60,
+                        help='Size of the time windows fetched in parallel, in minutes (default: 60)')
+    parser.add_argument('--state-file',
+                        help='Incremental sync: export only the events after the ones of the previous run, '
+                             'whose high-water mark is saved in this file, and append them to --output')
+    parser.add_argument('--format', choices=['text', 'jsonl', 'csv', 'sqlite'], default='text',
+                        dest='output_format',
+                        help='Output format; sqlite loads the events into the DriveActivityStore of --output '
+                             '(default: text)')
+    parser.add_argument('-o', '--output', default='-', help='Output file; - for stdout (default: -)')
+    parser.add_argument('--service-account-file',
+                        help='JSON key file of a service account with domain-wide delegation, for unattended runs')
+    parser.add_argument('--subject', help='Email address of the admin user impersonated by the service account')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    max_results = min(args.max_events, ACTIVITIES_PAGE_SIZE) or ACTIVITIES_PAGE_SIZE
+    if args.service_account_file:
+        # long exports must not wait for the access tokens to be refreshed
+        default_manager.start_refresher()
+
+    if args.state_file:
+        if args.output == '-' or args.output_format == 'text':
+            print('ERROR: --output and --format jsonl/csv/sqlite are required with --state-file', file=sys.stderr)
+            return 1
+        return sync(args)
+    if args.output_format == 'sqlite' and args.output == '-':
+        print('ERROR: --output is required with --format sqlite', file=sys.stderr)
+        return 1
+
+    if args.workers > 1:
+        if not args.start_time:
+            print('ERROR: --start-time is required with --workers', file=sys.stderr)
+            return 1
+        activities = iter_gdrive_activities_parallel(
+            functools.partial(gdrive_service, args.service_account_file, args.subject),
+            start_time=args.start_time,
+            end_time=args.end_time or format_rfc3339(datetime.now(timezone.utc)),
+            window=timedelta(minutes=args.window_minutes),
+            max_workers=args.workers,
+            event_name=args.event_name,
+            max_results=max_results,
+        )
+    else:
+        activities = iter_gdrive_activities(
+            gdrive_service(args.service_account_file, args.subject),
+            start_time=args.start_time,
+            end_time=args.end_time,
+            event_name=args.event_name,
+            max_results=max_results,
+        )
+    if args.max_events:
+        activities = itertools.islice(activities, args.max_events)
+
+    if args.output_format == 'text':
+        print_activities(activities)
+        return 0
+
+    if args.output_format == 'sqlite':
+        count = store_activities(activities, args.output)
+        print('{} events stored'.format(count), file=sys.stderr)
+        return 0
+
+    fp = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        count = export_activities(activities, fp, args.output_format)
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
+    print('{} events exported'.format(count), file=sys.stderr)
+    return 0
+
+
+def store_activities(activities, path):
+    """Load the events of the activities into a `DriveActivityStore`
+    :return: number of new events
+    """
+    from gsuite_utils.activity_store import DriveActivityStore
+    store = DriveActivityStore(path)
+    try:
+        return store.add_activities(activities)
+    finally:
+        store.close()
+
+
+def sync(args):
+    """Append the events not seen by the previous run to the output file, then save the new high-water mark.
+    The events are written to a temporary file first and appended once all of them are fetched, so a failed
+    run leaves both the output and the state as they were.
+    """
+    state = load_sync_state(args.state_file)
+    activities = iter_new_gdrive_activities(
+        gdrive_service(args.service_account_file, args.subject), state, event_name=args.event_name)
+    if args.output_format == 'sqlite':
+        count = store_activities(activities, args.output)
+    else:
+        header = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+        tmp_path = args.output + '.tmp'
+        try:
+            with open(tmp_path, 'w', newline='') as fp:
+                count = export_activities(activities, fp, args.output_format, header=header)
+            with open(tmp_path, newline='') as src, open(args.output, 'a', newline='') as dst:
+                shutil.copyfileobj(src, dst)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    save_sync_state(args.state_file, state)
+    print('{} new events exported'.format(count), file=sys.stderr)
+    return 0
+
 
 if __name__ == '__main__':
     sys.exit(main())
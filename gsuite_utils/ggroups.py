@@ -1,9 +1,14 @@
 from __future__ import print_function
-import httplib2
 import os
-from apiclient import discovery
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from gsuite_utils.credentials import get_credentials
+from gsuite_utils.credentials import default_manager
+from gsuite_utils.reconcile import diff_settings, is_plan_empty, plan_group_changes
+from gsuite_utils.retry import default_policy, http_status, is_ambiguous, is_rate_limited, is_retryable
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.telemetry import Telemetry
 
 
 APP_NAME = os.path.basename(__file__).split('.')[0]
@@ -38,22 +43,61 @@ Defaults = {
 
 ROLES = ["OWNER", "MANAGER", "MEMBER"]
 
+# Maximum number of calls in a single batch request of the Admin SDK
+MAX_BATCH_SIZE = 1000
+
+# Maximum number of members per page of members().list
+MEMBERS_PAGE_SIZE = 200
+
+# Maximum number of groups per page of groups().list
+GROUPS_PAGE_SIZE = 200
+
+# Default maximum number of groups processed in parallel by the bulk operations
+DEFAULT_MAX_WORKERS = 8
+
 
 class GGroupsAndSettings(object):
-    def __init__(self, client_secret_file, local_credential_file):
-        self.http = self._auth(client_secret_file, local_credential_file)
-        self.logs = []
+    def __init__(self, client_secret_file, local_credential_file, services=None, retry_policy=None, cache=None,
+                 service_account_file=None, subject=None, telemetry=None, membership_index=None):
+        """
+        :param client_secret_file: OAuth client secret file
+        :param local_credential_file: file name of the stored credentials in ~/.credentials
+        :param services: optional `ServiceRegistry` to share built API services between helpers
+        :param retry_policy: optional `RetryPolicy` of the API calls; defaults to the one shared in the process
+        :param cache: optional `StateCache` of groups, settings and members
+        :param service_account_file: optional JSON key file of a service account to use instead of
+            the OAuth client, e.g. for unattended workers
+        :param subject: email address of the admin user impersonated by the service account
+        :param telemetry: optional `Telemetry` recording the API calls and errors
+        :param membership_index: optional `MembershipIndex` filled by the members retrieved and kept current
+            by the members added, removed or updated
+        """
+        self.http = self._auth(client_secret_file, local_credential_file, service_account_file, subject)
+        self.services = services if services is not None else ServiceRegistry(self.http)
+        self.retry_policy = retry_policy if retry_policy is not None else default_policy
+        self.cache = cache
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self.membership_index = membership_index
+        self._auth_args = (client_secret_file, local_credential_file, service_account_file, subject)
+        self._owner_thread = threading.current_thread()
+        self._local = threading.local()
 
-    def group_info(self, group_email_address):
+    def group_info(self, group_email_address, stream=False, max_results=MEMBERS_PAGE_SIZE, fields=None):
         """
         :param group_email_address: email address of the group
+        :param stream: True to return members as a generator fetching the pages lazily
+        :param max_results: number of members per page
+        :param fields: optional member fields to download, e.g. 'email,role,type'
         :return: `dict` containing group basic info, settings and members
         """
         results = dict()
         results['group'] = self._get_group(group_email_address)
         if results['group'] is not None:
             results['settings'] = self._get_group_settings(group_email_address)
-            results['members'] = self._get_group_members(group_email_address)
+            if stream is True:
+                results['members'] = self._stream_group_members(group_email_address, max_results, fields)
+            else:
+                results['members'] = self._get_group_members(group_email_address, max_results, fields)
         return results
 
     def create_group(self, group_email_address, is_public=False):
@@ -76,22 +120,21 @@ class GGroupsAndSettings(object):
         :return: `dict` containing group settings if succeeded; {} if no update required; None if failed.
         """
         try:
-            body = {}
             groupsettings = self._get_group_settings(group_email_address)
 
             if groupsettings is None:
                 return None
 
-            for k, v in group_settings_dict.items():
-                if groupsettings[k] != v:
-                    body[k] = v
-
+            body = diff_settings(groupsettings, group_settings_dict)
             if body:
-                return self._groupssettings_service().update(groupUniqueId=group_email_address, body=body).execute()
+                self._invalidate(group_email_address, 'settings')
+                return self._execute(
+                    self._groupssettings_service().update(groupUniqueId=group_email_address, body=body),
+                    group_email_address)
 
         except Exception as e:
             self.logging('ERROR: Failed to update group settings of ({}). It is not a group or it does not exist.'
-                         .format(group_email_address))
+                         .format(group_email_address), group_email_address)
             return None
         return {}
 
@@ -102,42 +145,446 @@ class GGroupsAndSettings(object):
         """
         return self.update_group_settings(group_email_address, Defaults['PublicGroupsSettings'])
 
-    def add_group_members(self, group_email_address, email_address_list, role=Defaults['Role']):
+    def add_group_members(self, group_email_address, email_address_list, role=Defaults['Role'],
+                          batch=False, results=None):
         """
         :param group_email_address: email address of the group
         :param email_address_list: list of email address to be added
+        :param batch: True to send the requests in batches of up to MAX_BATCH_SIZE calls
+        :param results: optional `dict` to be filled with {member_email_address: True/False}
         :return: True if succeeded; False is any failure occurred.
         """
         if role not in ROLES:
-            self.logging('ERROR: Invalid role {}. Choose from {}'.format(role, ROLES))
+            self.logging('ERROR: Invalid role {}. Choose from {}'.format(role, ROLES), group_email_address)
             return False
 
         if not group_email_address or not email_address_list:
-            self.logging('ERROR: GROUP_EMAIL_ADDRESS or MEMBER_EMAIL_ADDRESS is not provided. Nothing to remove.')
+            self.logging('ERROR: GROUP_EMAIL_ADDRESS or MEMBER_EMAIL_ADDRESS is not provided. Nothing to remove.',
+                         group_email_address)
             return False
 
-        err_cnt = 0
-        for member_email_address in email_address_list:
-            if self._add_group_members(group_email_address, member_email_address, role) is False:
-                err_cnt += 1
+        self._invalidate(group_email_address, 'group', 'members')
+        results = {} if results is None else results
+        if batch is True:
+            requests = [
+                (member_email_address, self._members_service().insert(
+                    groupKey=group_email_address, body={'email': member_email_address, 'role': role}))
+                for member_email_address in email_address_list
+            ]
+            err_cnt = self._execute_batch(requests, results, lambda member_email_address, e: self.logging(
+                'ERROR: Failed to add {} {} to {}. {}'.format(
+                    role, member_email_address, group_email_address,
+                    self._add_member_error(e, member_email_address, role)),
+                group_email_address, member_email_address), group_email_address)
+        else:
+            err_cnt = 0
+            for member_email_address in email_address_list:
+                succeeded = self._add_group_members(group_email_address, member_email_address, role) is not False
+                results[member_email_address] = succeeded
+                if not succeeded:
+                    err_cnt += 1
+        self._index_results(group_email_address, email_address_list, results, role)
         return err_cnt == 0
 
-    def remove_group_members(self, group_email_address, email_address_list):
+    def remove_group_members(self, group_email_address, email_address_list, batch=False, results=None):
         """
         :param group_email_address: email address of the group
         :param email_address_list: list of email address to be removed
+        :param batch: True to send the requests in batches of up to MAX_BATCH_SIZE calls
+        :param results: optional `dict` to be filled with {member_email_address: True/False}
         :return: True if succeeded; False is any failure occurred.
         """
         if not group_email_address or not email_address_list:
-            self.logging('ERROR: GROUP_EMAIL_ADDRESS or MEMBER_EMAIL_ADDRESS is not provided. Nothing to remove.')
+            self.logging('ERROR: GROUP_EMAIL_ADDRESS or MEMBER_EMAIL_ADDRESS is not provided. Nothing to remove.',
+                         group_email_address)
+            return False
+
+        self._invalidate(group_email_address, 'group', 'members')
+        results = {} if results is None else results
+        if batch is True:
+            requests = [
+                (member_email_address, self._members_service().delete(
+                    groupKey=group_email_address, memberKey=member_email_address))
+                for member_email_address in email_address_list
+            ]
+            err_cnt = self._execute_batch(requests, results, lambda member_email_address, e: self.logging(
+                'ERROR: Failed to remove {} from {}. {}'.format(
+                    member_email_address, group_email_address, self._remove_member_error(e)),
+                group_email_address, member_email_address), group_email_address)
+        else:
+            err_cnt = 0
+            for member_email_address in email_address_list:
+                succeeded = self._remove_group_members(group_email_address, member_email_address) is not False
+                results[member_email_address] = succeeded
+                if not succeeded:
+                    err_cnt += 1
+        self._index_results(group_email_address, email_address_list, results)
+        return err_cnt == 0
+
+    def update_group_members_role(self, group_email_address, email_address_list, role, batch=False, results=None):
+        """Change the role of existing members in place with members().patch, instead of removing and adding them.
+        Members already holding the role, as per the current members of the group, are skipped.
+        :param group_email_address: email address of the group
+        :param email_address_list: list of email address of the members
+        :param role: new role, one of ROLES
+        :param batch: True to send the requests in batches of up to MAX_BATCH_SIZE calls
+        :param results: optional `dict` to be filled with {member_email_address: True/False}
+        :return: True if succeeded; False is any failure occurred.
+        """
+        if role not in ROLES:
+            self.logging('ERROR: Invalid role {}. Choose from {}'.format(role, ROLES), group_email_address)
+            return False
+
+        if not group_email_address or not email_address_list:
+            self.logging('ERROR: GROUP_EMAIL_ADDRESS or MEMBER_EMAIL_ADDRESS is not provided. Nothing to update.',
+                         group_email_address)
+            return False
+
+        members = self._get_group_members(group_email_address, fields='email,role')
+        if members is None:
             return False
+        current_roles = {m['email'].lower(): m.get('role') for m in members if m.get('email')}
 
+        results = {} if results is None else results
         err_cnt = 0
+        to_patch = []
         for member_email_address in email_address_list:
-            if self._remove_group_members(group_email_address, member_email_address) is False:
+            current_role = current_roles.get(member_email_address.lower())
+            if current_role is None:
+                self.logging('ERROR: Failed to change role of {} in {} to {}. Member not found.'.format(
+                    member_email_address, group_email_address, role), group_email_address, member_email_address)
+                results[member_email_address] = False
                 err_cnt += 1
+            elif current_role == role:
+                results[member_email_address] = True
+            else:
+                to_patch.append(member_email_address)
+
+        if to_patch and not self._patch_group_members(group_email_address, to_patch, role, batch, results):
+            err_cnt += 1
         return err_cnt == 0
 
+    def reconcile_group(self, group_email_address, desired_settings=None, desired_members=None,
+                        dry_run=False, batch=True):
+        """Bring a group to the desired state with the minimal set of changes.
+        :param group_email_address: email address of the group; created if it does not exist
+        :param desired_settings: optional `dict` of group settings; None to leave the settings unchanged
+        :param desired_members: optional `dict` of {member_email_address: role}; None to leave the members unchanged
+        :param dry_run: True to only compute the plan
+        :param batch: True to send the member changes in batches
+        :return: `dict` plan of {group, create, settings, insert, delete, update_role} (see reconcile.describe_plan);
+            unless dry_run, with 'succeeded' True if all changes were applied and 'results' {member_email_address: True/False}.
+        """
+        if desired_members is not None:
+            invalid = set(desired_members.values()) - set(ROLES)
+            if invalid:
+                self.logging('ERROR: Invalid role {}. Choose from {}'.format(sorted(invalid), ROLES),
+                             group_email_address)
+                return None
+
+        try:
+            group = self._execute_cached('group', group_email_address, self._groups_service().get(
+                groupKey=group_email_address))
+        except Exception as e:
+            if http_status(e) != 404:
+                self.logging('ERROR: Failed to retrieve group ({}). {}'.format(group_email_address, e),
+                             group_email_address)
+                return None
+            group = None
+
+        settings, members = None, []
+        if group is not None:
+            if desired_settings:
+                settings = self._get_group_settings(group_email_address)
+                if settings is None:
+                    return None
+            if desired_members is not None:
+                members = self._get_group_members(group_email_address)
+                if members is None:
+                    return None
+
+        plan = plan_group_changes(
+            group_email_address, group, settings, members, desired_settings, desired_members)
+        if dry_run is True or is_plan_empty(plan):
+            return plan
+
+        plan['results'] = results = {}
+        succeeded = True
+        if plan['create'] and self._create_group(group_email_address) is None:
+            plan['succeeded'] = False
+            return plan
+        if plan['settings']:
+            succeeded &= self._update_group_settings(group_email_address, plan['settings']) is not None
+
+        for role in ROLES:
+            emails = [m['email'] for m in plan['insert'] if m['role'] == role]
+            if emails:
+                succeeded &= self.add_group_members(group_email_address, emails, role, batch=batch, results=results)
+        if plan['delete']:
+            succeeded &= self.remove_group_members(group_email_address, plan['delete'], batch=batch, results=results)
+        for role in ROLES:
+            emails = [m['email'] for m in plan['update_role'] if m['role'] == role]
+            if emails:
+                succeeded &= self._patch_group_members(group_email_address, emails, role, batch, results)
+
+        plan['succeeded'] = bool(succeeded)
+        return plan
+
+    def groups_info(self, group_email_addresses, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param group_email_addresses: list of email addresses of the groups
+        :param max_workers: maximum number of groups processed in parallel
+        :return: `dict` of {group_email_address: `group_info` results}
+        """
+        return self._run_concurrently(
+            self.group_info, {g: () for g in group_email_addresses}, max_workers)
+
+    def add_groups_members(self, members_by_group, role=Defaults['Role'], batch=False, results=None,
+                           max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param members_by_group: `dict` of {group_email_address: list of email address to be added}
+        :param max_workers: maximum number of groups processed in parallel
+        :param results: optional `dict` to be filled with {group_email_address: {member_email_address: True/False}}
+        :return: `dict` of {group_email_address: True if succeeded; False is any failure occurred}
+        """
+        results = {} if results is None else results
+        jobs = {}
+        for group_email_address, email_address_list in members_by_group.items():
+            results[group_email_address] = {}
+            jobs[group_email_address] = (email_address_list, role, batch, results[group_email_address])
+        return self._run_concurrently(self.add_group_members, jobs, max_workers)
+
+    def remove_groups_members(self, members_by_group, batch=False, results=None, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param members_by_group: `dict` of {group_email_address: list of email address to be removed}
+        :param max_workers: maximum number of groups processed in parallel
+        :param results: optional `dict` to be filled with {group_email_address: {member_email_address: True/False}}
+        :return: `dict` of {group_email_address: True if succeeded; False is any failure occurred}
+        """
+        results = {} if results is None else results
+        jobs = {}
+        for group_email_address, email_address_list in members_by_group.items():
+            results[group_email_address] = {}
+            jobs[group_email_address] = (email_address_list, batch, results[group_email_address])
+        return self._run_concurrently(self.remove_group_members, jobs, max_workers)
+
+    def create_groups(self, group_specs, apply_defaults=True, max_workers=DEFAULT_MAX_WORKERS):
+        """Create groups concurrently, each with a single write of its settings right after its creation.
+        The settings of a group are Defaults['DefaultGroupSettings'] (unless apply_defaults is False),
+        then Defaults['PublicGroupsSettings'] if it is public, then its own settings.
+        :param group_specs: `dict` of {group_email_address: spec}, spec being a `dict` of
+            {name, description, is_public, settings} where all keys are optional
+        :param apply_defaults: False to not apply Defaults['DefaultGroupSettings']
+        :param max_workers: maximum number of groups processed in parallel
+        :return: `dict` of {group_email_address: {group, settings, succeeded}} where group and settings
+            are the payloads returned by the API, or None if not created or not updated
+        """
+        return self._run_concurrently(
+            self._provision_group, {g: (spec or {}, apply_defaults) for g, spec in group_specs.items()}, max_workers)
+
+    def _provision_group(self, group_email_address, spec, apply_defaults=True):
+        """Create a group and write its settings, without reading the settings of the group just created.
+        :return: `dict` of {group, settings, succeeded}
+        """
+        results = {'group': None, 'settings': None, 'succeeded': False}
+        results['group'] = self._create_group(group_email_address, spec.get('name'), spec.get('description'))
+        if results['group'] is None:
+            return results
+
+        settings = dict(Defaults['DefaultGroupSettings']) if apply_defaults else {}
+        if spec.get('is_public') is True:
+            settings.update(Defaults['PublicGroupsSettings'])
+        settings.update(spec.get('settings') or {})
+        if settings:
+            results['settings'] = self._update_group_settings(group_email_address, settings)
+            results['succeeded'] = results['settings'] is not None
+        else:
+            results['succeeded'] = True
+        return results
+
+    def update_groups_members_role(self, members_by_group, role, batch=False, results=None,
+                                   max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param members_by_group: `dict` of {group_email_address: list of email address of the members}
+        :param role: new role, one of ROLES
+        :param max_workers: maximum number of groups processed in parallel
+        :param results: optional `dict` to be filled with {group_email_address: {member_email_address: True/False}}
+        :return: `dict` of {group_email_address: True if succeeded; False is any failure occurred}
+        """
+        results = {} if results is None else results
+        jobs = {}
+        for group_email_address, email_address_list in members_by_group.items():
+            results[group_email_address] = {}
+            jobs[group_email_address] = (email_address_list, role, batch, results[group_email_address])
+        return self._run_concurrently(self.update_group_members_role, jobs, max_workers)
+
+    def update_groups_settings(self, settings_by_group, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param settings_by_group: `dict` of {group_email_address: dict containing the group settings}
+        :param max_workers: maximum number of groups processed in parallel
+        :return: `dict` of {group_email_address: `update_group_settings` result}
+        """
+        return self._run_concurrently(
+            self.update_group_settings, {g: (s,) for g, s in settings_by_group.items()}, max_workers)
+
+    def remove_member_from_all_groups(self, member_email_address, batch=False, max_workers=DEFAULT_MAX_WORKERS):
+        """Remove a member, e.g. a leaving user, from all the groups it is in as per `self.membership_index`.
+        :param member_email_address: email address of the member
+        :param max_workers: maximum number of groups processed in parallel
+        :return: `dict` of {group_email_address: True if removed; False if failed}; None if there is no index
+        """
+        if self.membership_index is None:
+            self.logging('ERROR: Failed to remove {} from all groups. No membership index.'.format(
+                member_email_address), member_email_address=member_email_address)
+            return None
+        groups = self.membership_index.groups_of(member_email_address)
+        return self.remove_groups_members(
+            {g: [member_email_address] for g in groups}, batch=batch, max_workers=max_workers)
+
+    def expand_group_members(self, group_email_address, graph=None, max_workers=DEFAULT_MAX_WORKERS):
+        """Flatten the membership of a group through its nested groups, i.e. who receives the mail sent to it.
+        Each level of subgroups is fetched concurrently, and each group is fetched once, whatever the number
+        of groups it belongs to.
+        :param group_email_address: email address of the group
+        :param graph: optional `dict` of {group_email_address: list of members, or None if failed to retrieve},
+            shared between calls to fetch each group once per run
+        :param max_workers: maximum number of groups fetched in parallel
+        :return: `dict` of {
+            members: {email address: path, list of the groups from this group to the one the member is in},
+            groups: {email address of the nested group: path},
+            cycles: list of paths of groups ending with a group already in the path,
+            failed: list of email addresses of the groups not retrieved}
+            Members reachable through several groups are reported with one of the shortest paths.
+        """
+        graph = {} if graph is None else graph
+        root = group_email_address.lower()
+        ret = {'members': {}, 'groups': {}, 'cycles': [], 'failed': []}
+        paths = {root: [root]}
+        frontier = [root]
+        while frontier:
+            missing = {g: (MEMBERS_PAGE_SIZE, 'email,role,type') for g in frontier if g not in graph}
+            graph.update(self._run_concurrently(self._get_group_members, missing, max_workers))
+
+            next_frontier = []
+            for group in frontier:
+                if graph[group] is None:
+                    ret['failed'].append(group)
+                    continue
+                for member in graph[group]:
+                    if not member.get('email'):
+                        # e.g. a CUSTOMER member, all the users of the organisation
+                        continue
+                    email = member['email'].lower()
+                    path = paths[group]
+                    if member.get('type') != 'GROUP':
+                        ret['members'].setdefault(email, path)
+                    elif email not in paths:
+                        paths[email] = ret['groups'][email] = path + [email]
+                        next_frontier.append(email)
+            frontier = next_frontier
+
+        ret['cycles'] = self._find_cycles(root, graph)
+        return ret
+
+    def expand_groups_members(self, group_email_addresses, max_workers=DEFAULT_MAX_WORKERS):
+        """
+        :param group_email_addresses: list of email addresses of the groups
+        :param max_workers: maximum number of groups fetched in parallel
+        :return: `dict` of {group_email_address: `expand_group_members` results}; the subgroups shared by
+            the groups are fetched once
+        """
+        graph = {}
+        return {g: self.expand_group_members(g, graph, max_workers) for g in group_email_addresses}
+
+    @staticmethod
+    def _find_cycles(root, graph):
+        """
+        :param graph: `dict` of {group_email_address: list of members, or None}
+        :return: list of paths of groups from the root, ending with a group already in the path
+        """
+        cycles = []
+        path, on_path, done = [root], {root}, set()
+        stack = [iter(graph.get(root) or [])]
+        while stack:
+            member = next(stack[-1], None)
+            if member is None:
+                stack.pop()
+                done.add(path[-1])
+                on_path.discard(path.pop())
+                continue
+            if member.get('type') != 'GROUP' or not member.get('email'):
+                continue
+            email = member['email'].lower()
+            if email in done:
+                continue
+            if email in on_path:
+                cycles.append(path + [email])
+            else:
+                path.append(email)
+                on_path.add(email)
+                stack.append(iter(graph.get(email) or []))
+        return cycles
+
+    def scan_domain(self, inventory, customer='my_customer', fields=None, rescan=False,
+                    max_workers=DEFAULT_MAX_WORKERS):
+        """Snapshot all the groups of the domain with their settings and members.
+        An interrupted scan resumes from the page it was scanning, skipping the groups already scanned. Once the
+        last page is scanned, the groups no longer in the domain are dropped from the snapshot.
+        :param inventory: `GroupInventory` storing the snapshot and the checkpoint of the scan
+        :param customer: customer ID of the domain; 'my_customer' for the one of the admin user
+        :param fields: optional member fields to download, e.g. 'email,role,type'
+        :param rescan: True to start a new scan even if the previous one was interrupted
+        :param max_workers: maximum number of groups processed in parallel
+        :return: `dict` of {scanned: number of groups stored, failed: list of email addresses of groups not stored,
+                 removed: number of groups dropped as no longer in the domain}
+        """
+        checkpoint = inventory.get_checkpoint(customer)
+        if rescan or checkpoint is None or checkpoint.complete:
+            checkpoint = inventory.start_scan(customer)
+        done = inventory.group_emails(since=checkpoint.started_at)
+
+        ret = {'scanned': 0, 'failed': []}
+        page_token = checkpoint.page_token
+        while True:
+            response = self._execute(self._groups_service().list(
+                customer=customer, maxResults=GROUPS_PAGE_SIZE, pageToken=page_token))
+            jobs = {g['email']: (g, inventory, fields) for g in response.get('groups', [])
+                    if g['email'].lower() not in done}
+            for group_email_address, stored in self._run_concurrently(self._scan_group, jobs, max_workers).items():
+                if stored:
+                    ret['scanned'] += 1
+                else:
+                    ret['failed'].append(group_email_address)
+
+            page_token = response.get('nextPageToken')
+            inventory.save_checkpoint(customer, page_token, complete=page_token is None)
+            if page_token is None:
+                # the groups which failed keep their previous snapshot
+                ret['removed'] = inventory.remove_stale(checkpoint.started_at, keep=ret['failed'])
+                return ret
+
+    def _scan_group(self, group_email_address, group, inventory, fields=None):
+        """Store the group with its settings and members in the inventory.
+        :return: True if succeeded; False is any failure occurred.
+        """
+        settings = self._get_group_settings(group_email_address)
+        if settings is None:
+            return False
+        members = self._get_group_members(group_email_address, fields=fields)
+        if members is None:
+            return False
+        inventory.put({'group': group, 'settings': settings, 'members': members}, self.is_group_public(settings))
+        return True
+
+    def _run_concurrently(self, func, jobs, max_workers):
+        """Call func(group_email_address, *args) for each group with at most `max_workers` calls in flight.
+        :param jobs: `dict` of {group_email_address: args}
+        :return: `dict` of {group_email_address: return value of func}
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {g: executor.submit(func, g, *args) for g, args in jobs.items()}
+        return {g: f.result() for g, f in futures.items()}
+
     def _add_group_members(self, group_email_address, member_email_address, role):
         """
         :param group_email_address: email address of the group
@@ -146,19 +593,13 @@ class GGroupsAndSettings(object):
         """
         try:
             body = {'email': member_email_address, 'role': role}
-            self._members_service().insert(groupKey=group_email_address, body=body).execute()
+            self._execute(self._members_service().insert(groupKey=group_email_address, body=body),
+                          group_email_address, member_email_address, insert=True)
 
         except Exception as e:
-            if 'Resource Not Found: groupKey' in str(e):
-                msg = "Group not found."
-            elif 'already exist' in str(e):
-                msg = 'Already exist.'
-            elif 'Invalid Input: memberKey' in str(e):
-                msg = '{} cannot be added as {}.'.format(member_email_address, role)
-            else:
-                msg = e
             self.logging('ERROR: Failed to add {} {} to {}. {}'.format(
-                role, member_email_address, group_email_address, msg))
+                role, member_email_address, group_email_address,
+                self._add_member_error(e, member_email_address, role)), group_email_address, member_email_address)
             return False
         return True
 
@@ -169,25 +610,170 @@ class GGroupsAndSettings(object):
         :return: True if succeeded; False is any failure occurred.
         """
         try:
-            self._members_service().delete(groupKey=group_email_address, memberKey=member_email_address).execute()
+            self._execute(
+                self._members_service().delete(groupKey=group_email_address, memberKey=member_email_address),
+                group_email_address, member_email_address)
 
         except Exception as e:
-            if 'Resource Not Found: groupKey' in str(e):
-                msg = "Group not found."
-            elif 'Resource Not Found: memberKey' in str(e) or 'Missing required field: memberKey' in str(e):
-                msg = "Member not found."
-            else:
-                msg = e
             self.logging('ERROR: Failed to remove {} from {}. {}'.format(
-                member_email_address, group_email_address, msg))
+                member_email_address, group_email_address, self._remove_member_error(e)),
+                group_email_address, member_email_address)
             return False
         return True
 
+    def _patch_group_members(self, group_email_address, email_address_list, role, batch, results):
+        """Change the role of members without checking their current role.
+        :param results: `dict` to be filled with {member_email_address: True/False}
+        :return: True if succeeded; False is any failure occurred.
+        """
+        if batch is True:
+            self._invalidate(group_email_address, 'group', 'members')
+            requests = [
+                (member_email_address, self._members_service().patch(
+                    groupKey=group_email_address, memberKey=member_email_address, body={'role': role}))
+                for member_email_address in email_address_list
+            ]
+            err_cnt = self._execute_batch(requests, results, lambda member_email_address, e: self.logging(
+                'ERROR: Failed to change role of {} in {} to {}. {}'.format(
+                    member_email_address, group_email_address, role, self._remove_member_error(e)),
+                group_email_address, member_email_address), group_email_address)
+        else:
+            err_cnt = 0
+            for member_email_address in email_address_list:
+                results[member_email_address] = self._patch_group_member(group_email_address, member_email_address, role)
+                if not results[member_email_address]:
+                    err_cnt += 1
+        self._index_results(group_email_address, email_address_list, results, role)
+        return err_cnt == 0
+
+    def _index_results(self, group_email_address, email_address_list, results, role=None):
+        """Apply the successful writes to `self.membership_index`.
+        :param results: `dict` of {member_email_address: True/False}
+        :param role: role of the members added or updated; None if they were removed
+        """
+        if self.membership_index is None:
+            return
+        for member_email_address in email_address_list:
+            if not results.get(member_email_address):
+                continue
+            if role is None:
+                self.membership_index.remove(group_email_address, member_email_address)
+            else:
+                self.membership_index.add(group_email_address, member_email_address, role)
+
+    def _patch_group_member(self, group_email_address, member_email_address, role):
+        """Change the role of an existing member in place.
+        :param group_email_address: email address of the group
+        :param member_email_address: email address of the member
+        :param role: new role
+        :return: True if succeeded; False is any failure occurred.
+        """
+        self._invalidate(group_email_address, 'members')
+        try:
+            self._execute(self._members_service().patch(
+                groupKey=group_email_address, memberKey=member_email_address, body={'role': role}),
+                group_email_address, member_email_address)
+
+        except Exception as e:
+            self.logging('ERROR: Failed to change role of {} in {} to {}. {}'.format(
+                member_email_address, group_email_address, role, self._remove_member_error(e)),
+                group_email_address, member_email_address)
+            return False
+        return True
+
+    @staticmethod
+    def _add_member_error(e, member_email_address, role):
+        """Return the reason of a failed member insert
+        """
+        if 'Resource Not Found: groupKey' in str(e):
+            return "Group not found."
+        elif http_status(e) == 409:
+            return 'Already exist.'
+        elif 'Invalid Input: memberKey' in str(e):
+            return '{} cannot be added as {}.'.format(member_email_address, role)
+        return e
+
+    @staticmethod
+    def _remove_member_error(e):
+        """Return the reason of a failed member delete
+        """
+        if 'Resource Not Found: groupKey' in str(e):
+            return "Group not found."
+        elif 'Resource Not Found: memberKey' in str(e) or 'Missing required field: memberKey' in str(e):
+            return "Member not found."
+        return e
+
+    def _execute_batch(self, requests, results, on_error, group_email_address=None):
+        """Send requests in batches of up to MAX_BATCH_SIZE calls.
+        Requests failing with a retryable error are sent again in a later batch, as per `self.retry_policy`.
+        :param requests: list of (member_email_address, request)
+        :param results: `dict` to be filled with {member_email_address: True/False}
+        :param on_error: function(member_email_address, exception) called for each failed request
+        :param group_email_address: optional email address of the group, recorded in `self.telemetry`
+        :return: number of failed requests
+        """
+        failures = []
+        # members whose request may have been applied by a failed attempt
+        ambiguous = set()
+        attempt = 1
+        while requests:
+            retries = []
+            for start in range(0, len(requests), MAX_BATCH_SIZE):
+                chunk = requests[start:start + MAX_BATCH_SIZE]
+
+                def callback(request_id, response, exception):
+                    member_email_address, request = chunk[int(request_id)]
+                    if exception is not None and http_status(exception) == 409 \
+                            and member_email_address in ambiguous and request.methodId.endswith('.insert'):
+                        # inserted by a previous attempt
+                        exception = None
+                    if exception is not None and is_retryable(exception) \
+                            and attempt < self.retry_policy.max_attempts:
+                        if is_ambiguous(exception):
+                            ambiguous.add(member_email_address)
+                        retries.append(chunk[int(request_id)] + (exception,))
+                        return
+                    self.telemetry.record(
+                        request.methodId, group_email_address, member_email_address,
+                        'ok' if exception is None else 'error', http_status(exception) if exception else 200,
+                        retries=attempt - 1)
+                    results[member_email_address] = exception is None
+                    if exception is not None:
+                        failures.append(member_email_address)
+                        on_error(member_email_address, exception)
+
+                batch = self._registry().get('admin', 'directory_v1').new_batch_http_request(callback=callback)
+                for i, (_, request) in enumerate(chunk):
+                    batch.add(request, request_id=str(i))
+
+                def execute(batch=batch, chunk=chunk):
+                    try:
+                        return batch.execute()
+                    except Exception as e:
+                        if is_ambiguous(e):
+                            ambiguous.update(member_email_address for member_email_address, _ in chunk)
+                        raise
+
+                try:
+                    self._call('batch', execute, calls=len(chunk))
+                except Exception as e:
+                    # the whole batch failed (e.g. transport error), so none of the callbacks was called
+                    for member_email_address, _ in chunk:
+                        results[member_email_address] = False
+                        failures.append(member_email_address)
+                        on_error(member_email_address, e)
+
+            if retries:
+                self.retry_policy.wait(attempt, retries[-1][2])
+            requests = [r[:2] for r in retries]
+            attempt += 1
+        return len(failures)
+
     @staticmethod
     def is_group_public(groupsettings):
         """Return True if it is a public group (allowing posts from external email address)
         """
-        return groupsettings["whoCanPostMessage"] == Defaults["PublicGroupsSettings"]["whoCanPostMessage"]
+        return groupsettings.get("whoCanPostMessage") == Defaults["PublicGroupsSettings"]["whoCanPostMessage"]
 
     def _get_group(self, group_email_address):
         """
@@ -197,82 +783,255 @@ class GGroupsAndSettings(object):
           None if group_email_address is None or empty
         """
         try:
-            return self._groups_service().get(groupKey=group_email_address).execute()
+            return self._execute_cached('group', group_email_address, self._groups_service().get(
+                groupKey=group_email_address))
 
         except Exception as e:
-            msg = 'Group not found.' if 'Resource Not Found' in str(e) else e
-            self.logging('ERROR: Failed to retrieve group ({}). {}'.format(group_email_address, msg))
+            msg = 'Group not found.' if http_status(e) == 404 else e
+            self.logging('ERROR: Failed to retrieve group ({}). {}'.format(group_email_address, msg),
+                         group_email_address)
             return None
 
-    def _create_group(self, group_email_address):
+    def _create_group(self, group_email_address, name=None, description=None):
         """Create a new Group.
         :param group_email_address: email address of the group
+        :param name: optional display name; the email address if None
+        :param description: optional description
         :return: Group payload in `dict` or None if failed to create the group.
         """
         body = {
             "email": group_email_address,
-            "name": group_email_address
+            "name": name or group_email_address
         }
+        if description:
+            body["description"] = description
+        self._invalidate(group_email_address)
+        try:
+            group = self._execute(self._groups_service().insert(body=body), group_email_address, insert=True)
+            # None if created by an attempt which failed to answer
+            return group if group is not None else self._get_group(group_email_address)
+        except Exception as e:
+            msg = 'Group already exist.' if http_status(e) == 409 else e
+            self.logging('ERROR: Failed to create group ({}). {}'.format(group_email_address, msg),
+                         group_email_address)
+            return None
+
+    def _update_group_settings(self, group_email_address, body):
+        """Write group settings without reading them first.
+        :return: `dict` containing group settings if succeeded; None if failed.
+        """
+        self._invalidate(group_email_address, 'settings')
         try:
-            return self._groups_service().insert(body=body).execute()
+            return self._execute(
+                self._groupssettings_service().update(groupUniqueId=group_email_address, body=body),
+                group_email_address)
+
         except Exception as e:
-            msg = 'Group already exist.' if 'Entity already exist' in str(e) else e
-            self.logging('ERROR: Failed to create group ({}). {}'.format(group_email_address, msg))
+            self.logging('ERROR: Failed to update group settings of ({}). {}'.format(group_email_address, e),
+                         group_email_address)
             return None
 
     def _get_group_settings(self, group_email_address):
         """Return group settings
         """
-        max_try=3
-        attempt = 1
-        while attempt <= max_try:
-            try:
-                return self._groupssettings_service().get(groupUniqueId=group_email_address, alt='json').execute()
+        try:
+            # sometimes google returns 'server issue' when retrieving group settings, retried by the policy
+            return self._execute_cached('settings', group_email_address, self._groupssettings_service().get(
+                groupUniqueId=group_email_address, alt='json'))
 
-            except Exception as e:
-                # try again, sometimes google returns 'server issue" when retrieving group settings
-                attempt += 1
-                if attempt > max_try:
-                    msg = 'Not exist or not a group.' if 'Backend Error' in str(e) else e
-                    self.logging('ERROR: Failed to retrieve group settings of ({}). {}'.format(group_email_address, msg))
+        except Exception as e:
+            msg = 'Not exist or not a group.' if 'Backend Error' in str(e) else e
+            self.logging('ERROR: Failed to retrieve group settings of ({}). {}'.format(group_email_address, msg),
+                         group_email_address)
         return None
 
-    def _get_group_members(self, group_email_address):
+    def _get_group_members(self, group_email_address, max_results=MEMBERS_PAGE_SIZE, fields=None):
         """
         :param group_email_address: email address of the group
+        :param max_results: number of members per page
+        :param fields: optional member fields to download, e.g. 'email,role,type'
         :return: list of members in list of {email, role, type, status, etc.}
         """
+        members = self._get_group_members_cached(group_email_address, max_results, fields)
+        if members is not None and self.membership_index is not None and \
+                (not fields or 'email' in fields.split(',')):
+            self.membership_index.load_group(group_email_address, members)
+        return members
+
+    def _get_group_members_cached(self, group_email_address, max_results=MEMBERS_PAGE_SIZE, fields=None):
+        """Same as `_get_group_members`, through `self.cache` and without loading `self.membership_index`
+        """
+        kind = 'members:{}'.format(fields) if fields else 'members'
+        entry = self.cache.get(kind, group_email_address) if self.cache is not None else None
+        if entry is not None and entry.fresh:
+            return entry.payload
+
         try:
-            results = self._members_service().list(groupKey=group_email_address).execute()
-            return results.get('members', [])
+            members, etags = [], []
+            for page in self._iter_member_pages(
+                    group_email_address, max_results, fields, entry.etag if entry is not None else None):
+                etags.append(page.get('etag'))
+                members.extend(page.get('members', []))
 
         except Exception as e:
-            self.logging('ERROR: {}'.format(e))
+            if entry is not None and http_status(e) == 304:
+                self.cache.touch(kind, group_email_address)
+                return entry.payload
+            self.logging('ERROR: {}'.format(e), group_email_address)
             return None
 
+        if self.cache is not None:
+            # the etag of a page does not change with the other pages, so only single pages are revalidated
+            self.cache.put(kind, group_email_address, members, etags[0] if len(etags) == 1 else None)
+        return members
+
+    def _stream_group_members(self, group_email_address, max_results=MEMBERS_PAGE_SIZE, fields=None):
+        """Same as `_get_group_members` but yields the members; stops and logs on failure.
+        """
+        try:
+            for member in self._iter_group_members(group_email_address, max_results, fields):
+                yield member
+
+        except Exception as e:
+            self.logging('ERROR: {}'.format(e), group_email_address)
+
+    def _iter_group_members(self, group_email_address, max_results=MEMBERS_PAGE_SIZE, fields=None):
+        """Yield the members of the group, requesting the next page only when the previous one is consumed.
+        """
+        for page in self._iter_member_pages(group_email_address, max_results, fields):
+            for member in page.get('members', []):
+                yield member
+
+    def _iter_member_pages(self, group_email_address, max_results=MEMBERS_PAGE_SIZE, fields=None, etag=None):
+        """Yield the pages of members().list responses.
+        :param etag: optional etag of the first page; raises HttpError 304 if it did not change
+        """
+        kwargs = {'groupKey': group_email_address, 'maxResults': max_results}
+        if fields:
+            kwargs['fields'] = 'etag,nextPageToken,members({})'.format(fields)
+        service = self._members_service()
+        request = service.list(**kwargs)
+        if etag:
+            request.headers['If-None-Match'] = etag
+        while request is not None:
+            response = self._execute(request, group_email_address)
+            # only the first page is revalidated; list_next copies the headers of the previous request
+            request.headers.pop('If-None-Match', None)
+            yield response
+            request = service.list_next(request, response)
+
+    def _execute_cached(self, kind, group_email_address, request):
+        """Execute a read request through `self.cache`, revalidating stale entries with their etag.
+        :param kind: 'group' or 'settings'
+        """
+        if self.cache is None:
+            return self._execute(request, group_email_address)
+
+        entry = self.cache.get(kind, group_email_address)
+        if entry is not None and entry.fresh:
+            return entry.payload
+        if entry is not None and entry.etag:
+            request.headers['If-None-Match'] = entry.etag
+        try:
+            payload = self._execute(request, group_email_address)
+        except Exception as e:
+            if entry is not None and http_status(e) == 304:
+                self.cache.touch(kind, group_email_address)
+                return entry.payload
+            raise
+        self.cache.put(kind, group_email_address, payload, payload.get('etag'))
+        return payload
+
+    def _invalidate(self, group_email_address, *kinds):
+        """Drop cached state of the group before writing it
+        """
+        if self.cache is not None:
+            self.cache.invalidate(group_email_address, *kinds)
+
     @staticmethod
-    def _auth(client_secret_file, local_credential_file):
-        return get_credentials(
+    def _auth(client_secret_file, local_credential_file, service_account_file=None, subject=None):
+        # authorized http object of the current thread, sharing the credentials with the other threads
+        if service_account_file:
+            return default_manager.service_account_http(service_account_file, SCOPES, subject)
+        return default_manager.http(
             application_name=APP_NAME,
             client_secret_file=client_secret_file,
             local_credential_file=local_credential_file,
             scopes=SCOPES,
-        ).authorize(httplib2.Http())
+        )
+
+    def _registry(self):
+        """Return the service registry of the current thread, as httplib2.Http is not thread-safe.
+        Worker threads of the bulk operations get their own authorized http object.
+        """
+        if threading.current_thread() is self._owner_thread:
+            return self.services
+        registry = getattr(self._local, 'services', None)
+        if registry is None:
+            registry = self._local.services = self.services.for_http(self._auth(*self._auth_args))
+        return registry
 
     def _groups_service(self):
         # https://developers.google.com/resources/api-libraries/documentation/admin/directory_v1/python/latest/admin_directory_v1.groups.html
-        service = discovery.build('admin', 'directory_v1', http=self.http)
-        return service.groups()
+        return self._registry().collection('admin', 'directory_v1', 'groups')
 
     def _groupssettings_service(self):
         # see https://developers.google.com/resources/api-libraries/documentation/groupssettings/v1/python/latest/groupssettings_v1.groups.html
-        service = discovery.build('groupssettings', 'v1', http=self.http)
-        return service.groups()
+        return self._registry().collection('groupssettings', 'v1', 'groups')
 
     def _members_service(self):
         # https://developers.google.com/resources/api-libraries/documentation/admin/directory_v1/python/latest/admin_directory_v1.members.html
-        service = discovery.build('admin', 'directory_v1', http=self.http)
-        return service.members()
+        return self._registry().collection('admin', 'directory_v1', 'members')
+
+    def _execute(self, request, group_email_address=None, member_email_address=None, insert=False):
+        """Execute an API request as per `self.retry_policy`, recording its outcome and latency in `self.telemetry`
+        :param insert: True for an insert request; a 409 Conflict after an attempt which may have been applied
+            means the insert succeeded, and None is returned
+        """
+        return self._call(request.methodId, request.execute, group_email_address, member_email_address,
+                          insert=insert)
+
+    def _call(self, operation, func, group_email_address=None, member_email_address=None, calls=1, insert=False):
+        # [attempts, rate limited attempts, an attempt may have been applied]
+        attempts = [0, 0, False]
+
+        def attempt():
+            attempts[0] += 1
+            try:
+                return func()
+            except Exception as e:
+                if insert and attempts[2] and http_status(e) == 409:
+                    return None
+                attempts[1] += is_rate_limited(e)
+                attempts[2] = attempts[2] or is_ambiguous(e)
+                raise
+
+        start = time.monotonic()
+        try:
+            ret = self.retry_policy.call(attempt, calls=calls)
+        except Exception as e:
+            status = http_status(e)
+            # 304 Not Modified is the expected answer of a revalidation
+            self.telemetry.record(
+                operation, group_email_address, member_email_address, 'ok' if status == 304 else 'error', status,
+                time.monotonic() - start, attempts[0] - 1, attempts[1])
+            raise
+        self.telemetry.record(
+            operation, group_email_address, member_email_address, 'ok', 200, time.monotonic() - start,
+            attempts[0] - 1, attempts[1])
+        return ret
+
+    @property
+    def logs(self):
+        """Messages of the last operations, oldest first, see `Telemetry.logs`"""
+        return self.telemetry.logs
+
+    @logs.setter
+    def logs(self, messages):
+        self.telemetry.set_messages(messages)
+
+    def clear_logs(self):
+        self.telemetry.clear_messages()
 
-    def logging(self, msg):
-        self.logs.append(msg)
+    def logging(self, msg, group_email_address=None, member_email_address=None):
+        self.telemetry.log(msg, group_email_address, member_email_address)
@@ -0,0 +1,234 @@
+"""
+Command line interface of GGroupsAndSettings, the ggroups-helper console script.
+
+Only the standard library is imported at start-up; the Google API client is imported when a subcommand needs
+to call the APIs, so --help and --dry-run runs start fast.
+"""
+from __future__ import print_function
+import argparse
+import csv
+import itertools
+import json
+import sys
+
+# If modifying these scopes, delete your previously saved credentials
+# at ~/.credentials/gsuite_utilities_ggroups.json
+LOCAL_CREDENTIAL_FILE = 'gsuite_utilities_ggroups.json'
+CLIENT_SECRET_FILE = 'client_secret_gsuite_utilities.json'
+
+# Number of member addresses read from the input and sent per call of add/remove_group_members
+DEFAULT_CHUNK_SIZE = 1000
+
+# Same as ggroups.ROLES, not imported to keep the start-up fast
+ROLES = ["OWNER", "MANAGER", "MEMBER"]
+
+
+def iter_addresses(fp, invalid=None):
+    """Yield the email addresses of the first column of a CSV file, one row at a time.
+    Blank rows, comments (#) and an 'email' header are skipped.
+    :param fp: file object open for reading text
+    :param invalid: optional list to be filled with the values which are not email addresses
+    """
+    for row in csv.reader(fp):
+        value = row[0].strip() if row else ''
+        if not value or value.startswith('#') or value.lower() == 'email':
+            continue
+        if '@' not in value.strip('@'):
+            if invalid is not None:
+                invalid.append(value)
+            continue
+        yield value
+
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items of the iterable, without reading ahead of the current chunk."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def open_input(path):
+    return sys.stdin if path == '-' else open(path, newline='')
+
+
+def member_addresses(args, invalid):
+    """Yield the member addresses given as arguments, then the ones of --file"""
+    for value in args.members:
+        if '@' in value.strip('@'):
+            yield value
+        else:
+            invalid.append(value)
+    if args.file:
+        fp = open_input(args.file)
+        try:
+            for value in iter_addresses(fp, invalid):
+                yield value
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+
+
+def groups_helper(args):
+    """
+    :return: `GGroupsAndSettings` authorized as per the command line arguments
+    """
+    from gsuite_utils.ggroups import GGroupsAndSettings
+    if args.service_account_file:
+        from gsuite_utils.credentials import default_manager
+        default_manager.start_refresher()
+    return GGroupsAndSettings(args.client_secret_file, args.credential_file,
+                              service_account_file=args.service_account_file, subject=args.subject)
+
+
+def print_logs(helper):
+    for msg in helper.logs:
+        print(msg, file=sys.stderr)
+
+
+def cmd_info(args):
+    helper = groups_helper(args)
+    ret = 0
+    for group_email_address in args.groups:
+        info = helper.group_info(group_email_address, fields=args.fields)
+        if info['group'] is None or info.get('members') is None:
+            ret = 1
+        print(json.dumps(dict(info, email=group_email_address), sort_keys=True))
+    print_logs(helper)
+    return ret
+
+
+def cmd_create(args):
+    spec = {'name': args.name, 'description': args.description, 'is_public': args.public}
+    helper = groups_helper(args)
+    results = helper.create_groups({g: spec for g in args.groups}, apply_defaults=not args.no_defaults)
+    print_logs(helper)
+    for group_email_address, r in results.items():
+        print('{} {}'.format(group_email_address, 'created' if r['succeeded'] else 'FAILED'))
+    return 0 if all(r['succeeded'] for r in results.values()) else 1
+
+
+def cmd_members(args):
+    """add or remove the members, one chunk of the input at a time"""
+    invalid = []
+    helper = None if args.dry_run else groups_helper(args)
+    counts = {'succeeded': 0, 'failed': 0}
+    for chunk in chunked(member_addresses(args, invalid), args.chunk_size):
+        if helper is None:
+            counts['succeeded'] += len(chunk)
+            continue
+        results = {}
+        if args.command == 'add':
+            helper.add_group_members(args.group, chunk, role=args.role, batch=args.batch, results=results)
+        else:
+            helper.remove_group_members(args.group, chunk, batch=args.batch, results=results)
+        succeeded = sum(1 for ok in results.values() if ok)
+        counts['succeeded'] += succeeded
+        counts['failed'] += len(chunk) - succeeded
+        print_logs(helper)
+        helper.telemetry.clear()
+
+    for value in invalid:
+        print('ERROR: Invalid email address {}'.format(value), file=sys.stderr)
+    print('{} {} {}, {} failed, {} invalid'.format(
+        args.group, counts['succeeded'], 'valid' if args.dry_run else 'done', counts['failed'], len(invalid)),
+        file=sys.stderr)
+    return 0 if not counts['failed'] and not invalid else 1
+
+
+def cmd_settings(args):
+    settings = {}
+    if args.file:
+        fp = open_input(args.file)
+        try:
+            settings.update(json.load(fp))
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+    for pair in args.settings:
+        key, sep, value = pair.partition('=')
+        if not sep or not key:
+            print('ERROR: Invalid setting {}, expected KEY=VALUE'.format(pair), file=sys.stderr)
+            return 1
+        settings[key] = value
+    if not settings:
+        print('ERROR: No settings given', file=sys.stderr)
+        return 1
+    if args.dry_run:
+        print(json.dumps(settings, sort_keys=True))
+        return 0
+
+    helper = groups_helper(args)
+    ret = helper.update_group_settings(args.group, settings)
+    print_logs(helper)
+    if ret is None:
+        return 1
+    print('{} {}'.format(args.group, 'updated' if ret else 'unchanged'))
+    return 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Manage Google Groups and their settings')
+    parser.add_argument('--client-secret-file', default=CLIENT_SECRET_FILE,
+                        help='OAuth client secret file (default: {})'.format(CLIENT_SECRET_FILE))
+    parser.add_argument('--credential-file', default=LOCAL_CREDENTIAL_FILE,
+                        help='File name of the stored credentials in ~/.credentials (default: {})'.format(
+                            LOCAL_CREDENTIAL_FILE))
+    parser.add_argument('--service-account-file',
+                        help='JSON key file of a service account with domain-wide delegation, for unattended runs')
+    parser.add_argument('--subject', help='Email address of the admin user impersonated by the service account')
+    subparsers = parser.add_subparsers(dest='command', metavar='COMMAND')
+    subparsers.required = True
+
+    p = subparsers.add_parser('info', help='Print the group, its settings and members as JSON, one line per group')
+    p.add_argument('groups', nargs='+', metavar='GROUP', help='Email address of the group')
+    p.add_argument('--fields', help='Member fields to download, e.g. email,role,type')
+    p.set_defaults(func=cmd_info)
+
+    p = subparsers.add_parser('create', help='Create groups with the default settings')
+    p.add_argument('groups', nargs='+', metavar='GROUP', help='Email address of the group')
+    p.add_argument('--name', help='Name of the groups (default: their email address)')
+    p.add_argument('--description', help='Description of the groups')
+    p.add_argument('--public', action='store_true', help='Allow posts from external email addresses')
+    p.add_argument('--no-defaults', action='store_true', help='Do not apply the default group settings')
+    p.set_defaults(func=cmd_create)
+
+    for command, action in (('add', 'Add'), ('remove', 'Remove')):
+        p = subparsers.add_parser(command, help='{} members of a group'.format(action))
+        p.add_argument('group', metavar='GROUP', help='Email address of the group')
+        p.add_argument('members', nargs='*', metavar='MEMBER', help='Email address of a member')
+        p.add_argument('-f', '--file',
+                       help='CSV file with the member email addresses in the first column; - for stdin')
+        p.add_argument('--batch', action='store_true', help='Send the requests in batches')
+        p.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                       help='Number of members read from the input at a time (default: {})'.format(
+                           DEFAULT_CHUNK_SIZE))
+        p.add_argument('--dry-run', action='store_true', help='Only validate the email addresses')
+        if command == 'add':
+            p.add_argument('--role', choices=ROLES, default='MEMBER', help='Role of the members (default: MEMBER)')
+        p.set_defaults(func=cmd_members)
+
+    p = subparsers.add_parser('settings', help='Update the settings of a group')
+    p.add_argument('group', metavar='GROUP', help='Email address of the group')
+    p.add_argument('settings', nargs='*', metavar='KEY=VALUE', help='Setting, e.g. whoCanJoin=INVITED_CAN_JOIN')
+    p.add_argument('-f', '--file', help='JSON file of the settings; - for stdin')
+    p.add_argument('--dry-run', action='store_true', help='Only print the settings to be applied')
+    p.set_defaults(func=cmd_settings)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'chunk_size', 1) < 1:
+        parser.error('--chunk-size must be at least 1')
+    if args.command in ('add', 'remove') and not args.members and not args.file:
+        parser.error('MEMBER or --file is required')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
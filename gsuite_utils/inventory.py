@@ -0,0 +1,147 @@
+from __future__ import print_function
+import json
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# Progress of the scan of the groups of a customer
+ScanCheckpoint = namedtuple('ScanCheckpoint', ['page_token', 'complete', 'started_at'])
+
+
+class GroupInventory(object):
+    """Snapshot of the groups of a domain with their settings and members, in SQLite.
+
+    It also keeps the page token of the scan in progress, so an interrupted scan resumes from the last
+    page instead of starting over.
+    """
+
+    def __init__(self, path, clock=time.time):
+        """
+        :param path: SQLite database file; ':memory:' for a snapshot of the process only
+        """
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS groups ('
+                ' group_email TEXT PRIMARY KEY, is_public INTEGER, scanned_at REAL NOT NULL, payload TEXT NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS groups_public ON groups (is_public)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS scans ('
+                ' customer TEXT PRIMARY KEY, page_token TEXT, complete INTEGER NOT NULL, started_at REAL NOT NULL)')
+
+    def put(self, info, is_public):
+        """
+        :param info: `dict` of {group, settings, members} as returned by `GGroupsAndSettings.group_info`
+        :param is_public: True if it is a public group; None if unknown
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO groups (group_email, is_public, scanned_at, payload) VALUES (?, ?, ?, ?)',
+                (info['group']['email'].lower(), None if is_public is None else int(is_public), self._clock(),
+                 json.dumps(info, separators=(',', ':'))))
+
+    def get(self, group_email_address):
+        """
+        :return: `dict` of {group, settings, members}; None if not in the snapshot
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT payload FROM groups WHERE group_email = ?', (group_email_address.lower(),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def group_emails(self, since=None):
+        """
+        :param since: optional time; only the groups scanned at or after it
+        :return: set of the email addresses of the groups in the snapshot
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT group_email FROM groups WHERE scanned_at >= ?', (since or 0,)).fetchall()
+        return {row[0] for row in rows}
+
+    def remove_stale(self, before, keep=()):
+        """Drop the groups not scanned since a time, e.g. the groups deleted from the domain since the last scan
+        :param before: time; the groups scanned before it are dropped
+        :param keep: email addresses of groups to keep anyway, e.g. the ones which failed to be scanned
+        :return: number of groups dropped
+        """
+        keep = [g.lower() for g in keep]
+        with self._lock, self._db:
+            return self._db.execute(
+                'DELETE FROM groups WHERE scanned_at < ? AND group_email NOT IN ({})'.format(
+                    ', '.join('?' * len(keep))), [before] + keep).rowcount
+
+    def groups(self, is_public=None):
+        """
+        :param is_public: True or False to get only the public or non-public groups; None for all of them
+        :return: list of `dict` of {group, settings, members}, ordered by email address
+        """
+        query, args = 'SELECT payload FROM groups', ()
+        if is_public is not None:
+            query, args = query + ' WHERE is_public = ?', (int(is_public),)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY group_email', args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def public_groups(self):
+        """
+        :return: email addresses of the public groups, see `GGroupsAndSettings.is_group_public`
+        """
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT group_email FROM groups WHERE is_public = 1 ORDER BY group_email').fetchall()
+        return [row[0] for row in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM groups').fetchone()[0]
+
+    def start_scan(self, customer):
+        """Record the start of a new scan of the groups of the customer
+        :param customer: customer ID of the scan, e.g. 'my_customer'
+        :return: `ScanCheckpoint` of the first page
+        """
+        checkpoint = ScanCheckpoint(None, False, self._clock())
+        with self._lock, self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO scans (customer, page_token, complete, started_at) VALUES (?, ?, 0, ?)',
+                (customer, None, checkpoint.started_at))
+        return checkpoint
+
+    def get_checkpoint(self, customer):
+        """
+        :param customer: customer ID of the scan, e.g. 'my_customer'
+        :return: `ScanCheckpoint` of the last scan; None if never scanned
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT page_token, complete, started_at FROM scans WHERE customer = ?', (customer,)).fetchone()
+        return ScanCheckpoint(row[0], bool(row[1]), row[2]) if row else None
+
+    def save_checkpoint(self, customer, page_token, complete=False):
+        """
+        :param page_token: token of the next page of groups to scan
+        :param complete: True once the last page is scanned
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                'UPDATE scans SET page_token = ?, complete = ? WHERE customer = ?',
+                (page_token, int(complete), customer))
+
+    def reset(self, customer=None):
+        """Drop the groups and the checkpoint, to start a new scan
+        :param customer: drop only the checkpoint of this customer, keeping the groups until they are scanned again
+        """
+        with self._lock, self._db:
+            if customer is None:
+                self._db.execute('DELETE FROM groups')
+                self._db.execute('DELETE FROM scans')
+            else:
+                self._db.execute('DELETE FROM scans WHERE customer = ?', (customer,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
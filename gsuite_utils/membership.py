@@ -0,0 +1,87 @@
+from __future__ import print_function
+import threading
+
+
+class MembershipIndex(object):
+    """In-memory index of the members of groups, by member and by group.
+
+    It is filled from a membership snapshot (e.g. a `GroupInventory`) or from members().list sweeps, and kept
+    current by the writes of a `GGroupsAndSettings` using it. Email addresses are stored in lower case.
+    """
+
+    def __init__(self):
+        self._groups_by_member = {}
+        self._members_by_group = {}
+        self._lock = threading.Lock()
+
+    def load_group(self, group_email_address, members):
+        """Replace the members of a group.
+        :param members: list of members as returned by members().list, with at least 'email'
+        """
+        group = group_email_address.lower()
+        members = {m['email'].lower(): m.get('role') for m in members if m.get('email')}
+        with self._lock:
+            for email in self._members_by_group.get(group, {}):
+                self._discard(email, group)
+            self._members_by_group[group] = members
+            for email, role in members.items():
+                self._groups_by_member.setdefault(email, {})[group] = role
+
+    def load_inventory(self, inventory):
+        """Load the members of all the groups of a snapshot.
+        :param inventory: `GroupInventory`
+        :return: number of groups loaded
+        """
+        count = 0
+        for info in inventory.groups():
+            self.load_group(info['group']['email'], info.get('members') or [])
+            count += 1
+        return count
+
+    def add(self, group_email_address, member_email_address, role=None):
+        """Add a member to a group, or change its role"""
+        group, email = group_email_address.lower(), member_email_address.lower()
+        with self._lock:
+            self._members_by_group.setdefault(group, {})[email] = role
+            self._groups_by_member.setdefault(email, {})[group] = role
+
+    def remove(self, group_email_address, member_email_address):
+        group, email = group_email_address.lower(), member_email_address.lower()
+        with self._lock:
+            self._members_by_group.get(group, {}).pop(email, None)
+            self._discard(email, group)
+
+    def drop_group(self, group_email_address):
+        group = group_email_address.lower()
+        with self._lock:
+            for email in self._members_by_group.pop(group, {}):
+                self._discard(email, group)
+
+    def _discard(self, email, group):
+        groups = self._groups_by_member.get(email)
+        if groups is not None:
+            groups.pop(group, None)
+            if not groups:
+                del self._groups_by_member[email]
+
+    def groups_of(self, member_email_address):
+        """
+        :return: `dict` of {group_email_address: role} of the groups the member is directly in
+        """
+        with self._lock:
+            return dict(self._groups_by_member.get(member_email_address.lower(), {}))
+
+    def members_of(self, group_email_address):
+        """
+        :return: `dict` of {member_email_address: role}; empty if the group is not indexed
+        """
+        with self._lock:
+            return dict(self._members_by_group.get(group_email_address.lower(), {}))
+
+    def __contains__(self, group_email_address):
+        """True if the members of the group are indexed"""
+        return group_email_address.lower() in self._members_by_group
+
+    def __len__(self):
+        """Number of distinct members"""
+        return len(self._groups_by_member)
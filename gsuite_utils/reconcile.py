@@ -0,0 +1,89 @@
+from __future__ import print_function
+
+
+def diff_settings(current_settings, desired_settings):
+    """
+    :param current_settings: `dict` of the current group settings
+    :param desired_settings: `dict` of the desired group settings
+    :return: `dict` containing only the settings to be changed
+    """
+    return {k: v for k, v in desired_settings.items() if current_settings.get(k) != v}
+
+
+def diff_members(current_members, desired_members):
+    """Compare members by email address (case insensitive) in O(n). Members without an email address, e.g. a
+    CUSTOMER member standing for all the users of the organisation, are left as they are.
+    :param current_members: iterable of member dicts {email, role, ...}, e.g. from `_iter_group_members`
+    :param desired_members: `dict` of {member_email_address: role}
+    :return: (insert, delete, update_role) where
+        insert is a list of {email, role},
+        delete is a list of email addresses,
+        update_role is a list of {email, role, from}.
+    """
+    desired = {email.lower(): (email, role) for email, role in desired_members.items()}
+    insert, delete, update_role = [], [], []
+
+    for member in current_members:
+        if not member.get('email'):
+            continue
+        key = member['email'].lower()
+        if key not in desired:
+            delete.append(member['email'])
+            continue
+        email, role = desired.pop(key)
+        if member.get('role') != role:
+            update_role.append({'email': member['email'], 'role': role, 'from': member.get('role')})
+
+    insert = [{'email': email, 'role': role} for email, role in desired.values()]
+    return insert, delete, update_role
+
+
+def plan_group_changes(group_email_address, current_group, current_settings, current_members,
+                       desired_settings=None, desired_members=None):
+    """
+    :param group_email_address: email address of the group
+    :param current_group: group payload; None if the group does not exist
+    :param current_settings: `dict` of the current group settings; None if the group does not exist
+    :param current_members: iterable of the current member dicts
+    :param desired_settings: optional `dict` of desired settings; None to leave the settings unchanged
+    :param desired_members: optional `dict` of {member_email_address: role}; None to leave the members unchanged
+    :return: `dict` plan of {group, create, settings, insert, delete, update_role}
+    """
+    plan = {
+        'group': group_email_address,
+        'create': current_group is None,
+        'settings': {},
+        'insert': [],
+        'delete': [],
+        'update_role': [],
+    }
+    if desired_settings:
+        plan['settings'] = diff_settings(current_settings or {}, desired_settings)
+    if desired_members is not None:
+        plan['insert'], plan['delete'], plan['update_role'] = diff_members(current_members or [], desired_members)
+    return plan
+
+
+def is_plan_empty(plan):
+    """Return True if there is nothing to change
+    """
+    return not (plan['create'] or plan['settings'] or plan['insert'] or plan['delete'] or plan['update_role'])
+
+
+def describe_plan(plan):
+    """
+    :param plan: `dict` returned by `plan_group_changes`
+    :return: list of human readable lines, one per change
+    """
+    lines = []
+    if plan['create']:
+        lines.append('+ group {}'.format(plan['group']))
+    for k, v in sorted(plan['settings'].items()):
+        lines.append('~ setting {} = {}'.format(k, v))
+    for m in plan['insert']:
+        lines.append('+ {} {}'.format(m['role'], m['email']))
+    for email in plan['delete']:
+        lines.append('- {}'.format(email))
+    for m in plan['update_role']:
+        lines.append('~ {} {} -> {}'.format(m['email'], m['from'], m['role']))
+    return lines
@@ -0,0 +1,185 @@
+from __future__ import print_function
+import email.utils
+import json
+import random
+import socket
+import threading
+import time
+
+# HTTP statuses worth retrying: rate limited or server side errors
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+# Reasons of a 403 response meaning the quota is exceeded rather than the access is denied
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded')
+
+# Admin SDK default quota is 2400 queries per minute per user per project
+# See https://developers.google.com/admin-sdk/directory/v1/limits
+ADMIN_SDK_QPS = 2400 / 60.0
+
+
+def http_status(e):
+    """
+    :param e: exception raised by an API call
+    :return: HTTP status of the error response as `int`; None if it is not an HTTP error
+    """
+    status = getattr(getattr(e, 'resp', None), 'status', None)
+    return int(status) if status is not None else None
+
+
+def error_reasons(e):
+    """
+    :param e: exception raised by an API call
+    :return: list of the `reason` of the errors in the error response
+    """
+    try:
+        content = e.content.decode('utf-8') if isinstance(e.content, bytes) else e.content
+        return [err.get('reason') for err in json.loads(content)['error'].get('errors', [])]
+    except Exception:
+        return []
+
+
+def is_rate_limited(e):
+    """
+    :param e: exception raised by an API call
+    :return: True if the call failed because the quota was exceeded
+    """
+    status = http_status(e)
+    return status == 429 or (status == 403 and any(r in RATE_LIMIT_REASONS for r in error_reasons(e)))
+
+
+def is_retryable(e):
+    """
+    :param e: exception raised by an API call
+    :return: True if the call may succeed when retried
+    """
+    if isinstance(e, (ConnectionError, socket.timeout)):
+        return True
+    return http_status(e) in RETRYABLE_STATUSES or is_rate_limited(e)
+
+
+def is_ambiguous(e):
+    """
+    :param e: exception raised by an API call
+    :return: True if the request may have been applied although the call failed, e.g. on a 503 or a lost
+        connection; a retried insert may then fail with 409 Conflict
+    """
+    return is_retryable(e) and not is_rate_limited(e)
+
+
+def retry_after(e):
+    """
+    :param e: exception raised by an API call
+    :return: seconds to wait requested by the `Retry-After` header; None if not provided
+    """
+    resp = getattr(e, 'resp', None)
+    value = resp.get('retry-after') if hasattr(resp, 'get') else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time()) if parsed else None
+
+
+class TokenBucket(object):
+    """Client side rate limiter shared by threads; `acquire` blocks until enough tokens are available."""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (burst size); defaults to `rate`
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        :param tokens: number of tokens to take, e.g. the number of calls in a batch
+        :return: seconds spent waiting
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # a request larger than the bucket waits for a full bucket, then leaves the balance negative
+                # so the next requests wait until all its tokens are paid back
+                needed = min(tokens, self.capacity)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return waited
+                wait = (needed - self._tokens) / self.rate
+            self._sleep(wait)
+            waited += wait
+
+
+class RetryPolicy(object):
+    """Retries API calls failing with a retryable error, with exponential backoff and full jitter."""
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=32.0, rate_limiter=None,
+                 sleep=time.sleep, rand=random.random):
+        """
+        :param max_attempts: maximum number of attempts of a call, including the first one
+        :param base_delay: seconds to wait before the first retry (before jitter)
+        :param max_delay: maximum seconds to wait between two attempts
+        :param rate_limiter: optional `TokenBucket` acquired before each attempt
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limiter = rate_limiter
+        self._sleep = sleep
+        self._rand = rand
+
+    def delay(self, attempt, e=None):
+        """
+        :param attempt: number of the attempt which just failed, starting from 1
+        :param e: the error of the failed attempt
+        :return: seconds to wait before the next attempt
+        """
+        requested = retry_after(e) if e is not None else None
+        if requested is not None:
+            return min(requested, self.max_delay)
+        return min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * self._rand()
+
+    def wait(self, attempt, e=None):
+        self._sleep(self.delay(attempt, e))
+
+    def throttle(self, calls=1):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(calls)
+
+    def execute(self, request):
+        """
+        :param request: API request, e.g. service.groups().get(groupKey=...)
+        :return: response of request.execute()
+        """
+        return self.call(request.execute)
+
+    def call(self, func, calls=1):
+        """Call func until it succeeds, it fails with an error not worth retrying or attempts are exhausted.
+        :param func: function without arguments making the API call(s)
+        :param calls: number of API calls made by func, e.g. the size of a batch
+        :return: return value of func
+        """
+        attempt = 1
+        while True:
+            self.throttle(calls)
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_attempts or not is_retryable(e):
+                    raise
+                self.wait(attempt, e)
+                attempt += 1
+
+
+# Shared by all API calls to the Admin SDK in the process, so the rate limit applies to all of them
+default_policy = RetryPolicy(rate_limiter=TokenBucket(ADMIN_SDK_QPS))
@@ -0,0 +1,129 @@
+from __future__ import print_function
+import json
+import os
+import threading
+
+from apiclient import discovery
+from googleapiclient import discovery_cache
+
+# Parsed discovery documents shared by every registry in the process, keyed by (api, version).
+_DOCUMENTS = {}
+_DOCUMENTS_LOCK = threading.Lock()
+
+
+def get_discovery_document(api, version, http=None, static_discovery=True, cache_dir=None):
+    """
+    Return the parsed discovery document of an API. Each API/version is parsed once per process.
+    :param api: name of the API, e.g. 'admin'
+    :param version: version of the API, e.g. 'directory_v1'
+    :param http: httplib2.Http used to download the document when it is not available locally
+    :param static_discovery: True to use the documents shipped with the API client (offline)
+    :param cache_dir: optional directory where downloaded documents are kept on disk
+    :return: discovery document in `dict`
+    """
+    key = (api, version)
+    with _DOCUMENTS_LOCK:
+        if key in _DOCUMENTS:
+            return _DOCUMENTS[key]
+
+    content = None
+    cache_file = os.path.join(cache_dir, '{}.{}.json'.format(api, version)) if cache_dir else None
+
+    if cache_file and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            content = f.read()
+
+    if content is None and static_discovery:
+        content = discovery_cache.get_static_doc(api, version)
+
+    if content is None:
+        if static_discovery:
+            raise ValueError('No static discovery document for {} {}'.format(api, version))
+        content = _download_discovery_document(api, version, http)
+        if cache_file:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            with open(cache_file, 'w') as f:
+                f.write(content)
+
+    document = json.loads(content)
+    with _DOCUMENTS_LOCK:
+        return _DOCUMENTS.setdefault(key, document)
+
+
+def _download_discovery_document(api, version, http):
+    for uri_template in (discovery.DISCOVERY_URI, discovery.V2_DISCOVERY_URI):
+        uri = uri_template.replace('{api}', api).replace('{apiVersion}', version)
+        resp, content = http.request(uri)
+        if resp.status < 400:
+            return content.decode('utf-8') if isinstance(content, bytes) else content
+    raise ValueError('Unable to download discovery document for {} {}'.format(api, version))
+
+
+class ServiceRegistry(object):
+    """Builds each API service object once and hands out the same instance afterwards.
+
+    A registry is bound to one authorized http object. Share a registry between helpers
+    using the same http object to build each service once per process.
+    """
+
+    def __init__(self, http, static_discovery=True, cache_dir=None, root_url=None):
+        """
+        :param http: authorized httplib2.Http used by the services
+        :param static_discovery: True to build services offline from the documents shipped with the API client
+        :param cache_dir: optional directory where downloaded discovery documents are kept on disk
+        :param root_url: optional root URL replacing the one of the discovery documents, e.g. a local fake
+        """
+        self.http = http
+        self.static_discovery = static_discovery
+        self.cache_dir = cache_dir
+        self.root_url = root_url
+        self._services = {}
+        self._lock = threading.Lock()
+
+    def for_http(self, http):
+        """
+        :param http: another authorized httplib2.Http, e.g. one per thread
+        :return: a new `ServiceRegistry` with the same settings bound to `http`
+        """
+        return ServiceRegistry(
+            http, static_discovery=self.static_discovery, cache_dir=self.cache_dir, root_url=self.root_url)
+
+    def get(self, api, version):
+        """
+        :param api: name of the API, e.g. 'admin'
+        :param version: version of the API, e.g. 'directory_v1'
+        :return: API service object
+        """
+        key = (api, version)
+        service = self._services.get(key)
+        if service is None:
+            document = get_discovery_document(
+                api, version, http=self.http, static_discovery=self.static_discovery, cache_dir=self.cache_dir)
+            if self.root_url:
+                document = dict(document, rootUrl=self.root_url)
+            with self._lock:
+                service = self._services.get(key)
+                if service is None:
+                    service = discovery.build_from_document(document, http=self.http)
+                    self._services[key] = service
+        return service
+
+    def collection(self, api, version, name):
+        """
+        :param api: name of the API, e.g. 'admin'
+        :param version: version of the API, e.g. 'directory_v1'
+        :param name: name of the resource collection, e.g. 'members'
+        :return: resource collection of the API service, built once
+        """
+        key = (api, version, name)
+        resource = self._services.get(key)
+        if resource is None:
+            resource = getattr(self.get(api, version), name)()
+            with self._lock:
+                resource = self._services.setdefault(key, resource)
+        return resource
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
@@ -0,0 +1,233 @@
+from __future__ import print_function
+import bisect
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+# Default number of event records kept in memory
+DEFAULT_CAPACITY = 10000
+
+# Default number of messages kept in memory, apart from the event records so the records of the successful
+# calls never push the error messages out
+DEFAULT_MESSAGE_CAPACITY = 100000
+
+# Upper bounds in seconds of the buckets of the latency histograms, from 1ms to about 1 minute, 20% apart
+LATENCY_BUCKETS = tuple(0.001 * 1.2 ** i for i in range(61))
+
+# Percentiles reported by `Telemetry.summary`
+PERCENTILES = (50, 95, 99)
+
+# An API call, or a message of an operation;
+# status is 'ok' or 'error', http_status and latency (seconds) are None if unknown
+EventRecord = namedtuple('EventRecord', [
+    'time', 'operation', 'group', 'member', 'status', 'http_status', 'latency', 'retries', 'message'])
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies in fixed buckets, so its size does not grow with the number of calls."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency):
+        self.counts[bisect.bisect_left(self.buckets, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, p):
+        """
+        :param p: percentile, e.g. 95
+        :return: upper bound of the bucket of the percentile, at most the highest latency; None if empty
+        """
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+
+class OperationMetrics(object):
+    """Counters and latency histogram of one operation, e.g. 'directory.members.insert'."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.quota_errors = 0
+        self.latency = LatencyHistogram()
+
+    def to_dict(self):
+        ret = {
+            'calls': self.calls,
+            'errors': self.errors,
+            'retries': self.retries,
+            'quota_errors': self.quota_errors,
+            'total_seconds': self.latency.total,
+        }
+        for p in PERCENTILES:
+            ret['p{}'.format(p)] = self.latency.percentile(p)
+        return ret
+
+
+class LoggingSink(object):
+    """Sends the event records to a stdlib logger, errors at ERROR level and the others at DEBUG level."""
+
+    def __init__(self, logger=None):
+        self.logger = logger or logging.getLogger('gsuite_utils')
+
+    def __call__(self, record):
+        level = logging.ERROR if record.status == 'error' else logging.DEBUG
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, record.message or '{} {} {}'.format(
+                record.operation, record.group or '', record.http_status or ''), extra={'event': record._asdict()})
+
+
+class JsonlSink(object):
+    """Appends the event records to a file as newline-delimited JSON."""
+
+    def __init__(self, fp):
+        """
+        :param fp: file object open for writing text, or a file name to append to
+        """
+        self._own = not hasattr(fp, 'write')
+        self.fp = open(fp, 'a') if self._own else fp
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record._asdict(), separators=(',', ':'))
+        with self._lock:
+            self.fp.write(line + '\n')
+
+    def close(self):
+        if self._own:
+            self.fp.close()
+
+
+class Telemetry(object):
+    """Structured event records in a bounded ring buffer, with per-operation counters and latency histograms.
+
+    Each record is also passed to the sinks, e.g. `LoggingSink` or `JsonlSink`, as it happens.
+    The messages of the records are also kept in `logs`, a list of their own. Once it holds a quarter more
+    than `message_capacity` messages, the oldest ones are dropped down to `message_capacity` at once, so the
+    list is not shifted for each new message.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, sinks=(), clock=time.time,
+                 message_capacity=DEFAULT_MESSAGE_CAPACITY):
+        """
+        :param capacity: number of records kept in memory; the oldest ones are dropped first
+        :param sinks: functions called with each `EventRecord`
+        :param message_capacity: number of messages kept; the oldest ones are dropped first
+        """
+        self.sinks = list(sinks)
+        self.metrics = {}
+        self.logs = []
+        self.message_capacity = message_capacity
+        self._records = deque(maxlen=capacity)
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def record(self, operation, group=None, member=None, status='ok', http_status=None, latency=None,
+               retries=0, quota_errors=0, message=None):
+        """
+        :param operation: name of the operation, e.g. the methodId of the API request
+        :param latency: seconds spent, including the retries
+        :param retries: number of attempts after the first one
+        :param quota_errors: number of attempts failed because the quota was exceeded
+        :return: `EventRecord`
+        """
+        record = EventRecord(
+            self._clock(), operation, group, member, status, http_status, latency, retries, message)
+        with self._lock:
+            self._records.append(record)
+            if message is not None:
+                self.logs.append(message)
+                self._trim_messages()
+            if operation is not None:
+                metrics = self.metrics.get(operation)
+                if metrics is None:
+                    metrics = self.metrics[operation] = OperationMetrics()
+                metrics.calls += 1
+                metrics.errors += status == 'error'
+                metrics.retries += retries
+                metrics.quota_errors += quota_errors
+                if latency is not None:
+                    metrics.latency.add(latency)
+        for sink in self.sinks:
+            sink(record)
+        return record
+
+    def log(self, message, group=None, member=None, status='error'):
+        """Record a message which is not about a single API call"""
+        return self.record(None, group, member, status, message=message)
+
+    def records(self, status=None):
+        """
+        :param status: optional 'ok' or 'error'
+        :return: list of the records in memory, oldest first
+        """
+        with self._lock:
+            return [r for r in self._records if status is None or r.status == status]
+
+    def _trim_messages(self):
+        if len(self.logs) > self.message_capacity + self.message_capacity // 4:
+            del self.logs[:len(self.logs) - self.message_capacity]
+
+    def messages(self):
+        """
+        :return: the last `message_capacity` messages recorded, oldest first
+        """
+        with self._lock:
+            return self.logs[-self.message_capacity:] if self.message_capacity else []
+
+    def set_messages(self, messages):
+        """Replace the messages, e.g. with the ones of a previous run
+        """
+        with self._lock:
+            self.logs[:] = messages
+            self._trim_messages()
+
+    def clear_messages(self):
+        with self._lock:
+            del self.logs[:]
+
+    def summary(self):
+        """
+        :return: `dict` of {operation: {calls, errors, retries, quota_errors, total_seconds, p50, p95, p99}}
+        """
+        with self._lock:
+            return {operation: m.to_dict() for operation, m in self.metrics.items()}
+
+    def format_summary(self):
+        """
+        :return: list of lines, one per operation, the ones with the most time spent first
+        """
+        summary = self.summary()
+        lines = ['{:<40} {:>7} {:>6} {:>7} {:>6} {:>9} {:>8} {:>8} {:>8}'.format(
+            'operation', 'calls', 'errors', 'retries', 'quota', 'total(s)', 'p50(ms)', 'p95(ms)', 'p99(ms)')]
+        for operation, m in sorted(summary.items(), key=lambda i: -i[1]['total_seconds']):
+            lines.append('{:<40} {:>7} {:>6} {:>7} {:>6} {:>9.2f} {:>8} {:>8} {:>8}'.format(
+                operation, m['calls'], m['errors'], m['retries'], m['quota_errors'], m['total_seconds'],
+                *('-' if m[k] is None else '{:.1f}'.format(m[k] * 1000) for k in ('p50', 'p95', 'p99'))))
+        return lines
+
+    def dump(self, fp):
+        """Write the summary as JSON, e.g. to be scraped by a monitoring agent"""
+        json.dump(self.summary(), fp, indent=2, sort_keys=True)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self.metrics.clear()
+            del self.logs[:]
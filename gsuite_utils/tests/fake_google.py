@@ -0,0 +1,471 @@
+"""
+In-process fake of the Google APIs used by gsuite_utils, served over local HTTP.
+"""
+import base64
+import email.parser
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import httplib2
+
+STATUS_TEXT = {
+    200: 'OK', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+    409: 'Conflict', 410: 'Gone', 429: 'Too Many Requests', 500: 'Internal Server Error', 503: 'Service Unavailable',
+}
+
+
+class FakeGoogleApi(object):
+    """State and request handling of the fake, independent of the transport."""
+
+    def __init__(self):
+        self.groups = {}
+        self.settings = {}
+        self.members = {}
+        self.activities = []
+        # {calendar_id: {event_id: (change number, event)}}
+        self.calendar_events = {}
+        self.calendar_changes = 0
+        self.requests = []
+        self.faults = []
+        # {access_token: subject} issued by the token endpoint, the subjects of the token requests,
+        # and the subjects of the requests authorized with an issued token
+        self.access_tokens = {}
+        self.token_requests = []
+        self.authorized_subjects = []
+        self.token_lifetime = 3600
+        # {channel_id: channel} of the watch requests; see `notify`
+        self.channels = {}
+        self.max_channel_ttl = 6 * 3600
+        # seconds added to each HTTP request, and the highest number of HTTP requests served at once
+        self.latency = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.RLock()
+        self._routes = [
+            ('GET', r'admin/directory/v1/groups/([^/]+)', self._get_group),
+            ('GET', r'admin/directory/v1/groups', self._list_groups),
+            ('POST', r'admin/directory/v1/groups', self._insert_group),
+            ('GET', r'admin/directory/v1/groups/([^/]+)/members', self._list_members),
+            ('POST', r'admin/directory/v1/groups/([^/]+)/members', self._insert_member),
+            ('PATCH', r'admin/directory/v1/groups/([^/]+)/members/([^/]+)', self._patch_member),
+            ('DELETE', r'admin/directory/v1/groups/([^/]+)/members/([^/]+)', self._delete_member),
+            ('GET', r'groups/v1/groups/([^/]+)', self._get_settings),
+            ('GET', r'admin/reports/v1/activity/users/([^/]+)/applications/([^/]+)', self._list_activities),
+            ('GET', r'calendar/v3/calendars/([^/]+)/events', self._list_calendar_events),
+            ('PUT', r'groups/v1/groups/([^/]+)', self._update_settings),
+            ('POST', r'admin/reports/v1/activity/users/([^/]+)/applications/([^/]+)/watch', self._watch_activities),
+            ('POST', r'calendar/v3/calendars/([^/]+)/events/watch', self._watch_calendar_events),
+            ('POST', r'(?:admin/reports_v1|calendar/v3)/channels/stop', self._stop_channel),
+        ]
+
+    def add_group(self, group_email_address, members=(), settings=None):
+        """
+        :param group_email_address: email address of the group
+        :param members: list of member dicts with at least 'email'
+        :param settings: dict of group settings
+        """
+        with self._lock:
+            self.groups[group_email_address] = {
+                'kind': 'admin#directory#group', 'email': group_email_address, 'name': group_email_address,
+                'id': group_email_address, 'etag': '"1"', 'directMembersCount': str(len(members)),
+            }
+            self.settings[group_email_address] = dict(settings or {}, email=group_email_address)
+            self.members[group_email_address] = {}
+            for m in members:
+                self._store_member(group_email_address, m)
+
+    def remove_group(self, group_email_address):
+        with self._lock:
+            for groups in (self.groups, self.settings, self.members):
+                groups.pop(group_email_address, None)
+
+    def add_activity(self, time, actor, event_name, parameters=None, unique_qualifier=None, application='drive'):
+        """
+        :param time: RFC3339 timestamp of the activity, e.g. '2020-01-01T00:00:00.000Z'
+        :param parameters: `dict` of event parameters
+        """
+        with self._lock:
+            activity = {
+                'kind': 'admin#reports#activity',
+                'id': {'time': time, 'uniqueQualifier': unique_qualifier or str(len(self.activities)),
+                       'applicationName': application, 'customerId': 'C01'},
+                'actor': {'email': actor, 'profileId': actor},
+                'events': [{'type': 'access', 'name': event_name, 'parameters': [
+                    {'name': k, 'boolValue': v} if isinstance(v, bool) else {'name': k, 'value': v}
+                    for k, v in (parameters or {}).items()]}],
+            }
+            self.activities.append(activity)
+            return activity
+
+    def add_calendar_event(self, calendar_id, event_id, start, end, summary='', status='confirmed'):
+        """
+        :param start: RFC3339 timestamp, or 'YYYY-MM-DD' for an all-day event
+        :param end: RFC3339 timestamp, or 'YYYY-MM-DD' for an all-day event
+        :param status: 'cancelled' for a deleted event
+        """
+        key = 'date' if len(start) == 10 else 'dateTime'
+        with self._lock:
+            self.calendar_changes += 1
+            event = {'kind': 'calendar#event', 'id': event_id, 'status': status, 'summary': summary,
+                     'start': {key: start}, 'end': {key: end}}
+            self.calendar_events.setdefault(calendar_id, {})[event_id] = (self.calendar_changes, event)
+            return event
+
+    def notify(self, kind, key=None, state='exists', message_number=None, token=None):
+        """Post a notification to the address of each channel watching the resource, as Google would.
+        :param kind: 'drive' or 'calendar'
+        :param key: calendar ID of calendar channels
+        :param state: X-Goog-Resource-State, e.g. 'sync' or 'exists'
+        :param message_number: X-Goog-Message-Number; the next one of the channel if None
+        :param token: X-Goog-Channel-Token; the one of the channel if None
+        :return: list of (channel_id, HTTP status of the response)
+        """
+        with self._lock:
+            channels = [c for c in self.channels.values() if c['resource'] == (kind, key)]
+            for c in channels:
+                c['messages'] += 1
+        ret = []
+        for c in channels:
+            response, _ = httplib2.Http().request(c['address'], 'POST', headers={
+                'X-Goog-Channel-ID': c['id'],
+                'X-Goog-Channel-Token': c['token'] if token is None else token,
+                'X-Goog-Channel-Expiration': time.strftime(
+                    '%a, %d %b %Y %H:%M:%S GMT', time.gmtime(int(c['expiration']) / 1000)),
+                'X-Goog-Resource-ID': c['resourceId'],
+                'X-Goog-Resource-State': state,
+                'X-Goog-Message-Number': str(c['messages'] if message_number is None else message_number),
+            })
+            ret.append((c['id'], response.status))
+        return ret
+
+    def inject_fault(self, status, count=1, path=None, headers=None, reason=None, applied=False):
+        """Make the next `count` requests matching `path` (regex; any request if None) fail with `status`.
+        :param applied: True to handle the requests before failing, e.g. a write applied but not acknowledged
+        """
+        with self._lock:
+            self.faults.extend([(status, path, headers or {}, reason, applied)] * count)
+
+    def _pop_fault(self, path):
+        """
+        :return: (response, applied) of the first fault matching the path; None if none
+        """
+        with self._lock:
+            for i, (status, pattern, headers, reason, applied) in enumerate(self.faults):
+                if pattern is None or re.match(pattern, path):
+                    del self.faults[i]
+                    code, resp_headers, body = self._error(status, 'Injected fault', reason)
+                    return (code, dict(resp_headers, **headers), body), applied
+        return None
+
+    def _store_member(self, group_email_address, body):
+        """
+        :param body: member with 'email'; or with 'id' only, e.g. {'id': 'C01', 'type': 'CUSTOMER'}
+        """
+        member = {
+            'kind': 'admin#directory#member', 'role': body.get('role', 'MEMBER'),
+            'type': body.get('type', 'USER'), 'status': 'ACTIVE', 'id': body.get('email') or body['id'], 'etag': '"1"',
+        }
+        if body.get('email'):
+            # CUSTOMER members (all the users of the organisation) have no email
+            member['email'] = body['email']
+        self.members[group_email_address][member['id'].lower()] = member
+        return member
+
+    def serve(self, method, url, headers, body):
+        """Handle an HTTP request, applying the latency and counting the requests in flight.
+        """
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            return self.handle(method, url, headers, body)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def handle(self, method, url, headers, body):
+        """
+        :return: (status, headers, body) of the response
+        """
+        parts = urlsplit(url)
+        path = unquote(parts.path.lstrip('/'))
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        with self._lock:
+            self.requests.append((method, path))
+        fault = self._pop_fault(path)
+        if fault is not None:
+            response, applied = fault
+            if applied:
+                self._route(method, path, query, headers, body)
+            return response
+        return self._route(method, path, query, headers, body)
+
+    def _route(self, method, path, query, headers, body):
+        if method == 'POST' and path == 'token':
+            return self._token(body)
+        authorization = headers.get('Authorization') or headers.get('authorization') or ''
+        if authorization.startswith('Bearer '):
+            with self._lock:
+                self.authorized_subjects.append(self.access_tokens.get(authorization[len('Bearer '):]))
+        if method == 'POST' and re.match(r'batch(/.*)?$', path):
+            return self._batch(headers, body)
+        for route_method, pattern, handler in self._routes:
+            match = re.match(pattern + '$', path)
+            if route_method == method and match:
+                payload = json.loads(body) if body else None
+                return handler(query, headers, payload, *match.groups())
+        return self._error(404, 'Not Found: {} {}'.format(method, path))
+
+    @staticmethod
+    def _json(status, payload):
+        return status, {'Content-Type': 'application/json; charset=UTF-8'}, json.dumps(payload)
+
+    def _etagged(self, headers, payload):
+        """Return the payload with an etag of its content, or 304 if the client has it already"""
+        content = json.dumps({k: v for k, v in payload.items() if k != 'etag'}, sort_keys=True)
+        payload = dict(payload, etag='"{}"'.format(hashlib.md5(content.encode('utf-8')).hexdigest()))
+        if headers.get('If-None-Match') == payload['etag']:
+            return 304, {}, ''
+        return self._json(200, payload)
+
+    def _error(self, status, message, reason=None):
+        error = {'message': message, 'reason': reason or 'error'}
+        return self._json(status, {'error': {'code': status, 'message': message, 'errors': [error]}})
+
+    def _token(self, body):
+        """OAuth 2.0 token endpoint of service accounts; the signature of the JWT assertion is not verified"""
+        form = {k: v[0] for k, v in parse_qs(body).items()}
+        if form.get('grant_type') != 'urn:ietf:params:oauth:grant-type:jwt-bearer':
+            return self._json(400, {'error': 'unsupported_grant_type'})
+        payload = form['assertion'].split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)).decode('utf-8'))
+        subject = claims.get('sub', claims['iss'])
+        with self._lock:
+            self.token_requests.append(subject)
+            access_token = 'token-{}'.format(len(self.access_tokens))
+            self.access_tokens[access_token] = subject
+        return self._json(200, {'access_token': access_token, 'token_type': 'Bearer',
+                                'expires_in': self.token_lifetime})
+
+    def _get_group(self, query, headers, body, group_key):
+        if group_key not in self.groups:
+            return self._error(404, 'Resource Not Found: groupKey')
+        return self._etagged(headers, self.groups[group_key])
+
+    def _list_groups(self, query, headers, body):
+        if 'customer' not in query and 'domain' not in query:
+            return self._error(400, 'Bad Request')
+        groups = sorted(self.groups.values(), key=lambda g: g['email'])
+        start = int(query.get('pageToken') or 0)
+        end = start + int(query.get('maxResults') or 200)
+        payload = {'kind': 'admin#directory#groups', 'groups': groups[start:end]}
+        if end < len(groups):
+            payload['nextPageToken'] = str(end)
+        return self._json(200, payload)
+
+    def _insert_group(self, query, headers, body):
+        if body['email'] in self.groups:
+            return self._error(409, 'Entity already exists.')
+        self.add_group(body['email'])
+        self.groups[body['email']].update((k, body[k]) for k in ('name', 'description') if k in body)
+        return self._json(200, self.groups[body['email']])
+
+    def _list_members(self, query, headers, body, group_key):
+        if group_key not in self.members:
+            return self._error(404, 'Resource Not Found: groupKey')
+        members = list(self.members[group_key].values())
+        start = int(query.get('pageToken', 0))
+        end = start + int(query.get('maxResults', 200))
+        match = re.search(r'members\(([^)]*)\)', query.get('fields', ''))
+        if match:
+            keys = match.group(1).split(',')
+            members = [{k: m[k] for k in keys if k in m} for m in members]
+        payload = {'kind': 'admin#directory#members', 'members': members[start:end]}
+        if end < len(members):
+            payload['nextPageToken'] = str(end)
+        return self._etagged(headers, payload)
+
+    def _insert_member(self, query, headers, body, group_key):
+        if group_key not in self.members:
+            return self._error(404, 'Resource Not Found: groupKey')
+        if not body.get('email'):
+            return self._error(400, 'Invalid Input: memberKey')
+        if body['email'].lower() in self.members[group_key]:
+            return self._error(409, 'Member already exists.')
+        return self._json(200, self._store_member(group_key, body))
+
+    def _patch_member(self, query, headers, body, group_key, member_key):
+        if group_key not in self.members:
+            return self._error(404, 'Resource Not Found: groupKey')
+        if member_key.lower() not in self.members[group_key]:
+            return self._error(404, 'Resource Not Found: memberKey')
+        member = self.members[group_key][member_key.lower()]
+        member.update(body)
+        return self._json(200, member)
+
+    def _delete_member(self, query, headers, body, group_key, member_key):
+        if group_key not in self.members:
+            return self._error(404, 'Resource Not Found: groupKey')
+        if member_key.lower() not in self.members[group_key]:
+            return self._error(404, 'Resource Not Found: memberKey')
+        del self.members[group_key][member_key.lower()]
+        return 204, {}, ''
+
+    def _list_activities(self, query, headers, body, user_key, application_name):
+        items = [
+            a for a in self.activities
+            if a['id']['applicationName'] == application_name
+            and (user_key == 'all' or a['actor']['email'] == user_key)
+            and a['id']['time'] >= query.get('startTime', '')
+            and ('endTime' not in query or a['id']['time'] < query['endTime'])
+            and ('eventName' not in query or any(e['name'] == query['eventName'] for e in a['events']))
+        ]
+        items.sort(key=lambda a: a['id']['time'], reverse=True)
+        start = int(query.get('pageToken', 0))
+        end = start + int(query.get('maxResults', 1000))
+        payload = {'kind': 'admin#reports#activities', 'items': items[start:end]}
+        if end < len(items):
+            payload['nextPageToken'] = str(end)
+        return self._json(200, payload)
+
+    def _list_calendar_events(self, query, headers, body, calendar_id):
+        if calendar_id not in self.calendar_events:
+            return self._error(404, 'Not Found')
+        changes = self.calendar_events[calendar_id].values()
+        if 'syncToken' in query:
+            if not query['syncToken'].isdigit():
+                return self._error(410, 'Sync token is no longer valid, a full sync is required.')
+            items = [e for seq, e in changes if seq > int(query['syncToken'])]
+        else:
+            def key(e, name):
+                return e[name].get('dateTime', e[name].get('date'))
+            items = [
+                e for _, e in changes
+                if e['status'] != 'cancelled'
+                and ('timeMin' not in query or key(e, 'end') > query['timeMin'])
+                and ('timeMax' not in query or key(e, 'start') < query['timeMax'])
+            ]
+            items.sort(key=lambda e: key(e, 'start'))
+        start = int(query.get('pageToken', 0))
+        end = start + int(query.get('maxResults', 250))
+        payload = {'kind': 'calendar#events', 'items': items[start:end]}
+        if end < len(items):
+            payload['nextPageToken'] = str(end)
+        else:
+            payload['nextSyncToken'] = str(self.calendar_changes)
+        return self._json(200, payload)
+
+    def _get_settings(self, query, headers, body, group_key):
+        if group_key not in self.settings:
+            return self._error(400, 'Backend Error')
+        return self._etagged(headers, self.settings[group_key])
+
+    def _update_settings(self, query, headers, body, group_key):
+        if group_key not in self.settings:
+            return self._error(400, 'Backend Error')
+        self.settings[group_key].update(body)
+        return self._json(200, self.settings[group_key])
+
+    def _watch(self, body, resource):
+        if body.get('type') != 'web_hook' or not body.get('address'):
+            return self._error(400, 'Invalid channel')
+        ttl = min(int(body.get('params', {}).get('ttl', self.max_channel_ttl)), self.max_channel_ttl)
+        with self._lock:
+            channel = {
+                'kind': 'api#channel', 'id': body['id'], 'resourceId': 'resource-{}'.format(len(self.channels)),
+                'resourceUri': '{}/{}'.format(*resource), 'token': body.get('token'),
+                'expiration': str(int((time.time() + ttl) * 1000)),
+            }
+            self.channels[body['id']] = dict(channel, address=body['address'], resource=resource, messages=0)
+        return self._json(200, channel)
+
+    def _watch_activities(self, query, headers, body, user_key, application_name):
+        return self._watch(body, (application_name, None))
+
+    def _watch_calendar_events(self, query, headers, body, calendar_id):
+        if calendar_id not in self.calendar_events:
+            return self._error(404, 'Not Found')
+        return self._watch(body, ('calendar', calendar_id))
+
+    def _stop_channel(self, query, headers, body):
+        with self._lock:
+            channel = self.channels.get(body['id'])
+            if channel is None or channel['resourceId'] != body.get('resourceId'):
+                return self._error(404, 'Channel not found')
+            del self.channels[body['id']]
+        return 204, {}, ''
+
+    def _batch(self, headers, body):
+        content_type = headers.get('Content-Type') or headers.get('content-type')
+        message = email.parser.Parser().parsestr('Content-Type: {}\r\n\r\n{}'.format(content_type, body))
+        boundary = 'batch_fake_google'
+        out = []
+        for part in message.get_payload():
+            request = part.get_payload()
+            head, _, sub_body = request.partition('\r\n\r\n') if '\r\n\r\n' in request else request.partition('\n\n')
+            lines = head.splitlines()
+            sub_method, sub_url = lines[0].split(' ')[:2]
+            sub_headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            status, resp_headers, resp_body = self.handle(sub_method, sub_url, sub_headers, sub_body)
+            resp_headers = dict(resp_headers, **{'Content-Length': str(len(resp_body.encode('utf-8')))})
+            content_id = part['Content-ID'].strip('<>')
+            out.append('--{}\r\nContent-Type: application/http\r\nContent-ID: <response-{}>\r\n\r\n'
+                       'HTTP/1.1 {} {}\r\n{}\r\n{}\r\n'.format(
+                           boundary, content_id, status, STATUS_TEXT.get(status, ''),
+                           ''.join('{}: {}\r\n'.format(k, v) for k, v in resp_headers.items()), resp_body))
+        out.append('--{}--\r\n'.format(boundary))
+        return 200, {'Content-Type': 'multipart/mixed; boundary={}'.format(boundary)}, ''.join(out)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeGoogleServer(object):
+    """Serves a `FakeGoogleApi` on a local port; use `root_url` as the API root of a `ServiceRegistry`."""
+
+    def __init__(self, api=None):
+        self.api = api or FakeGoogleApi()
+        api = self.api
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def _dispatch(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode('utf-8') if length else ''
+                status, headers, payload = api.serve(self.command, self.path, self.headers, body)
+                payload = payload.encode('utf-8')
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.root_url = 'http://127.0.0.1:{}/'.format(self._server.server_address[1])
+        self._thread = threading.Thread(target=self._server.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,66 @@
+"""
+Test gsuite_utils.activity_store
+"""
+from gsuite_utils.activity_store import DriveActivityStore
+
+
+def _activity(time, unique_id, actor, *events):
+    return {
+        'id': {'time': time, 'uniqueQualifier': unique_id},
+        'actor': {'email': actor},
+        'events': [{'name': name, 'parameters': [
+            {'name': k, 'boolValue': v} if isinstance(v, bool) else {'name': k, 'value': v}
+            for k, v in parameters.items()]} for name, parameters in events],
+    }
+
+
+ACTIVITIES = [
+    _activity('2020-01-01T10:00:00.000Z', '1', 'alice@example.com',
+              ('edit', {'doc_id': 'd1', 'doc_title': 'Plan', 'owner': 'alice@example.com', 'primary_event': True})),
+    _activity('2020-01-02T10:00:00.000Z', '2', 'alice@example.com',
+              ('change_document_visibility', {'doc_id': 'd1', 'owner': 'alice@example.com',
+                                              'visibility': 'people_with_link', 'visibility_change': 'external'}),
+              ('change_user_access', {'doc_id': 'd1', 'owner': 'alice@example.com',
+                                      'target_user': 'eve@other.com', 'visibility_change': 'external'})),
+    _activity('2020-01-02T11:00:00.000Z', '3', 'bob@example.com',
+              ('change_user_access', {'doc_id': 'd2', 'owner': 'bob@example.com',
+                                      'target_user': 'carol@example.com', 'visibility_change': 'none'})),
+    _activity('2020-01-09T10:00:00.000Z', '4', 'bob@example.com',
+              ('change_document_visibility', {'doc_id': 'd1', 'owner': 'alice@example.com',
+                                              'visibility': 'public_on_the_web', 'visibility_change': 'external'})),
+]
+
+
+def test_drive_activity_store(tmpdir):
+    """
+    Test DriveActivityStore.add_activities and the queries
+    """
+    path = str(tmpdir.join('drive.db'))
+    store = DriveActivityStore(path)
+    assert store.add_activities(ACTIVITIES, batch_size=2) == 5
+    # loading overlapping exports again stores only the new events
+    assert store.add_activities(ACTIVITIES[2:] + [
+        _activity('2020-01-09T12:00:00.000Z', '5', None, ('download', {'doc_id': 'd2'}))]) == 1
+    store.close()
+
+    store = DriveActivityStore(path)
+    assert len(store) == 6
+    assert [e['event'] for e in store.events(actor='alice@example.com')] == [
+        'change_document_visibility', 'change_user_access', 'edit']
+    edit = store.events(doc_id='d1', event='edit')[0]
+    assert edit['primary_event'] == 1 and edit['doc_title'] == 'Plan' and edit['visibility'] is None
+    assert [e['unique_id'] for e in store.events(doc_id='d1', start_time='2020-01-02T00:00:00.000Z', limit=2)] == [
+        '4', '2']
+
+    # external shares of the documents of alice in the week of Jan 6
+    shares = store.external_shares(owner='alice@example.com', start_time='2020-01-06T00:00:00.000Z',
+                                   end_time='2020-01-13T00:00:00.000Z')
+    assert [(e['actor'], e['visibility']) for e in shares] == [('bob@example.com', 'public_on_the_web')]
+    assert [e['target_user'] for e in store.external_shares(owner='alice@example.com')] == [
+        None, None, 'eve@other.com']
+    assert store.external_shares(owner='bob@example.com') == []
+
+    assert store.actor_counts() == {'alice@example.com': 3, 'bob@example.com': 2, None: 1}
+    assert store.actor_counts('2020-01-02', '2020-01-09') == {'alice@example.com': 2, 'bob@example.com': 1}
+    assert store.actor_counts(event='change_user_access') == {'alice@example.com': 1, 'bob@example.com': 1}
+    store.close()
@@ -0,0 +1,41 @@
+"""
+Test gsuite_utils.cache
+"""
+from gsuite_utils.cache import StateCache
+
+
+def test_state_cache(tmpdir):
+    """
+    Test StateCache get, put, touch, invalidate and eviction
+    """
+    now = [1000.0]
+    path = str(tmpdir.join('state.db'))
+    cache = StateCache(path, ttl=10, max_age=100, clock=lambda: now[0])
+
+    assert cache.get('group', 'group1@example.com') is None
+    cache.put('group', 'Group1@example.com', {'email': 'group1@example.com'}, '"e1"')
+    cache.put('members', 'group1@example.com', [{'email': 'user1@example.com'}], '"e2"')
+    cache.put('members:email,role', 'group1@example.com', [{'email': 'user1@example.com'}])
+
+    entry = cache.get('group', 'group1@example.com')
+    assert entry.payload == {'email': 'group1@example.com'} and entry.etag == '"e1"' and entry.fresh
+
+    # stale after ttl, fresh again when revalidated
+    now[0] += 50
+    assert not cache.get('group', 'group1@example.com').fresh
+    cache.touch('group', 'group1@example.com')
+    assert cache.get('group', 'group1@example.com').fresh
+
+    # kept on disk
+    cache.close()
+    cache = StateCache(path, ttl=10, max_age=100, clock=lambda: now[0])
+    assert cache.get('members', 'group1@example.com').payload == [{'email': 'user1@example.com'}]
+
+    cache.invalidate('group1@example.com', 'members')
+    assert cache.get('members', 'group1@example.com') is None
+    assert cache.get('members:email,role', 'group1@example.com') is None
+    assert cache.get('group', 'group1@example.com') is not None
+
+    # evicted after max_age
+    now[0] += 200
+    assert cache.get('group', 'group1@example.com') is None
@@ -0,0 +1,41 @@
+"""
+Test gsuite_utils.calendar_store
+"""
+from datetime import datetime
+
+from gsuite_utils.calendar_store import CalendarEventStore, event_start_key
+
+
+def _event(event_id, start, status='confirmed'):
+    return {'id': event_id, 'status': status, 'start': {'dateTime': start}, 'end': {'dateTime': start}}
+
+
+def test_event_start_key():
+    """
+    Test event_start_key converts to UTC
+    """
+    assert event_start_key(_event('1', '2020-01-02T09:00:00+10:00')) == '2020-01-01T23:00:00'
+    assert event_start_key(_event('1', '2020-01-02T09:00:00Z')) == '2020-01-02T09:00:00'
+    assert event_start_key({'start': {'date': '2020-01-02'}}) == '2020-01-02T00:00:00'
+
+
+def test_calendar_event_store(tmpdir):
+    """
+    Test CalendarEventStore.apply_changes, events and clear
+    """
+    store = CalendarEventStore(str(tmpdir.join('calendar.db')))
+    assert store.get_sync_token('primary') is None
+
+    store.apply_changes('primary', [
+        _event('1', '2020-01-01T09:00:00Z'), _event('2', '2020-01-02T09:00:00Z'), _event('3', '2020-02-01T09:00:00Z')
+    ], 'token1')
+    store.apply_changes('primary', [_event('2', '2020-01-02T09:00:00Z', 'cancelled'), _event('4', '2020-01-01T08:00:00Z')],
+                        'token2')
+
+    assert store.get_sync_token('primary') == 'token2'
+    events = store.events('primary', datetime(2020, 1, 1), datetime(2020, 2, 1))
+    assert [e['id'] for e in events] == ['4', '1']
+
+    store.clear('primary')
+    assert store.get_sync_token('primary') is None
+    assert store.events('primary', datetime(2020, 1, 1), datetime(2021, 1, 1)) == []
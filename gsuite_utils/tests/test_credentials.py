@@ -0,0 +1,182 @@
+"""
+Test gsuite_utils.credentials
+"""
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import rsa
+
+from gsuite_utils import credentials as credentials_module
+from gsuite_utils import ggroups
+from gsuite_utils.credentials import CredentialManager
+from gsuite_utils.ggroups import GGroupsAndSettings
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+
+
+class FakeCredentials(object):
+    def __init__(self):
+        self.access_token = 'token'
+        self.token_expiry = None
+        self.refreshed = 0
+        self.authorized = []
+
+    def authorize(self, http):
+        self.authorized.append(http)
+        return http
+
+    def refresh(self, http):
+        time.sleep(0.01)
+        self.refreshed += 1
+        self.token_expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+
+
+@pytest.fixture(scope='function')
+def loaded(monkeypatch):
+    loaded = []
+
+    def get_credentials(local_credential_file, client_secret_file, scopes, application_name):
+        loaded.append(local_credential_file)
+        return FakeCredentials()
+
+    monkeypatch.setattr(credentials_module, 'get_credentials', get_credentials)
+    return loaded
+
+
+def test_credential_manager_http(loaded):
+    """
+    Test CredentialManager.http loads each credential file once and keeps one http object per thread
+    """
+    manager = CredentialManager(http_factory=object)
+    args = ('a.json', 'secret.json', ['scope1', 'scope2'], 'app')
+
+    http = manager.http(*args)
+    assert manager.http(*args) is http
+    assert manager.http('b.json', 'secret.json', 'scope1', 'app') is not http
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        https = list(executor.map(lambda _: manager.http(*args), range(20)))
+    assert http not in https
+    assert len(set(map(id, https))) <= 4
+    assert loaded == ['a.json', 'b.json']
+    assert len(manager.credentials(*args).authorized) == 1 + len(set(map(id, https)))
+
+    manager.clear()
+    assert manager.http(*args) is not http
+    assert loaded == ['a.json', 'b.json', 'a.json']
+
+
+def test_credential_manager_refresh(loaded):
+    """
+    Test CredentialManager.http refreshes an expired access token once for all the threads
+    """
+    manager = CredentialManager(http_factory=object)
+    args = ('a.json', 'secret.json', 'scope1', 'app')
+    credentials = manager.credentials(*args)
+    credentials.token_expiry = datetime(2020, 1, 1)
+
+    barrier = threading.Barrier(8)
+
+    def http(_):
+        barrier.wait()
+        return manager.http(*args)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(http, range(8)))
+    assert credentials.refreshed == 1
+
+
+@pytest.fixture(scope='module')
+def private_key():
+    return rsa.newkeys(1024)[1].save_pkcs1().decode('utf-8')
+
+
+@pytest.fixture(scope='function')
+def fake_server():
+    with FakeGoogleServer() as server:
+        server.api.add_group('group1@example.com', members=[{'email': 'user1@example.com', 'role': 'MEMBER'}])
+        yield server
+
+
+@pytest.fixture(scope='function')
+def service_account_file(private_key, fake_server, tmp_path):
+    path = tmp_path / 'service_account.json'
+    path.write_text(json.dumps({
+        'type': 'service_account',
+        'client_email': 'worker@project.iam.gserviceaccount.com',
+        'client_id': '1234',
+        'private_key_id': 'key1',
+        'private_key': private_key,
+        'token_uri': fake_server.root_url + 'token',
+    }))
+    return str(path)
+
+
+def test_credential_manager_service_account(service_account_file, fake_server):
+    """
+    Test CredentialManager.service_account_http requests one access token per impersonated subject
+    """
+    manager = CredentialManager()
+    subjects = ['admin{}@example.com'.format(i % 3) for i in range(12)]
+
+    def get_group(subject):
+        http = manager.service_account_http(service_account_file, ggroups.SCOPES, subject)
+        service = ServiceRegistry(http, root_url=fake_server.root_url).get('admin', 'directory_v1')
+        return service.groups().get(groupKey='group1@example.com').execute()['email']
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        assert set(executor.map(get_group, subjects)) == {'group1@example.com'}
+
+    assert sorted(fake_server.api.token_requests) == sorted(set(subjects))
+    assert sorted(fake_server.api.authorized_subjects) == sorted(subjects)
+    assert manager.service_account_credentials(service_account_file, ggroups.SCOPES, 'admin0@example.com') is \
+        manager.service_account_credentials(service_account_file, ggroups.SCOPES, 'admin0@example.com')
+
+
+def test_credential_manager_refresh_expiring(service_account_file, fake_server, capsys):
+    """
+    Test CredentialManager refreshes the access tokens in use ahead of their expiry, also in the background
+    """
+    now = [datetime.now(timezone.utc).replace(tzinfo=None)]
+    manager = CredentialManager(clock=lambda: now[0])
+    manager.service_account_http(service_account_file, ggroups.SCOPES, 'admin@example.com')
+    assert fake_server.api.token_requests == ['admin@example.com']
+
+    assert manager.refresh_expiring() == 0
+    now[0] += timedelta(minutes=56)
+    assert manager.refresh_expiring(margin=timedelta(minutes=5)) == 1
+    assert fake_server.api.token_requests == ['admin@example.com'] * 2
+
+    # failures are reported on stderr, not to mix with exports on stdout
+    now[0] += timedelta(minutes=56)
+    fake_server.api.inject_fault(500, path='^token$')
+    assert manager.refresh_expiring(margin=timedelta(minutes=5)) == 0
+    out, err = capsys.readouterr()
+    assert out == '' and 'unable to refresh the access token' in err
+
+    now[0] += timedelta(minutes=56)
+    manager.start_refresher(interval=0.01)
+    try:
+        deadline = time.time() + 5
+        while len(fake_server.api.token_requests) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        manager.stop_refresher()
+    assert fake_server.api.token_requests == ['admin@example.com'] * 3
+
+
+def test_ggroups_service_account(service_account_file, fake_server, monkeypatch):
+    """
+    Test GGroupsAndSettings authorizes its requests as the subject impersonated by the service account
+    """
+    monkeypatch.setattr(ggroups, 'default_manager', CredentialManager())
+    helper = GGroupsAndSettings(None, None, service_account_file=service_account_file, subject='admin@example.com')
+    helper.services = ServiceRegistry(helper.http, root_url=fake_server.root_url)
+
+    assert [m['email'] for m in helper.group_info('group1@example.com')['members']] == ['user1@example.com']
+    assert set(fake_server.api.authorized_subjects) == {'admin@example.com'}
+    assert fake_server.api.token_requests == ['admin@example.com']
@@ -0,0 +1,92 @@
+"""
+Test gsuite_utils.gcalendar
+"""
+import importlib
+import sys
+import types
+from collections import namedtuple
+from datetime import datetime
+
+import httplib2
+import pytest
+
+from gsuite_utils.calendar_store import CalendarEventStore
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.timeentries import TaskRules
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+
+
+@pytest.fixture(scope='function')
+def gcalendar(monkeypatch):
+    """gsuite_utils.gcalendar imported with a stand-in of the gsuite_tools package, which is not on PyPI"""
+    gsuite_tools = types.ModuleType('gsuite_tools')
+    gsuite_tools.TimeEntryData = namedtuple('TimeEntryData', ['year', 'month', 'day', 'interval', 'comment', 'taskid'])
+    gsuite_tools.worklog_time_spent = lambda secs: '{:02d}:{:02d}'.format(secs // 3600, secs % 3600 // 60)
+    monkeypatch.setitem(sys.modules, 'gsuite_tools', gsuite_tools)
+    monkeypatch.delitem(sys.modules, 'gsuite_utils.gcalendar', raising=False)
+    return importlib.import_module('gsuite_utils.gcalendar')
+
+
+@pytest.fixture(scope='function')
+def fake_server():
+    with FakeGoogleServer() as server:
+        for c in ('user1@example.com', 'user2@example.com'):
+            for i in range(1, 31):
+                server.api.add_calendar_event(
+                    c, '{}-{}'.format(c, i), '2020-01-{:02d}T09:00:00Z'.format(i), '2020-01-{:02d}T10:00:00Z'.format(i),
+                    summary='Meeting {}'.format(i))
+        yield server
+
+
+@pytest.fixture(scope='function')
+def calendar(gcalendar, fake_server, monkeypatch):
+    def authorize_gcalender(self):
+        return ServiceRegistry(httplib2.Http(), root_url=fake_server.root_url).get('calendar', 'v3')
+
+    monkeypatch.setattr(gcalendar.GCalendar, 'authorize_gcalender', authorize_gcalender)
+    monkeypatch.setattr(gcalendar, 'EVENTS_PAGE_SIZE', 7)
+    return gcalendar.GCalendar('sample_not_exist.json', 'sample_not_exist.json')
+
+
+def test_gcalendar_events_by_calendar(calendar):
+    """
+    Test GCalendar.gcalendar_events_by_calendar follows nextPageToken on every calendar
+    """
+    ret = calendar.gcalendar_events_by_calendar(
+        datetime(2020, 1, 1), datetime(2020, 1, 21), ['user1@example.com', 'user2@example.com'], max_workers=2)
+    assert [len(v) for v in ret.values()] == [20, 20]
+
+
+def test_sync_gcalendar_events(calendar, fake_server):
+    """
+    Test GCalendar.sync_gcalendar_events downloads only the changes, and all events when the token expired
+    """
+    store = CalendarEventStore(':memory:')
+    assert calendar.sync_gcalendar_events('user1@example.com', store) == 30
+
+    fake_server.api.add_calendar_event('user1@example.com', 'user1@example.com-1', '', '', status='cancelled')
+    fake_server.api.add_calendar_event('user1@example.com', 'new', '2020-01-05T11:00:00Z', '2020-01-05T12:00:00Z')
+    assert calendar.sync_gcalendar_events('user1@example.com', store) == 2
+    events = store.events('user1@example.com', datetime(2020, 1, 1), datetime(2020, 1, 6))
+    assert [e['id'] for e in events] == ['user1@example.com-{}'.format(i) for i in (2, 3, 4, 5)] + ['new']
+
+    store.apply_changes('user1@example.com', [], sync_token='expired')
+    assert calendar.sync_gcalendar_events('user1@example.com', store) == 30
+
+
+def test_retrieve_gcalendar_event_table(calendar):
+    """
+    Test GCalendar.retrieve_gcalendar_event_table and retrieve_gcalendar_event_data map summaries with the rules
+    """
+    rules = TaskRules([('Meeting 1$', 'T-1')], default_taskid='T-0')
+    table = calendar.retrieve_gcalendar_event_table(
+        datetime(2020, 1, 1), datetime(2020, 1, 11), rules, calendar_ids=['user1@example.com', 'user2@example.com'])
+    assert table.aggregate(by=('person', 'task')) == {
+        ('user1@example.com', 'T-1'): 3600, ('user1@example.com', 'T-0'): 9 * 3600,
+        ('user2@example.com', 'T-1'): 3600, ('user2@example.com', 'T-0'): 9 * 3600,
+    }
+
+    entries = calendar.retrieve_gcalendar_event_data(
+        datetime(2020, 1, 1), datetime(2020, 1, 3), {'InternalMeeting': 'T-9'}, calendar_ids=['user1@example.com'])
+    assert [(e.day, e.interval, e.comment, e.taskid) for e in entries] == [
+        (1, '01:00', 'Meeting 1', 'T-9'), (2, '01:00', 'Meeting 2', 'T-9')]
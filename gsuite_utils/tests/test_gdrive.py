@@ -0,0 +1,186 @@
+"""
+Test gsuite_utils.gdrive
+"""
+import csv
+import io
+import json
+from datetime import timedelta
+
+import httplib2
+import pytest
+
+from gsuite_utils import gdrive
+from gsuite_utils.gdrive import (
+    export_activities,
+    flatten_activity,
+    iter_gdrive_activities,
+    iter_gdrive_activities_parallel,
+    iter_new_gdrive_activities,
+    load_sync_state,
+    save_sync_state,
+    split_time_range,
+)
+from gsuite_utils.retry import RetryPolicy
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+
+
+@pytest.fixture(scope='function')
+def fake_server():
+    with FakeGoogleServer() as server:
+        for i in range(25):
+            server.api.add_activity(
+                '2020-01-01T00:00:{:02d}.000Z'.format(i), 'user{}@example.com'.format(i % 3),
+                'edit' if i % 2 else 'view',
+                {'doc_id': 'doc{}'.format(i), 'doc_title': 'Doc {}'.format(i), 'doc_type': 'document',
+                 'owner': 'owner@example.com', 'primary_event': True})
+        yield server
+
+
+@pytest.fixture(scope='function')
+def reports_service(fake_server):
+    return ServiceRegistry(httplib2.Http(), root_url=fake_server.root_url).get('admin', 'reports_v1')
+
+
+def test_iter_gdrive_activities(reports_service, fake_server):
+    """
+    Test iter_gdrive_activities follows nextPageToken and passes the filters
+    """
+    activities = list(iter_gdrive_activities(reports_service, max_results=10, retry_policy=RetryPolicy()))
+    assert len(activities) == 25
+    assert activities[0]['id']['time'] == '2020-01-01T00:00:24.000Z'
+    assert len(fake_server.api.requests) == 3
+
+    activities = list(iter_gdrive_activities(
+        reports_service, start_time='2020-01-01T00:00:10.000Z', end_time='2020-01-01T00:00:20.000Z',
+        event_name='edit', retry_policy=RetryPolicy()))
+    assert [a['id']['time'][17:19] for a in activities] == ['19', '17', '15', '13', '11']
+
+
+def test_flatten_activity_missing_parameters():
+    """
+    Test flatten_activity with missing parameters and several events
+    """
+    activity = {
+        'id': {'time': '2020-01-01T00:00:00.000Z', 'uniqueQualifier': '123'},
+        'actor': {'email': 'user1@example.com'},
+        'events': [
+            {'name': 'create', 'parameters': [{'name': 'doc_id', 'value': 'doc1'}, {'name': 'visibility', 'value': 'x'}]},
+            {'name': 'edit', 'parameters': [{'name': 'primary_event', 'boolValue': False}]},
+        ],
+    }
+    rows = list(flatten_activity(activity))
+    assert rows[0]['doc_id'] == 'doc1' and rows[0]['owner'] is None and 'visibility' not in rows[0]
+    assert rows[1]['event'] == 'edit' and rows[1]['primary_event'] is False
+
+
+def test_export_activities(reports_service):
+    """
+    Test export_activities in jsonl and csv
+    """
+    fp = io.StringIO()
+    assert export_activities(iter_gdrive_activities(reports_service, retry_policy=RetryPolicy()), fp) == 25
+    rows = [json.loads(line) for line in fp.getvalue().splitlines()]
+    assert rows[0]['doc_id'] == 'doc24' and rows[0]['actor'] == 'user0@example.com'
+
+    fp = io.StringIO()
+    assert export_activities(iter_gdrive_activities(reports_service, retry_policy=RetryPolicy()), fp, 'csv') == 25
+    rows = list(csv.DictReader(io.StringIO(fp.getvalue())))
+    assert rows[-1]['doc_title'] == 'Doc 0' and rows[-1]['primary_event'] == 'True'
+
+
+def test_split_time_range():
+    """
+    Test split_time_range
+    """
+    assert split_time_range('2020-01-01T00:00:00.000Z', '2020-01-01T02:30:00Z', timedelta(hours=1)) == [
+        ('2020-01-01T01:30:00.000Z', '2020-01-01T02:30:00.000Z'),
+        ('2020-01-01T00:30:00.000Z', '2020-01-01T01:30:00.000Z'),
+        ('2020-01-01T00:00:00.000Z', '2020-01-01T00:30:00.000Z'),
+    ]
+
+
+def test_iter_gdrive_activities_parallel(fake_server):
+    """
+    Test iter_gdrive_activities_parallel merges the windows in time order and fetches them concurrently
+    """
+    fake_server.api.latency = 0.01
+    # an activity returned twice by the API
+    duplicate = dict(fake_server.api.activities[10])
+    duplicate['id'] = dict(duplicate['id'], time='2020-01-01T00:00:10.000Z')
+    fake_server.api.activities.append(duplicate)
+
+    def service_factory():
+        return ServiceRegistry(httplib2.Http(), root_url=fake_server.root_url).get('admin', 'reports_v1')
+
+    activities = list(iter_gdrive_activities_parallel(
+        service_factory, '2020-01-01T00:00:00.000Z', '2020-01-01T00:01:00.000Z', window=timedelta(seconds=5),
+        max_workers=4, max_results=2, retry_policy=RetryPolicy()))
+
+    times = [a['id']['time'] for a in activities]
+    assert len(times) == 25
+    assert times == sorted(times, reverse=True)
+    assert fake_server.api.max_in_flight > 1
+
+
+def test_incremental_sync(reports_service, fake_server, tmpdir):
+    """
+    Test iter_new_gdrive_activities with a saved state, including an event made available late
+    """
+    state_file = str(tmpdir.join('state.json'))
+    state = load_sync_state(state_file)
+    assert state == {}
+
+    first = list(iter_new_gdrive_activities(reports_service, state, retry_policy=RetryPolicy()))
+    assert len(first) == 25
+    assert state['time'] == '2020-01-01T00:00:24.000Z'
+    save_sync_state(state_file, state)
+
+    # one new event, and one older event only made available now
+    fake_server.api.add_activity('2020-01-01T00:00:30.000Z', 'user1@example.com', 'view')
+    fake_server.api.add_activity('2020-01-01T00:00:20.000Z', 'user1@example.com', 'view', unique_qualifier='late')
+    del fake_server.api.requests[:]
+
+    state = load_sync_state(state_file)
+    new = list(iter_new_gdrive_activities(
+        reports_service, state, overlap=timedelta(seconds=10), retry_policy=RetryPolicy()))
+    assert [(a['id']['time'][17:19], a['id']['uniqueQualifier']) for a in new] == [('30', '25'), ('20', 'late')]
+    assert state['time'] == '2020-01-01T00:00:30.000Z'
+    assert len(fake_server.api.requests) == 1
+
+    # nothing new
+    assert list(iter_new_gdrive_activities(
+        reports_service, state, overlap=timedelta(seconds=10), retry_policy=RetryPolicy())) == []
+    assert state['time'] == '2020-01-01T00:00:30.000Z'
+
+
+def test_sync_failure(reports_service, fake_server, tmpdir, monkeypatch):
+    """
+    Test a sync failing after some events leaves the output and the state as they were, so the next run
+    appends each event once
+    """
+    output = str(tmpdir.join('events.jsonl'))
+    state_file = str(tmpdir.join('state.json'))
+    args = gdrive.parse_args(['--state-file', state_file, '--format', 'jsonl', '-o', output])
+    monkeypatch.setattr(gdrive, 'gdrive_service', lambda *args: reports_service)
+    iter_activities = gdrive.iter_gdrive_activities
+
+    def failing(*args, **kwargs):
+        for i, activity in enumerate(iter_activities(*args, **kwargs)):
+            if i == 10:
+                raise IOError('connection reset')
+            yield activity
+
+    monkeypatch.setattr(gdrive, 'iter_gdrive_activities', failing)
+    with pytest.raises(IOError):
+        gdrive.sync(args)
+    # no output, no state and no temporary file
+    assert tmpdir.listdir() == []
+
+    monkeypatch.setattr(gdrive, 'iter_gdrive_activities', iter_activities)
+    assert gdrive.sync(args) == 0
+    fake_server.api.add_activity('2020-01-01T00:00:30.000Z', 'user1@example.com', 'view')
+    assert gdrive.sync(args) == 0
+    with open(output) as fp:
+        times = [json.loads(line)['time'] for line in fp]
+    assert len(times) == 26 and len(set(times)) == 26
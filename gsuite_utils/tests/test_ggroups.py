@@ -1,10 +1,19 @@
 """
 Test gsuite_utils.ggroups
 """
+import httplib2
 import pytest
 from mock import Mock
 
+from gsuite_utils import ggroups
+from gsuite_utils.cache import StateCache
 from gsuite_utils.ggroups import GGroupsAndSettings
+from gsuite_utils.inventory import GroupInventory
+from gsuite_utils.membership import MembershipIndex
+from gsuite_utils.retry import RetryPolicy
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.telemetry import Telemetry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
 
 MOCK_GROUP = {
     'kind': 'admin#directory#group', 'name': 'group1@example.com', 'adminCreated': True,
@@ -52,6 +61,26 @@ def mock_helper():
     return helper
 
 
+@pytest.fixture(scope='function')
+def fake_server():
+    with FakeGoogleServer() as server:
+        server.api.add_group('test_group@example.com', members=MOCK_MEMBERS['members'][:3])
+        yield server
+
+
+@pytest.fixture(scope='function')
+def fake_helper(fake_server, monkeypatch):
+    # Talk to the local fake Google APIs with unauthorized http objects
+    http = httplib2.Http()
+    monkeypatch.setattr(GGroupsAndSettings, '_auth', Mock(side_effect=lambda *args: httplib2.Http()))
+    return GGroupsAndSettings(
+        client_secret_file="sample_not_exist.json",
+        local_credential_file="sample_not_exist.json",
+        services=ServiceRegistry(http, root_url=fake_server.root_url),
+        retry_policy=RetryPolicy(),
+    )
+
+
 def test_group_info(mock_helper):
     """
     Test GGroupsAndSettings.group_info
@@ -144,3 +173,509 @@ def test_remove_group_members(mock_helper):
     helper._remove_group_members = Mock(return_value=False)
 
     assert False == helper.remove_group_members(g_email_addr, u_email_addr)
+
+
+def test_add_group_members_batch(fake_helper, fake_server, monkeypatch):
+    """
+    Test GGroupsAndSettings.add_group_members in batch mode
+    """
+    monkeypatch.setattr(ggroups, 'MAX_BATCH_SIZE', 2)
+    helper = fake_helper
+    g_email_addr = "test_group@example.com"
+    new_users = ["new1@example.com", "new2@example.com", "new3@example.com"]
+
+    # case 1: pass, 3 requests sent in 2 batches
+    results = {}
+    assert True == helper.add_group_members(g_email_addr, new_users, batch=True, results=results)
+    assert results == {u: True for u in new_users}
+    assert fake_server.api.requests.count(('POST', 'batch')) == 2
+    assert set(fake_server.api.members[g_email_addr]) >= set(new_users)
+
+    # case 2: some members already exist
+    results = {}
+    assert False == helper.add_group_members(g_email_addr, ["user1@example.com", "new4@example.com"],
+                                             batch=True, results=results)
+    assert results == {"user1@example.com": False, "new4@example.com": True}
+    assert helper.logs == ['ERROR: Failed to add MEMBER user1@example.com to test_group@example.com. Already exist.']
+
+
+def test_remove_group_members_batch(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.remove_group_members in batch mode
+    """
+    helper = fake_helper
+    g_email_addr = "test_group@example.com"
+
+    results = {}
+    assert False == helper.remove_group_members(g_email_addr, ["user2@example.com", "nobody@example.com"],
+                                                batch=True, results=results)
+    assert results == {"user2@example.com": True, "nobody@example.com": False}
+    assert "user2@example.com" not in fake_server.api.members[g_email_addr]
+    assert helper.logs == ['ERROR: Failed to remove nobody@example.com from test_group@example.com. Member not found.']
+
+    # group does not exist
+    assert False == helper.remove_group_members("no_group@example.com", ["user1@example.com"], batch=True)
+    assert helper.logs[-1].endswith('Group not found.')
+
+
+def test_bulk_operations_across_groups(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.add_groups_members, remove_groups_members, groups_info and update_groups_settings
+    """
+    helper = fake_helper
+    groups = ["group{}@example.com".format(i) for i in range(6)]
+    for g in groups:
+        fake_server.api.add_group(g, settings={'whoCanJoin': 'CAN_REQUEST_TO_JOIN'})
+
+    results = {}
+    ret = helper.add_groups_members(
+        {g: ["a@example.com", "b@example.com"] for g in groups}, results=results, max_workers=3)
+    assert ret == {g: True for g in groups}
+    assert results[groups[0]] == {"a@example.com": True, "b@example.com": True}
+
+    ret = helper.remove_groups_members({groups[0]: ["a@example.com"], groups[1]: ["c@example.com"]}, batch=True)
+    assert ret == {groups[0]: True, groups[1]: False}
+    assert helper.logs == ['ERROR: Failed to remove c@example.com from group1@example.com. Member not found.']
+
+    info = helper.groups_info(groups[:2], max_workers=2)
+    assert [m['email'] for m in info[groups[0]]['members']] == ["b@example.com"]
+    assert len(info[groups[1]]['members']) == 2
+
+    ret = helper.update_groups_settings({g: {'whoCanJoin': 'INVITED_CAN_JOIN'} for g in groups[:2]})
+    assert ret[groups[0]]['whoCanJoin'] == 'INVITED_CAN_JOIN'
+
+    # the worker threads authorized their own http objects
+    assert GGroupsAndSettings._auth.call_count > 1
+
+
+def test_group_members_pagination(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.group_info follows nextPageToken, in full and streaming mode
+    """
+    helper = fake_helper
+    g_email_addr = "big_group@example.com"
+    fake_server.api.add_group(g_email_addr, members=[{'email': 'u{}@example.com'.format(i)} for i in range(25)])
+
+    ret = helper.group_info(g_email_addr, max_results=10, fields='email,role,type')
+    assert len(ret['members']) == 25
+    assert set(ret['members'][0]) == {'email', 'role', 'type'}
+
+    del fake_server.api.requests[:]
+    ret = helper.group_info(g_email_addr, stream=True, max_results=10)
+    members = ret['members']
+    assert next(members)['email'] == 'u0@example.com'
+    assert fake_server.api.requests[-1] == ('GET', 'admin/directory/v1/groups/big_group@example.com/members')
+    assert len(fake_server.api.requests) == 3  # group, settings and the first page only
+    assert len(list(members)) == 24
+    assert helper.logs == []
+
+
+def test_batch_retries_rate_limited_items(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.add_group_members in batch mode sends rate limited items again
+    """
+    helper = fake_helper
+    helper.retry_policy = RetryPolicy(sleep=lambda secs: None)
+    g_email_addr = "test_group@example.com"
+    fake_server.api.inject_fault(429, count=2, path=r'admin/directory/v1/groups/[^/]+/members$')
+
+    results = {}
+    assert True == helper.add_group_members(g_email_addr, ["new1@example.com", "new2@example.com"],
+                                            batch=True, results=results)
+    assert results == {"new1@example.com": True, "new2@example.com": True}
+    assert fake_server.api.requests.count(('POST', 'batch')) == 2
+    assert helper.logs == []
+
+
+def test_reconcile_group(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.reconcile_group
+    """
+    helper = fake_helper
+    g_email_addr = "test_group@example.com"
+    desired_members = {
+        'user1@example.com': 'OWNER',
+        'user2@example.com': 'MEMBER',
+        'user4@example.com': 'MEMBER',
+    }
+
+    # case 1: dry run changes nothing
+    plan = helper.reconcile_group(g_email_addr, {'whoCanJoin': 'INVITED_CAN_JOIN'}, desired_members, dry_run=True)
+    assert plan['insert'] == [{'email': 'user4@example.com', 'role': 'MEMBER'}]
+    assert plan['delete'] == ['user3@example.com']
+    assert 'succeeded' not in plan
+    assert len(fake_server.api.members[g_email_addr]) == 3
+
+    # case 2: apply
+    plan = helper.reconcile_group(g_email_addr, {'whoCanJoin': 'INVITED_CAN_JOIN'}, desired_members)
+    assert plan['succeeded'] is True
+    current = fake_server.api.members[g_email_addr]
+    assert {k: m['role'] for k, m in current.items()} == desired_members
+    assert fake_server.api.settings[g_email_addr]['whoCanJoin'] == 'INVITED_CAN_JOIN'
+
+    # case 3: nothing left to change, no write sent
+    del fake_server.api.requests[:]
+    plan = helper.reconcile_group(g_email_addr, {'whoCanJoin': 'INVITED_CAN_JOIN'}, desired_members)
+    assert 'succeeded' not in plan
+    assert all(method == 'GET' for method, _ in fake_server.api.requests)
+
+    # case 4: group created
+    plan = helper.reconcile_group("new_group@example.com", desired_members={'user1@example.com': 'OWNER'})
+    assert plan['create'] is True and plan['succeeded'] is True
+    assert list(fake_server.api.members["new_group@example.com"]) == ['user1@example.com']
+
+    # case 5: a CUSTOMER member, without email address, is kept
+    fake_server.api.add_group('org_group@example.com', members=[{'id': 'C01', 'type': 'CUSTOMER'}])
+    plan = helper.reconcile_group('org_group@example.com', desired_members={'user1@example.com': 'OWNER'})
+    assert plan['delete'] == [] and plan['succeeded'] is True
+    assert sorted(fake_server.api.members['org_group@example.com']) == ['c01', 'user1@example.com']
+    assert helper.logs == []
+
+
+def test_group_info_cached(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.group_info with a StateCache: fresh, revalidated and invalidated entries
+    """
+    now = [1000.0]
+    helper = fake_helper
+    helper.cache = StateCache(':memory:', ttl=60, clock=lambda: now[0])
+    g_email_addr = "test_group@example.com"
+
+    first = helper.group_info(g_email_addr)
+    assert len(first['members']) == 3
+
+    # fresh: no request
+    del fake_server.api.requests[:]
+    assert helper.group_info(g_email_addr) == first
+    assert fake_server.api.requests == []
+
+    # stale: revalidated, group and members not modified
+    now[0] += 120
+    assert helper.group_info(g_email_addr) == first
+    assert len(fake_server.api.requests) == 3
+    assert helper.cache.get('members', g_email_addr).fresh
+
+    # own writes invalidate the cache
+    assert helper.add_group_members(g_email_addr, ["new1@example.com"])
+    assert len(helper.group_info(g_email_addr)['members']) == 4
+    assert helper.logs == []
+
+
+def test_group_members_cached_pages(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings._get_group_members with a StateCache refetches stale members of several pages,
+    as a change on a later page does not change the etag of the first one
+    """
+    now = [1000.0]
+    helper = fake_helper
+    helper.cache = StateCache(':memory:', ttl=60, clock=lambda: now[0])
+    g_email_addr = 'big_group@example.com'
+    fake_server.api.add_group(g_email_addr, members=[
+        {'email': 'u{}@example.com'.format(i), 'role': 'MEMBER', 'type': 'USER'} for i in range(25)])
+
+    assert len(helper._get_group_members(g_email_addr, max_results=10)) == 25
+    del fake_server.api.members[g_email_addr]['u24@example.com']
+    now[0] += 120
+    members = helper._get_group_members(g_email_addr, max_results=10)
+    assert len(members) == 24 and 'u24@example.com' not in [m['email'] for m in members]
+    assert helper.logs == []
+
+
+def test_scan_domain(fake_helper, fake_server, monkeypatch):
+    """
+    Test GGroupsAndSettings.scan_domain snapshots all groups and resumes an interrupted scan from its checkpoint
+    """
+    monkeypatch.setattr(ggroups, 'GROUPS_PAGE_SIZE', 2)
+    for i in range(1, 6):
+        settings = dict(MOCK_GROUP_SETTINGS, whoCanPostMessage='ANYONE_CAN_POST' if i % 2 else 'ALL_MEMBERS_CAN_POST')
+        fake_server.api.add_group('group{}@example.com'.format(i), members=MOCK_MEMBERS['members'][:i % 3 + 1],
+                                  settings=settings)
+    helper = fake_helper
+    inventory = GroupInventory(':memory:')
+
+    # interrupted after the first page
+    save_checkpoint = inventory.save_checkpoint
+
+    def interrupt(*args, **kwargs):
+        save_checkpoint(*args, **kwargs)
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(inventory, 'save_checkpoint', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        helper.scan_domain(inventory, max_workers=2)
+    assert inventory.group_emails() == {'group1@example.com', 'group2@example.com'}
+    monkeypatch.setattr(inventory, 'save_checkpoint', save_checkpoint)
+
+    # resumed from the second page
+    del fake_server.api.requests[:]
+    assert helper.scan_domain(inventory, max_workers=2) == {'scanned': 4, 'failed': [], 'removed': 0}
+    assert not any('group1@' in path or 'group2@' in path for _, path in fake_server.api.requests)
+    assert len(inventory) == 6
+    assert inventory.public_groups() == ['group1@example.com', 'group3@example.com', 'group5@example.com']
+    assert [m['email'] for m in inventory.get('group4@example.com')['members']] == \
+        ['user1@example.com', 'user2@example.com']
+    assert inventory.get_checkpoint('my_customer').complete
+
+    # a complete scan is started over
+    fake_server.api.inject_fault(404, path=r'groups/v1/groups/group3@example.com')
+    ret = helper.scan_domain(inventory, max_workers=2)
+    assert ret == {'scanned': 5, 'failed': ['group3@example.com'], 'removed': 0}
+    assert len(helper.logs) == 1
+
+    # groups deleted from the domain are dropped by the next complete scan
+    fake_server.api.remove_group('group1@example.com')
+    assert helper.scan_domain(inventory, max_workers=2) == {'scanned': 5, 'failed': [], 'removed': 1}
+    assert len(inventory) == 5
+    assert inventory.public_groups() == ['group3@example.com', 'group5@example.com']
+
+
+def test_telemetry(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings records the API calls with their retries and quota errors in its telemetry
+    """
+    helper = fake_helper
+    helper.retry_policy = RetryPolicy(base_delay=0.001)
+    g_email_addr = "test_group@example.com"
+    fake_server.api.inject_fault(429, count=2, path=r'admin/directory/v1/groups/[^/]+/members$')
+
+    assert helper.add_group_members(g_email_addr, ["new1@example.com", "user1@example.com"]) is False
+    assert helper.add_group_members(g_email_addr, ["new2@example.com"], batch=True)
+
+    records = helper.telemetry.records()
+    assert [(r.operation, r.member, r.status, r.http_status, r.retries) for r in records if r.operation] == [
+        ('directory.members.insert', 'new1@example.com', 'ok', 200, 2),
+        ('directory.members.insert', 'user1@example.com', 'error', 409, 0),
+        # the calls of a batch are recorded as their responses are parsed, then the batch itself
+        ('directory.members.insert', 'new2@example.com', 'ok', 200, 0),
+        ('batch', None, 'ok', 200, 0),
+    ]
+    assert helper.logs == [r.message for r in records if r.message] and len(helper.logs) == 1
+
+    summary = helper.telemetry.summary()
+    assert summary['directory.members.insert']['quota_errors'] == 2
+    assert summary['directory.members.insert']['calls'] == 3 and summary['batch']['calls'] == 1
+
+
+def test_logs_kept_apart_from_call_records(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.logs keeps the early errors of large runs, with the group and member in their records
+    """
+    helper = fake_helper
+    helper.telemetry = Telemetry(capacity=50)
+    emails = ['user1@example.com'] + ['new{}@example.com'.format(i) for i in range(60)]
+
+    assert helper.add_group_members('test_group@example.com', emails) is False
+    assert helper.logs == ['ERROR: Failed to add MEMBER user1@example.com to test_group@example.com. Already exist.']
+
+    helper.logs.clear()
+    assert helper.logs == []
+    helper.logs = ['ERROR: previous run']
+    assert helper.add_group_members('test_group@example.com', ['user1@example.com'], batch=True) is False
+    assert len(helper.logs) == 2 and helper.logs[0] == 'ERROR: previous run'
+    record = [r for r in helper.telemetry.records() if r.message][-1]
+    assert (record.group, record.member) == ('test_group@example.com', 'user1@example.com')
+    helper.clear_logs()
+    assert helper.logs == []
+
+
+def test_update_group_members_role(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.update_group_members_role patches only the members not holding the role yet
+    """
+    helper = fake_helper
+    g_email_addr = "test_group@example.com"
+    results = {}
+
+    assert helper.update_group_members_role(g_email_addr, ["user1@example.com"], "ADMIN") is False
+    assert helper.logs[-1].startswith('ERROR: Invalid role ADMIN')
+
+    del fake_server.api.requests[:]
+    assert helper.update_group_members_role(
+        g_email_addr, ["user2@example.com", "User3@example.com", "nobody@example.com"], "MANAGER",
+        batch=True, results=results) is False
+    assert results == {"user2@example.com": True, "User3@example.com": True, "nobody@example.com": False}
+    assert helper.logs[-1] == 'ERROR: Failed to change role of nobody@example.com in test_group@example.com ' \
+                              'to MANAGER. Member not found.'
+    assert [r for r in fake_server.api.requests if r[0] == 'PATCH'] == [
+        ('PATCH', 'admin/directory/v1/groups/test_group@example.com/members/User3@example.com')]
+    # no remove and add
+    assert {method for method, _ in fake_server.api.requests} == {'GET', 'POST', 'PATCH'}
+    assert [path for method, path in fake_server.api.requests if method == 'POST'] == ['batch']
+    assert {k: m['role'] for k, m in fake_server.api.members[g_email_addr].items()} == {
+        'user1@example.com': 'OWNER', 'user2@example.com': 'MANAGER', 'user3@example.com': 'MANAGER'}
+
+    # across groups, one request per member not holding the role; a CUSTOMER member has no email address
+    fake_server.api.add_group('group1@example.com', members=[{'email': 'a@example.com'}, {'email': 'b@example.com'},
+                                                             {'id': 'C01', 'type': 'CUSTOMER'}])
+    del fake_server.api.requests[:]
+    assert helper.update_groups_members_role({
+        g_email_addr: ["user1@example.com", "user2@example.com", "user3@example.com"],
+        'group1@example.com': ["a@example.com", "b@example.com"],
+    }, "MEMBER", max_workers=2) == {g_email_addr: True, 'group1@example.com': True}
+    assert len([r for r in fake_server.api.requests if r[0] == 'PATCH']) == 3
+    assert not any('group1@' in path for method, path in fake_server.api.requests if method == 'PATCH')
+    assert {m['role'] for m in fake_server.api.members[g_email_addr].values()} == {'MEMBER'}
+
+
+def test_create_groups(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.create_groups creates the groups and writes their settings once, without reading them
+    """
+    helper = fake_helper
+    specs = {
+        'group{}@example.com'.format(i): {'name': 'Group {}'.format(i), 'is_public': i % 2 == 1}
+        for i in range(1, 6)
+    }
+    specs['group6@example.com'] = {'description': 'Sales', 'settings': {'whoCanJoin': 'INVITED_CAN_JOIN'}}
+    specs['test_group@example.com'] = None
+
+    ret = helper.create_groups(specs, max_workers=4)
+    assert {g: r['succeeded'] for g, r in ret.items()} == dict(
+        {g: True for g in specs}, **{'test_group@example.com': False})
+    assert ret['test_group@example.com'] == {'group': None, 'settings': None, 'succeeded': False}
+    assert helper.logs == ['ERROR: Failed to create group (test_group@example.com). Group already exist.']
+
+    # one insert and one settings update per group, no settings read
+    methods = sorted(method for method, path in fake_server.api.requests)
+    assert methods == ['POST'] * 7 + ['PUT'] * 6
+
+    api = fake_server.api
+    assert api.groups['group1@example.com']['name'] == 'Group 1'
+    assert api.groups['group6@example.com']['description'] == 'Sales'
+    assert api.settings['group1@example.com']['whoCanPostMessage'] == 'ANYONE_CAN_POST'
+    assert api.settings['group1@example.com']['isArchived'] == 'true'
+    assert api.settings['group2@example.com']['whoCanPostMessage'] == 'ALL_IN_DOMAIN_CAN_POST'
+    assert api.settings['group6@example.com']['whoCanJoin'] == 'INVITED_CAN_JOIN'
+    assert helper.is_group_public(ret['group3@example.com']['settings'])
+
+    ret = helper.create_groups({'group7@example.com': {}}, apply_defaults=False)
+    assert ret['group7@example.com']['succeeded'] and ret['group7@example.com']['settings'] is None
+
+
+def test_inserts_applied_before_an_error(fake_helper, fake_server):
+    """
+    Test the inserts applied by an attempt answered with a 503 succeed, although their retry gets 409 Conflict
+    """
+    helper = fake_helper
+    helper.retry_policy = RetryPolicy(base_delay=0.001)
+    api = fake_server.api
+    members_path = r'admin/directory/v1/groups/test_group@example.com/members$'
+
+    api.inject_fault(503, path=r'admin/directory/v1/groups$', applied=True)
+    ret = helper.create_groups({'group7@example.com': {'name': 'Group 7'}})
+    assert ret['group7@example.com']['succeeded'] is True
+    assert ret['group7@example.com']['group']['name'] == 'Group 7'
+    assert api.settings['group7@example.com']['whoCanJoin'] == ggroups.Defaults['DefaultGroupSettings']['whoCanJoin']
+
+    api.inject_fault(503, path=members_path, applied=True)
+    assert helper.add_group_members('test_group@example.com', ['new1@example.com'])
+
+    api.inject_fault(503, path=members_path, applied=True)
+    results = {}
+    assert helper.add_group_members('test_group@example.com', ['new2@example.com', 'new3@example.com'],
+                                    batch=True, results=results)
+    assert results == {'new2@example.com': True, 'new3@example.com': True}
+
+    # the whole batch applied, then its response lost
+    api.inject_fault(503, path='batch', applied=True)
+    assert helper.add_group_members('test_group@example.com', ['new4@example.com'], batch=True)
+
+    # a 409 with no ambiguous attempt before is still a failure
+    assert helper.add_group_members('test_group@example.com', ['new1@example.com']) is False
+    assert helper.logs == ['ERROR: Failed to add MEMBER new1@example.com to test_group@example.com. Already exist.']
+    assert {'new{}@example.com'.format(i) for i in range(1, 5)} <= set(api.members['test_group@example.com'])
+
+
+def test_expand_group_members(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.expand_group_members flattens nested groups, fetching each group once, and skips
+    the members without an email address
+    """
+    def group(email):
+        return {'email': email, 'role': 'MEMBER', 'type': 'GROUP'}
+
+    def user(email):
+        return {'email': email, 'role': 'MEMBER', 'type': 'USER'}
+
+    api = fake_server.api
+    api.add_group('all@example.com', members=[user('ceo@example.com'), group('eng@example.com'),
+                                              group('sales@example.com'), {'id': 'C01', 'type': 'CUSTOMER'}])
+    api.add_group('eng@example.com', members=[user('dev1@example.com'), group('oncall@example.com')])
+    api.add_group('sales@example.com', members=[user('rep1@example.com'), group('oncall@example.com'),
+                                                group('gone@example.com')])
+    api.add_group('oncall@example.com', members=[user('dev1@example.com'), user('ops1@example.com'),
+                                                 group('all@example.com')])
+
+    ret = fake_helper.expand_group_members('all@example.com', max_workers=4)
+    assert ret['members'] == {
+        'ceo@example.com': ['all@example.com'],
+        'dev1@example.com': ['all@example.com', 'eng@example.com'],
+        'rep1@example.com': ['all@example.com', 'sales@example.com'],
+        'ops1@example.com': ['all@example.com', 'eng@example.com', 'oncall@example.com'],
+    }
+    assert sorted(ret['groups']) == ['eng@example.com', 'gone@example.com', 'oncall@example.com',
+                                     'sales@example.com']
+    assert ret['cycles'] == [['all@example.com', 'eng@example.com', 'oncall@example.com', 'all@example.com']]
+    assert ret['failed'] == ['gone@example.com']
+
+    # oncall is in two groups but fetched once; all is not fetched again when reached through oncall
+    member_requests = [path for method, path in api.requests if path.endswith('/members')]
+    assert len(member_requests) == 5
+
+    # a shared graph fetches each group once across groups
+    del api.requests[:]
+    ret = fake_helper.expand_groups_members(['eng@example.com', 'sales@example.com'])
+    assert sorted(ret['sales@example.com']['members']) == ['ceo@example.com', 'dev1@example.com',
+                                                           'ops1@example.com', 'rep1@example.com']
+    assert ret['eng@example.com']['cycles'] == [
+        ['eng@example.com', 'oncall@example.com', 'all@example.com', 'eng@example.com'],
+        ['eng@example.com', 'oncall@example.com', 'all@example.com', 'sales@example.com', 'oncall@example.com']]
+    assert len([path for method, path in api.requests if path.endswith('/members')]) == 5
+
+
+def test_remove_member_from_all_groups(fake_helper, fake_server):
+    """
+    Test GGroupsAndSettings.remove_member_from_all_groups removes the member only from the indexed groups it is in
+    """
+    helper = fake_helper
+    assert helper.remove_member_from_all_groups('user1@example.com') is None
+
+    api = fake_server.api
+    for i in range(1, 6):
+        api.add_group('group{}@example.com'.format(i), members=[{'email': 'user{}@example.com'.format(i)}])
+    api.add_group('group6@example.com', members=[{'email': 'user1@example.com'}, {'email': 'user2@example.com'}])
+
+    helper.membership_index = MembershipIndex()
+    helper.groups_info(['group{}@example.com'.format(i) for i in range(1, 7)] + ['test_group@example.com'])
+    assert sorted(helper.membership_index.groups_of('user1@example.com')) == [
+        'group1@example.com', 'group6@example.com', 'test_group@example.com']
+
+    # kept current by our own writes
+    assert helper.add_group_members('group2@example.com', ['user1@example.com', 'user9@example.com'], batch=True)
+    assert helper.remove_group_members('group6@example.com', ['user2@example.com'])
+    assert helper.update_group_members_role('group2@example.com', ['user1@example.com'], 'MANAGER')
+    assert helper.membership_index.groups_of('user1@example.com')['group2@example.com'] == 'MANAGER'
+    assert helper.membership_index.groups_of('user2@example.com') == {
+        'group2@example.com': 'MEMBER', 'test_group@example.com': 'MANAGER'}
+
+    del api.requests[:]
+    ret = helper.remove_member_from_all_groups('user1@example.com', max_workers=4)
+    assert ret == {g: True for g in ['group1@example.com', 'group2@example.com', 'group6@example.com',
+                                     'test_group@example.com']}
+    assert sorted(path for method, path in api.requests) == sorted(
+        'admin/directory/v1/groups/{}/members/user1@example.com'.format(g) for g in ret)
+    assert all(method == 'DELETE' for method, path in api.requests)
+    assert helper.membership_index.groups_of('user1@example.com') == {}
+    assert 'user1@example.com' not in api.members['group6@example.com']
+
+    # members read from a cache are indexed too, whether fresh or revalidated
+    now = [1000.0]
+    helper.cache = StateCache(':memory:', ttl=60, clock=lambda: now[0])
+    groups = ['group2@example.com', 'group3@example.com']
+    helper.groups_info(groups)
+    for _ in ('fresh', 'revalidated'):
+        helper.membership_index = MembershipIndex()
+        helper.groups_info(groups)
+        assert helper.membership_index.groups_of('user3@example.com') == {'group3@example.com': 'MEMBER'}
+        now[0] += 120
+    assert helper.remove_member_from_all_groups('user3@example.com') == {'group3@example.com': True}
@@ -0,0 +1,103 @@
+"""
+Test gsuite_utils.ggroups_cli
+"""
+import io
+import json
+import subprocess
+import sys
+
+import httplib2
+import pytest
+from mock import Mock
+
+from gsuite_utils import ggroups, ggroups_cli
+from gsuite_utils.ggroups import GGroupsAndSettings
+from gsuite_utils.retry import RetryPolicy
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+
+
+@pytest.fixture(scope='function')
+def fake_server(monkeypatch):
+    with FakeGoogleServer() as server:
+        server.api.add_group('test_group@example.com', members=[{'email': 'user1@example.com'}])
+        monkeypatch.setattr(GGroupsAndSettings, '_auth', Mock(side_effect=lambda *args: httplib2.Http()))
+        monkeypatch.setattr(ggroups_cli, 'groups_helper', lambda args: GGroupsAndSettings(
+            args.client_secret_file, args.credential_file,
+            services=ServiceRegistry(httplib2.Http(), root_url=server.root_url), retry_policy=RetryPolicy()))
+        yield server
+
+
+def test_iter_addresses():
+    """
+    Test iter_addresses and chunked read the input lazily
+    """
+    invalid = []
+    fp = io.StringIO('email,name\nuser1@example.com,User 1\n\n# comment\nnot-an-address\n user2@example.com \n'
+                     'user3@example.com\n')
+    addresses = ggroups_cli.iter_addresses(fp, invalid)
+    chunks = ggroups_cli.chunked(addresses, 2)
+    assert next(chunks) == ['user1@example.com', 'user2@example.com']
+    assert invalid == ['not-an-address']
+    assert fp.readline() == 'user3@example.com\n'
+    assert list(chunks) == []
+    assert ggroups_cli.ROLES == ggroups.ROLES
+
+
+def test_help_does_not_import_google_api_client():
+    """
+    Test --help and --dry-run runs do not import the Google API client
+    """
+    code = ('import sys\n'
+            'from gsuite_utils import ggroups_cli\n'
+            'assert ggroups_cli.main(["add", "g@example.com", "user1@example.com", "--dry-run"]) == 0\n'
+            'try:\n'
+            '    ggroups_cli.main(["--help"])\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            'print(sorted(m for m in sys.modules if m.split(".")[0] in '
+            '("googleapiclient", "apiclient", "oauth2client", "httplib2", "gsuite_utils")))\n')
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+    assert output.splitlines()[-1] == "['gsuite_utils', 'gsuite_utils.ggroups_cli']"
+
+
+def test_commands(fake_server, tmpdir, capsys, monkeypatch):
+    """
+    Test the info, create, add, remove and settings commands against the fake Google APIs
+    """
+    members = tmpdir.join('members.csv')
+    members.write('email\n' + ''.join('user{}@example.com\n'.format(i) for i in range(2, 8)) + 'invalid\n')
+
+    assert ggroups_cli.main(['create', 'new@example.com', '--name', 'New', '--public']) == 0
+    assert capsys.readouterr().out == 'new@example.com created\n'
+    assert fake_server.api.settings['new@example.com']['whoCanPostMessage'] == 'ANYONE_CAN_POST'
+
+    # the invalid address fails the run, the valid ones are added in chunks of 4
+    assert ggroups_cli.main(['add', 'new@example.com', 'user1@example.com', '-f', str(members),
+                             '--chunk-size', '4', '--batch', '--role', 'MANAGER']) == 1
+    err = capsys.readouterr().err
+    assert 'ERROR: Invalid email address invalid' in err
+    assert 'new@example.com 7 done, 0 failed, 1 invalid' in err
+    assert [path for method, path in fake_server.api.requests].count('batch') == 2
+    assert len(fake_server.api.members['new@example.com']) == 7
+
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('user2@example.com\nuser9@example.com\n'))
+    assert ggroups_cli.main(['remove', 'new@example.com', '-f', '-']) == 1
+    err = capsys.readouterr().err
+    assert 'ERROR: Failed to remove user9@example.com from new@example.com. Member not found.' in err
+    assert 'new@example.com 1 done, 1 failed, 0 invalid' in err
+
+    assert ggroups_cli.main(['settings', 'new@example.com', 'whoCanJoin=INVITED_CAN_JOIN']) == 0
+    assert capsys.readouterr().out == 'new@example.com updated\n'
+    assert ggroups_cli.main(['settings', 'new@example.com', 'whoCanJoin']) == 1
+
+    assert ggroups_cli.main(['info', 'new@example.com', '--fields', 'email,role']) == 0
+    info = json.loads(capsys.readouterr().out)
+    assert info['group']['name'] == 'New'
+    assert info['settings']['whoCanJoin'] == 'INVITED_CAN_JOIN'
+    assert sorted(m['email'] for m in info['members']) == [
+        'user{}@example.com'.format(i) for i in (1, 3, 4, 5, 6, 7)]
+    assert ggroups_cli.main(['info', 'missing@example.com']) == 1
+
+    with pytest.raises(SystemExit):
+        ggroups_cli.main(['add', 'new@example.com'])
@@ -0,0 +1,47 @@
+"""
+Test gsuite_utils.inventory
+"""
+from gsuite_utils.inventory import GroupInventory
+
+
+def test_group_inventory(tmpdir):
+    """
+    Test GroupInventory put, queries and checkpoints
+    """
+    now = [1000.0]
+    path = str(tmpdir.join('inventory.db'))
+    inventory = GroupInventory(path, clock=lambda: now[0])
+    assert inventory.get_checkpoint('my_customer') is None
+
+    checkpoint = inventory.start_scan('my_customer')
+    assert checkpoint == (None, False, 1000.0)
+    inventory.put({'group': {'email': 'Group1@example.com'}, 'settings': {}, 'members': []}, True)
+    inventory.put({'group': {'email': 'group2@example.com'}, 'settings': {}, 'members': []}, False)
+    inventory.put({'group': {'email': 'group3@example.com'}, 'settings': None, 'members': []}, None)
+    inventory.save_checkpoint('my_customer', '200')
+
+    # kept on disk
+    inventory.close()
+    inventory = GroupInventory(path, clock=lambda: now[0])
+    assert len(inventory) == 3
+    assert inventory.get('group1@example.com')['group'] == {'email': 'Group1@example.com'}
+    assert inventory.get('group4@example.com') is None
+    assert inventory.public_groups() == ['group1@example.com']
+    assert [i['group']['email'] for i in inventory.groups(is_public=False)] == ['group2@example.com']
+    assert len(inventory.groups()) == 3
+    assert inventory.get_checkpoint('my_customer') == ('200', False, 1000.0)
+
+    now[0] += 10
+    inventory.put({'group': {'email': 'group2@example.com'}, 'settings': {}, 'members': []}, False)
+    assert inventory.group_emails() == {'group1@example.com', 'group2@example.com', 'group3@example.com'}
+    assert inventory.group_emails(since=1005.0) == {'group2@example.com'}
+    inventory.save_checkpoint('my_customer', None, complete=True)
+    assert inventory.get_checkpoint('my_customer').complete
+
+    assert inventory.remove_stale(1005.0, keep=['Group3@example.com']) == 1
+    assert inventory.group_emails() == {'group2@example.com', 'group3@example.com'}
+
+    inventory.reset('my_customer')
+    assert inventory.get_checkpoint('my_customer') is None and len(inventory) == 2
+    inventory.reset()
+    assert len(inventory) == 0
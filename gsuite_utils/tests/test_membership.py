@@ -0,0 +1,43 @@
+"""
+Test gsuite_utils.membership
+"""
+from gsuite_utils.inventory import GroupInventory
+from gsuite_utils.membership import MembershipIndex
+
+
+def test_membership_index():
+    """
+    Test MembershipIndex loads, writes and lookups
+    """
+    inventory = GroupInventory(':memory:')
+    inventory.put({'group': {'email': 'Group1@example.com'}, 'settings': {},
+                   'members': [{'email': 'User1@example.com', 'role': 'OWNER'},
+                               {'email': 'user2@example.com', 'role': 'MEMBER'}]}, False)
+    inventory.put({'group': {'email': 'group2@example.com'}, 'settings': {},
+                   'members': [{'email': 'user1@example.com', 'role': 'MEMBER'}]}, False)
+
+    index = MembershipIndex()
+    assert index.load_inventory(inventory) == 2
+    assert len(index) == 2
+    assert index.groups_of('USER1@example.com') == {'group1@example.com': 'OWNER', 'group2@example.com': 'MEMBER'}
+    assert index.members_of('group1@example.com') == {'user1@example.com': 'OWNER', 'user2@example.com': 'MEMBER'}
+    assert 'group2@example.com' in index and 'group3@example.com' not in index
+
+    index.add('group2@example.com', 'user2@example.com', 'MANAGER')
+    index.add('group2@example.com', 'user1@example.com', 'OWNER')
+    assert index.groups_of('user2@example.com') == {'group1@example.com': 'MEMBER', 'group2@example.com': 'MANAGER'}
+    assert index.groups_of('user1@example.com')['group2@example.com'] == 'OWNER'
+
+    index.remove('group1@example.com', 'user2@example.com')
+    index.remove('group1@example.com', 'user3@example.com')
+    assert index.groups_of('user2@example.com') == {'group2@example.com': 'MANAGER'}
+
+    # reloading a group drops the members not in it anymore
+    index.load_group('group2@example.com', [{'email': 'user3@example.com'}])
+    assert index.groups_of('user2@example.com') == {}
+    assert index.groups_of('user3@example.com') == {'group2@example.com': None}
+    assert len(index) == 2
+
+    index.drop_group('group1@example.com')
+    assert index.groups_of('user1@example.com') == {}
+    assert len(index) == 1
@@ -0,0 +1,59 @@
+"""
+Test gsuite_utils.reconcile
+"""
+from gsuite_utils.reconcile import describe_plan, diff_members, diff_settings, is_plan_empty, plan_group_changes
+
+CURRENT_MEMBERS = [
+    {'email': 'user1@example.com', 'role': 'OWNER', 'type': 'USER'},
+    {'email': 'User2@example.com', 'role': 'MANAGER', 'type': 'USER'},
+    {'email': 'user3@example.com', 'role': 'MEMBER', 'type': 'USER'},
+]
+
+
+def test_diff_members():
+    """
+    Test diff_members
+    """
+    insert, delete, update_role = diff_members(CURRENT_MEMBERS, {
+        'user1@example.com': 'OWNER',
+        'user2@example.com': 'MEMBER',
+        'user4@example.com': 'MEMBER',
+    })
+    assert insert == [{'email': 'user4@example.com', 'role': 'MEMBER'}]
+    assert delete == ['user3@example.com']
+    assert update_role == [{'email': 'User2@example.com', 'role': 'MEMBER', 'from': 'MANAGER'}]
+
+    assert diff_members(CURRENT_MEMBERS, {m['email']: m['role'] for m in CURRENT_MEMBERS}) == ([], [], [])
+
+    # members without an email address are never deleted
+    customer = {'id': 'C01', 'role': 'MEMBER', 'type': 'CUSTOMER'}
+    assert diff_members(CURRENT_MEMBERS + [customer], {}) == ([], [m['email'] for m in CURRENT_MEMBERS], [])
+
+
+def test_diff_settings():
+    """
+    Test diff_settings
+    """
+    current = {'whoCanJoin': 'CAN_REQUEST_TO_JOIN', 'isArchived': 'true'}
+    assert diff_settings(current, {'whoCanJoin': 'CAN_REQUEST_TO_JOIN', 'isArchived': 'false'}) == \
+        {'isArchived': 'false'}
+    assert diff_settings(current, {'whoCanPostMessage': 'ANYONE_CAN_POST'}) == \
+        {'whoCanPostMessage': 'ANYONE_CAN_POST'}
+
+
+def test_plan_group_changes():
+    """
+    Test plan_group_changes and describe_plan
+    """
+    plan = plan_group_changes('group1@example.com', None, None, [], {'isArchived': 'true'},
+                              {'user1@example.com': 'OWNER'})
+    assert not is_plan_empty(plan)
+    assert describe_plan(plan) == [
+        '+ group group1@example.com',
+        '~ setting isArchived = true',
+        '+ OWNER user1@example.com',
+    ]
+
+    plan = plan_group_changes('group1@example.com', {'email': 'group1@example.com'}, {'isArchived': 'true'},
+                              CURRENT_MEMBERS, {'isArchived': 'true'})
+    assert is_plan_empty(plan)
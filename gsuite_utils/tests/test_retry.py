@@ -0,0 +1,99 @@
+"""
+Test gsuite_utils.retry
+"""
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from gsuite_utils.retry import RetryPolicy, TokenBucket, is_retryable
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+
+
+@pytest.fixture(scope='function')
+def groups_service():
+    with FakeGoogleServer() as server:
+        server.api.add_group('test_group@example.com')
+        registry = ServiceRegistry(httplib2.Http(), root_url=server.root_url)
+        yield server.api, registry.collection('admin', 'directory_v1', 'groups')
+
+
+def _policy(sleeps, **kwargs):
+    return RetryPolicy(sleep=sleeps.append, rand=lambda: 1.0, **kwargs)
+
+
+def test_retry_on_server_errors(groups_service):
+    """
+    Test RetryPolicy.execute retries 503 with exponential backoff
+    """
+    api, groups = groups_service
+    api.inject_fault(503, count=2)
+    sleeps = []
+
+    ret = _policy(sleeps, base_delay=1).execute(groups.get(groupKey='test_group@example.com'))
+    assert ret['email'] == 'test_group@example.com'
+    assert sleeps == [1, 2]
+
+
+def test_retry_honours_retry_after(groups_service):
+    """
+    Test RetryPolicy.execute waits as requested by Retry-After on 429 and quota errors
+    """
+    api, groups = groups_service
+    api.inject_fault(429, headers={'Retry-After': '7'})
+    api.inject_fault(403, reason='userRateLimitExceeded')
+    sleeps = []
+
+    assert _policy(sleeps, base_delay=1).execute(groups.get(groupKey='test_group@example.com'))
+    assert sleeps == [7, 2]
+
+
+def test_no_retry(groups_service):
+    """
+    Test RetryPolicy.execute does not retry client errors and gives up after max_attempts
+    """
+    api, groups = groups_service
+    sleeps = []
+
+    with pytest.raises(HttpError) as e:
+        _policy(sleeps).execute(groups.get(groupKey='no_group@example.com'))
+    assert e.value.resp.status == 404
+    assert not is_retryable(e.value)
+    assert sleeps == []
+
+    api.inject_fault(403, reason='forbidden')
+    with pytest.raises(HttpError):
+        _policy(sleeps).execute(groups.get(groupKey='test_group@example.com'))
+    assert sleeps == []
+
+    api.inject_fault(500, count=3)
+    with pytest.raises(HttpError):
+        _policy(sleeps, max_attempts=3).execute(groups.get(groupKey='test_group@example.com'))
+    assert len(sleeps) == 2
+
+
+def test_token_bucket():
+    """
+    Test TokenBucket.acquire waits for tokens once the burst is used
+    """
+    now = [0.0]
+    sleeps = []
+
+    def sleep(secs):
+        sleeps.append(secs)
+        now[0] += secs
+
+    bucket = TokenBucket(rate=10, capacity=5, clock=lambda: now[0], sleep=sleep)
+    for _ in range(5):
+        assert bucket.acquire() == 0
+    assert bucket.acquire(2) == pytest.approx(0.2)
+    assert bucket.acquire(50) == pytest.approx(0.5)
+    # requests larger than the bucket are paid in full, so the rate holds for batches too
+    assert bucket.acquire(50) == pytest.approx(50 / 10.0)
+    assert bucket.acquire(1) == pytest.approx((45 + 1) / 10.0)
+
+    now[0] = 0.0
+    bucket = TokenBucket(rate=40, clock=lambda: now[0], sleep=sleep)
+    # 5 batches of 1000 calls at 40 QPS: each batch after the first waits for the previous one to be paid back
+    waited = sum(bucket.acquire(1000) for _ in range(5))
+    assert waited == pytest.approx(4 * 1000 / 40.0)
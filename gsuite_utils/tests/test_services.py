@@ -0,0 +1,49 @@
+"""
+Test gsuite_utils.services
+"""
+import json
+
+import httplib2
+from googleapiclient import discovery_cache
+
+from gsuite_utils import services
+from gsuite_utils.services import ServiceRegistry, get_discovery_document
+
+
+def test_registry_builds_each_service_once():
+    """
+    Test ServiceRegistry.get
+    """
+    registry = ServiceRegistry(httplib2.Http())
+
+    directory = registry.get('admin', 'directory_v1')
+    assert directory is registry.get('admin', 'directory_v1')
+    assert directory is not registry.get('groupssettings', 'v1')
+
+    members = registry.collection('admin', 'directory_v1', 'members')
+    assert members is registry.collection('admin', 'directory_v1', 'members')
+
+    registry.clear()
+    assert directory is not registry.get('admin', 'directory_v1')
+
+
+def test_discovery_document_shared_between_registries():
+    """
+    Test get_discovery_document returns the same parsed document
+    """
+    doc = get_discovery_document('admin', 'directory_v1')
+    assert doc is get_discovery_document('admin', 'directory_v1')
+    assert doc['name'] == 'admin'
+
+
+def test_discovery_document_from_cache_dir(tmpdir, monkeypatch):
+    """
+    Test get_discovery_document reads documents kept on disk
+    """
+    monkeypatch.setattr(services, '_DOCUMENTS', {})
+    content = json.loads(discovery_cache.get_static_doc('groupssettings', 'v1'))
+    content['description'] = 'from cache dir'
+    tmpdir.join('groupssettings.v1.json').write(json.dumps(content))
+
+    doc = get_discovery_document('groupssettings', 'v1', static_discovery=False, cache_dir=str(tmpdir))
+    assert doc['description'] == 'from cache dir'
@@ -0,0 +1,105 @@
+"""
+Test gsuite_utils.telemetry
+"""
+import io
+import json
+import logging
+
+from gsuite_utils.telemetry import JsonlSink, LatencyHistogram, LoggingSink, Telemetry
+
+
+def test_latency_histogram():
+    """
+    Test LatencyHistogram percentiles are within a bucket (20%) of the exact ones
+    """
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+    for i in range(1, 1001):
+        histogram.add(i / 1000.0)
+
+    assert histogram.count == 1000 and histogram.max == 1.0
+    for p in (50, 95, 99):
+        assert p / 100.0 <= histogram.percentile(p) <= p / 100.0 * 1.2
+    assert histogram.percentile(100) == 1.0
+
+
+def test_telemetry():
+    """
+    Test Telemetry keeps the last records only, and the counters and latencies of all of them
+    """
+    telemetry = Telemetry(capacity=3, clock=lambda: 1000.0)
+    for i in range(5):
+        telemetry.record('directory.members.insert', 'group1@example.com', 'user{}@example.com'.format(i),
+                         latency=0.1, retries=i % 2)
+    telemetry.record('directory.members.insert', 'group1@example.com', 'user5@example.com', 'error', 429,
+                     latency=1.0, retries=4, quota_errors=5)
+    telemetry.log('ERROR: Failed')
+
+    records = telemetry.records()
+    assert [r.member for r in records] == ['user4@example.com', 'user5@example.com', None]
+    assert [r.member for r in telemetry.records(status='error')] == ['user5@example.com', None]
+    assert telemetry.messages() == ['ERROR: Failed']
+
+    summary = telemetry.summary()
+    assert list(summary) == ['directory.members.insert']
+    m = summary['directory.members.insert']
+    assert (m['calls'], m['errors'], m['retries'], m['quota_errors']) == (6, 1, 6, 5)
+    assert abs(m['total_seconds'] - 1.5) < 1e-9
+    assert 0.1 <= m['p50'] <= 0.12 and m['p99'] == 1.0
+
+    lines = telemetry.format_summary()
+    assert len(lines) == 2 and lines[1].split()[:5] == ['directory.members.insert', '6', '1', '6', '5']
+
+    fp = io.StringIO()
+    telemetry.dump(fp)
+    assert json.loads(fp.getvalue()) == summary
+
+    telemetry.clear()
+    assert telemetry.records() == [] and telemetry.summary() == {} and telemetry.messages() == []
+
+
+def test_telemetry_messages():
+    """
+    Test Telemetry keeps the messages apart from the records, so the records of the calls do not push them out
+    """
+    telemetry = Telemetry(capacity=2, message_capacity=3)
+    telemetry.log('ERROR: first', group='group1@example.com', member='user1@example.com')
+    for i in range(10):
+        telemetry.record('directory.members.insert', 'group1@example.com')
+    assert telemetry.messages() == ['ERROR: first']
+    assert telemetry.records(status='error') == []
+
+    for i in range(4):
+        telemetry.log('ERROR: {}'.format(i))
+    assert telemetry.messages() == ['ERROR: 1', 'ERROR: 2', 'ERROR: 3']
+    telemetry.clear_messages()
+    assert telemetry.messages() == [] and len(telemetry.records()) == 2
+
+    # the oldest messages are dropped in blocks, a quarter of the capacity at a time
+    telemetry = Telemetry(message_capacity=8)
+    lengths = []
+    for i in range(25):
+        telemetry.log('ERROR: {}'.format(i))
+        lengths.append(len(telemetry.logs))
+    assert lengths[7:] == [8, 9, 10] * 6
+    assert telemetry.messages() == ['ERROR: {}'.format(i) for i in range(17, 25)]
+    telemetry.set_messages(['ERROR: previous run {}'.format(i) for i in range(20)])
+    assert telemetry.logs == ['ERROR: previous run {}'.format(i) for i in range(12, 20)]
+
+
+def test_telemetry_sinks(caplog):
+    """
+    Test Telemetry passes each record to the JSONL and logging sinks
+    """
+    fp = io.StringIO()
+    telemetry = Telemetry(sinks=[JsonlSink(fp), LoggingSink()])
+    with caplog.at_level(logging.DEBUG, logger='gsuite_utils'):
+        telemetry.record('directory.groups.get', 'group1@example.com', latency=0.01)
+        telemetry.log('ERROR: Failed', group='group1@example.com')
+
+    lines = [json.loads(line) for line in fp.getvalue().splitlines()]
+    assert [(r['operation'], r['status'], r['message']) for r in lines] == [
+        ('directory.groups.get', 'ok', None), (None, 'error', 'ERROR: Failed')]
+    assert [(r.levelno, r.getMessage()) for r in caplog.records] == [
+        (logging.DEBUG, 'directory.groups.get group1@example.com '), (logging.ERROR, 'ERROR: Failed')]
+    assert caplog.records[1].event['group'] == 'group1@example.com'
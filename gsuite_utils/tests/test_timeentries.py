@@ -0,0 +1,76 @@
+"""
+Test gsuite_utils.timeentries
+"""
+from datetime import date
+
+import pytest
+
+from gsuite_utils.timeentries import TaskRules, TimeEntry, TimeEntryTable
+
+
+def test_task_rules():
+    """
+    Test TaskRules applies the first matching rule in table order, whatever the position of the match
+    """
+    rules = TaskRules([
+        (r'stand-?up', 'T-1'),
+        (r'\binterview\b', 'T-2'),
+        (r'meeting', 'T-3'),
+    ], default_taskid='T-0')
+
+    assert rules.match('Daily Standup') == 'T-1'
+    assert rules.match('Team meeting: stand-up') == 'T-1'
+    assert rules.match('Interview meeting') == 'T-2'
+    assert rules.match('Interviewing tips meeting') == 'T-3'
+    assert rules.match('Lunch') == 'T-0'
+    assert rules.match('') == 'T-0'
+    assert TaskRules([], default_taskid='T-0').match('Anything') == 'T-0'
+    assert TaskRules([('Lunch', 'T-9')], ignore_case=False).match('lunch') is None
+
+
+def test_time_entry_table_add_events():
+    """
+    Test TimeEntryTable.add_events converts events, including all-day and cancelled events
+    """
+    rules = TaskRules([('standup', 'T-1')], default_taskid='T-0')
+    table = TimeEntryTable(keep_comments=True)
+    assert table.add_events('user1@example.com', [
+        {'summary': 'Standup', 'start': {'dateTime': '2020-01-02T09:00:00+10:00'},
+         'end': {'dateTime': '2020-01-02T09:15:00+10:00'}},
+        {'summary': 'Offsite', 'start': {'date': '2020-01-03'}, 'end': {'date': '2020-01-05'}},
+        {'start': {'dateTime': '2020-01-03T23:30:00Z'}, 'end': {'dateTime': '2020-01-04T00:30:00Z'}},
+        {'status': 'cancelled', 'id': 'x'},
+    ], rules) == 3
+
+    assert list(table.rows()) == [
+        TimeEntry(date(2020, 1, 2), 'user1@example.com', 900, 'T-1', 'Standup'),
+        TimeEntry(date(2020, 1, 3), 'user1@example.com', 2 * 86400, 'T-0', 'Offsite'),
+        TimeEntry(date(2020, 1, 3), 'user1@example.com', 3600, 'T-0', ''),
+    ]
+
+
+def test_time_entry_table_aggregate():
+    """
+    Test TimeEntryTable.aggregate totals by any combination of day, person and task
+    """
+    table = TimeEntryTable()
+    table.append(date(2020, 1, 1), 'a', 60, 'T-1')
+    table.append(date(2020, 1, 1), 'b', 120, 'T-1')
+    table.append(date(2020, 1, 1), 'a', 30, 'T-2')
+    table.append(date(2020, 1, 2), 'a', 15, 'T-1')
+
+    assert len(table) == 4
+    assert table.persons == ['a', 'b']
+    assert next(table.rows()).comment is None
+    assert table.aggregate() == {
+        (date(2020, 1, 1), 'a', 'T-1'): 60,
+        (date(2020, 1, 1), 'b', 'T-1'): 120,
+        (date(2020, 1, 1), 'a', 'T-2'): 30,
+        (date(2020, 1, 2), 'a', 'T-1'): 15,
+    }
+    assert table.aggregate(by=('person',)) == {('a',): 105, ('b',): 120}
+    assert table.aggregate(by=('task', 'day')) == {
+        ('T-1', date(2020, 1, 1)): 180, ('T-2', date(2020, 1, 1)): 30, ('T-1', date(2020, 1, 2)): 15}
+
+    with pytest.raises(ValueError):
+        table.aggregate(by=('month',))
@@ -0,0 +1,36 @@
+"""
+Test gsuite_utils.timeparse
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from gsuite_utils.timeparse import event_duration_seconds, parse_event_time
+
+
+def test_parse_event_time():
+    """
+    Test parse_event_time with RFC3339 timestamps and dates
+    """
+    dt = parse_event_time('2020-01-02T09:30:00+10:00')
+    assert (dt.year, dt.month, dt.day, dt.hour, dt.minute) == (2020, 1, 2, 9, 30)
+    assert dt.utcoffset() == timedelta(hours=10)
+    assert parse_event_time('2020-01-02T09:30:00Z').utcoffset() == timedelta(0)
+    assert parse_event_time('2020-01-02') == datetime(2020, 1, 2)
+    assert parse_event_time('2020-01-02T09:30:00Z') is parse_event_time('2020-01-02T09:30:00Z')
+
+    with pytest.raises(ValueError):
+        parse_event_time('not a time')
+
+
+def test_event_duration_seconds():
+    """
+    Test event_duration_seconds across days and timezones
+    """
+    assert event_duration_seconds('2020-01-02T09:00:00+10:00', '2020-01-02T10:30:00+10:00') == 5400
+    # multi-day events
+    assert event_duration_seconds('2020-01-01T09:00:00Z', '2020-01-03T10:00:00Z') == 2 * 86400 + 3600
+    assert event_duration_seconds('2020-01-01', '2020-01-04') == 3 * 86400
+    # same instant in two timezones
+    assert event_duration_seconds('2020-01-02T09:00:00+10:00', '2020-01-01T23:00:00Z') == 0
+    assert event_duration_seconds('2020-01-01T23:00:00-05:00', '2020-01-02T08:00:00+02:00') == 2 * 3600
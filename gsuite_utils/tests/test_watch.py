@@ -0,0 +1,172 @@
+"""
+Test gsuite_utils.watch
+"""
+import threading
+import time
+
+import httplib2
+import pytest
+
+from gsuite_utils.gdrive import iter_new_gdrive_activities
+from gsuite_utils.retry import RetryPolicy
+from gsuite_utils.services import ServiceRegistry
+from gsuite_utils.tests.fake_google import FakeGoogleServer
+from gsuite_utils.watch import NotificationReceiver, WatchManager
+
+
+@pytest.fixture(scope='function')
+def fake_server():
+    with FakeGoogleServer() as server:
+        for c in ('cal1@example.com', 'cal2@example.com'):
+            server.api.add_calendar_event(c, 'e0', '2020-01-01T09:00:00Z', '2020-01-01T10:00:00Z')
+        yield server
+
+
+@pytest.fixture(scope='function')
+def receiver():
+    receiver = NotificationReceiver()
+    yield receiver
+    if receiver.manager is not None:
+        receiver.stop()
+
+
+def test_watch_end_to_end(fake_server, receiver):
+    """
+    Test notifications posted by the simulator trigger incremental fetches of the changed resource only
+    """
+    registry = ServiceRegistry(httplib2.Http(), root_url=fake_server.root_url)
+    calendar = registry.get('calendar', 'v3')
+    reports = registry.get('admin', 'reports_v1')
+    manager = WatchManager(receiver.url, retry_policy=RetryPolicy())
+    receiver.start(manager)
+
+    fetched = []
+    sync_tokens = {}
+    release = threading.Event()
+
+    def sync_calendar(channel):
+        # incremental fetch of the calendar of the channel
+        release.wait(5)
+        response = calendar.events().list(calendarId=channel.key, syncToken=sync_tokens.get(channel.key)).execute()
+        sync_tokens[channel.key] = response['nextSyncToken']
+        fetched.append((channel.key, [e['id'] for e in response['items']]))
+
+    drive_state = {}
+    drive_events = []
+
+    def sync_drive(channel):
+        drive_events.extend(a['id']['uniqueQualifier'] for a in iter_new_gdrive_activities(
+            reports, drive_state, retry_policy=RetryPolicy()))
+
+    channels = {c: manager.watch_calendar_events(calendar, c, sync_calendar)
+                for c in ('cal1@example.com', 'cal2@example.com')}
+    drive = manager.watch_drive_activities(reports, sync_drive)
+    assert set(fake_server.api.channels) == {drive.id} | {c.id for c in channels.values()}
+    assert fake_server.api.channels[drive.id]['address'] == receiver.url
+
+    # sync messages trigger no fetch
+    assert fake_server.api.notify('calendar', 'cal1@example.com', state='sync') == [
+        (channels['cal1@example.com'].id, 200)]
+    release.set()
+    assert receiver.wait_idle(5)
+    assert fetched == []
+
+    # only the changed calendar is fetched; a duplicate delivery is dropped
+    fake_server.api.add_calendar_event('cal1@example.com', 'e1', '2020-01-02T09:00:00Z', '2020-01-02T10:00:00Z')
+    fake_server.api.notify('calendar', 'cal1@example.com')
+    fake_server.api.notify('calendar', 'cal1@example.com', message_number=2)
+    assert receiver.wait_idle(5)
+    assert fetched == [('cal1@example.com', ['e0', 'e1'])]
+    assert receiver.stats['duplicates'] == 1
+
+    # notifications received during a fetch are coalesced into a single new fetch
+    release.clear()
+    fake_server.api.notify('calendar', 'cal2@example.com')
+    for i in range(3):
+        fake_server.api.add_calendar_event('cal2@example.com', 'x{}'.format(i), '2020-01-03T09:00:00Z',
+                                           '2020-01-03T10:00:00Z')
+        fake_server.api.notify('calendar', 'cal2@example.com')
+    release.set()
+    assert receiver.wait_idle(5)
+    assert [key for key, _ in fetched[1:]] in (['cal2@example.com'], ['cal2@example.com'] * 2)
+    assert sorted(sum((ids for _, ids in fetched[1:]), [])) == ['e0', 'x0', 'x1', 'x2']
+
+    # wrong tokens are rejected without any fetch
+    count = len(fetched)
+    assert fake_server.api.notify('calendar', 'cal1@example.com', token='forged') == [
+        (channels['cal1@example.com'].id, 403)]
+    # a byte above 0x7f is received as a non-ASCII character
+    assert fake_server.api.notify('calendar', 'cal1@example.com', token='forg\xe9') == [
+        (channels['cal1@example.com'].id, 403)]
+    assert receiver.wait_idle(5)
+    assert len(fetched) == count
+    assert receiver.stats['rejected'] == 2
+
+    fake_server.api.add_activity('2020-01-01T00:00:00.000Z', 'user@example.com', 'edit', unique_qualifier='a1')
+    fake_server.api.notify('drive')
+    assert receiver.wait_idle(5)
+    fake_server.api.add_activity('2020-01-01T00:01:00.000Z', 'user@example.com', 'edit', unique_qualifier='a2')
+    fake_server.api.notify('drive')
+    assert receiver.wait_idle(5)
+    assert drive_events == ['a1', 'a2']
+
+    manager.stop_all()
+    assert fake_server.api.channels == {}
+    assert manager.telemetry.messages() == []
+
+
+def test_renew_expiring(fake_server, receiver):
+    """
+    Test WatchManager.renew_expiring replaces the channels about to expire and stops them
+    """
+    now = [time.time()]
+    calendar = ServiceRegistry(httplib2.Http(), root_url=fake_server.root_url).get('calendar', 'v3')
+    manager = WatchManager(receiver.url, ttl=3600, retry_policy=RetryPolicy(), clock=lambda: now[0])
+    receiver.start(manager)
+    fetched = []
+    old = manager.watch_calendar_events(calendar, 'cal1@example.com', lambda channel: fetched.append(channel.id))
+    assert old.expiration == pytest.approx(now[0] + 3600, abs=5)
+
+    assert manager.renew_expiring(margin=600) == []
+    now[0] += 3100
+    new, = manager.renew_expiring(margin=600)
+    assert new.id != old.id and new.key == 'cal1@example.com'
+    assert list(fake_server.api.channels) == [new.id]
+    assert manager.channels() == [new]
+
+    # the notifications of the old channel are rejected, the new one triggers the same fetch
+    assert manager.channel(old.id, old.token) is None
+    fake_server.api.notify('calendar', 'cal1@example.com')
+    assert receiver.wait_idle(5)
+    assert fetched == [new.id]
+
+    # failures are recorded, and the channel kept until it is renewed
+    fake_server.api.inject_fault(404, path='calendar/v3/calendars/.*/watch')
+    now[0] += 3600
+    assert manager.renew_expiring() == []
+    assert manager.channels() == [new]
+    assert manager.telemetry.messages()[0].startswith('ERROR: Failed to renew channel {}'.format(new.id))
+    manager.stop_all()
+
+
+def test_notifications_acknowledged_during_api_calls(fake_server, receiver):
+    """
+    Test notifications are acknowledged while the manager waits for the API to open or stop a channel
+    """
+    calendar = ServiceRegistry(httplib2.Http(), root_url=fake_server.root_url).get('calendar', 'v3')
+    manager = WatchManager(receiver.url, retry_policy=RetryPolicy())
+    receiver.start(manager)
+    channel = manager.watch_calendar_events(calendar, 'cal1@example.com', lambda channel: None)
+
+    fake_server.api.latency = 1.0
+    for call in (lambda: manager.watch_calendar_events(calendar, 'cal2@example.com', lambda channel: None),
+                 lambda: manager.stop(channel.id)):
+        thread = threading.Thread(target=call)
+        thread.start()
+        time.sleep(0.2)
+        t = time.time()
+        assert fake_server.api.notify('calendar', 'cal1@example.com') in ([(channel.id, 200)], [(channel.id, 403)])
+        assert time.time() - t < 0.5
+        thread.join()
+    fake_server.api.latency = 0.0
+    manager.stop_all()
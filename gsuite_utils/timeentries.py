@@ -0,0 +1,149 @@
+from __future__ import print_function
+import re
+from array import array
+from collections import namedtuple
+from datetime import date
+
+from gsuite_utils.timeparse import parse_event_time
+
+# Maximum number of distinct event summaries kept matched by a `TaskRules`
+MATCH_CACHE_SIZE = 65536
+
+# Columns a `TimeEntryTable` can be aggregated by
+AGGREGATE_KEYS = ('day', 'person', 'task')
+
+# Row of a `TimeEntryTable`; a namedtuple has no per-instance __dict__
+TimeEntry = namedtuple('TimeEntry', ['day', 'person', 'seconds', 'taskid', 'comment'])
+
+
+class TaskRules(object):
+    """Maps event summaries to task IDs with an ordered table of regular expressions.
+
+    The rules are tried in table order and the first one matching anywhere in the summary wins. Summaries
+    already seen are looked up instead of being matched again.
+    """
+
+    def __init__(self, rules, default_taskid=None, ignore_case=True):
+        """
+        :param rules: list of (pattern, taskid)
+        :param default_taskid: task ID of the summaries matching no rule
+        :param ignore_case: match the patterns case insensitively
+        """
+        self.rules = list(rules)
+        self.default_taskid = default_taskid
+        flags = re.IGNORECASE if ignore_case else 0
+        self._compiled = [(re.compile(pattern, flags).search, taskid) for pattern, taskid in self.rules]
+        self._cache = {}
+
+    def match(self, summary):
+        """
+        :param summary: summary of a calendar event
+        :return: task ID of the first matching rule; `default_taskid` if none matches
+        """
+        try:
+            return self._cache[summary]
+        except KeyError:
+            pass
+        taskid = self.default_taskid
+        if summary:
+            for search, t in self._compiled:
+                if search(summary):
+                    taskid = t
+                    break
+        if len(self._cache) < MATCH_CACHE_SIZE:
+            self._cache[summary] = taskid
+        return taskid
+
+
+class TimeEntryTable(object):
+    """Column-backed time entries, e.g. the calendar events of an organisation over a year.
+
+    Days, durations, people and tasks are kept in `array` columns of integers; people and task IDs are
+    interned, so each distinct value is stored once.
+    """
+
+    def __init__(self, keep_comments=False):
+        """
+        :param keep_comments: keep the summary of each entry; they are usually not needed for aggregation
+        """
+        self.days = array('l')
+        self.seconds = array('l')
+        self.person_ids = array('l')
+        self.task_ids = array('l')
+        self.comments = [] if keep_comments else None
+        self.persons = []
+        self.tasks = []
+        self._person_index = {}
+        self._task_index = {}
+
+    def __len__(self):
+        return len(self.seconds)
+
+    @staticmethod
+    def _intern(value, values, index):
+        i = index.get(value)
+        if i is None:
+            i = index[value] = len(values)
+            values.append(value)
+        return i
+
+    def append(self, day, person, seconds, taskid, comment=None):
+        """
+        :param day: `date` of the entry
+        :param person: e.g. calendar ID or email address
+        :param seconds: time spent
+        :param taskid: task ID; None if unknown
+        :param comment: optional comment, kept only if the table keeps comments
+        """
+        self.days.append(day.toordinal())
+        self.seconds.append(seconds)
+        self.person_ids.append(self._intern(person, self.persons, self._person_index))
+        self.task_ids.append(self._intern(taskid, self.tasks, self._task_index))
+        if self.comments is not None:
+            self.comments.append(comment)
+
+    def add_events(self, person, events, task_rules):
+        """Convert events of the Calendar API into entries.
+        :param person: e.g. the calendar ID of the events
+        :param events: list of events returned by events().list
+        :param task_rules: `TaskRules` mapping the summaries to task IDs
+        :return: number of entries added
+        """
+        count = 0
+        for event in events:
+            if event.get('status') == 'cancelled':
+                continue
+            start = parse_event_time(event['start'].get('dateTime', event['start'].get('date')))
+            end = parse_event_time(event['end'].get('dateTime', event['end'].get('date')))
+            summary = event.get('summary', '')
+            self.append(start.date(), person, int((end - start).total_seconds()), task_rules.match(summary), summary)
+            count += 1
+        return count
+
+    def rows(self):
+        """
+        :return: generator of `TimeEntry`
+        """
+        comments = self.comments if self.comments is not None else [None] * len(self)
+        for day, seconds, p, t, comment in zip(self.days, self.seconds, self.person_ids, self.task_ids, comments):
+            yield TimeEntry(date.fromordinal(day), self.persons[p], seconds, self.tasks[t], comment)
+
+    def aggregate(self, by=AGGREGATE_KEYS):
+        """Total the time spent per group of entries.
+        :param by: columns to group by, any of 'day', 'person' and 'task'
+        :return: `dict` of {tuple of the values of the `by` columns: total seconds}
+        """
+        columns = {'day': self.days, 'person': self.person_ids, 'task': self.task_ids}
+        try:
+            keys = [columns[k] for k in by]
+        except KeyError as e:
+            raise ValueError('Unable to aggregate by {}, expected any of {}'.format(e, AGGREGATE_KEYS))
+
+        # total on the integer codes, then decode each group once
+        totals = {}
+        for key, seconds in zip(zip(*keys), self.seconds):
+            totals[key] = totals.get(key, 0) + seconds
+
+        decoders = {'day': date.fromordinal, 'person': self.persons.__getitem__, 'task': self.tasks.__getitem__}
+        decode = [decoders[k] for k in by]
+        return {tuple(f(v) for f, v in zip(decode, key)): seconds for key, seconds in totals.items()}
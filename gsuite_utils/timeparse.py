@@ -0,0 +1,31 @@
+from __future__ import print_function
+from datetime import datetime
+from functools import lru_cache
+
+# Number of distinct timestamp strings kept parsed; events of a team often share their start and end times
+PARSE_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_event_time(value):
+    """
+    Parses the start or end of a Calendar API event in a single pass.
+    :param value: RFC3339 timestamp of 'dateTime', e.g. '2020-01-01T09:00:00+10:00' or '2020-01-01T09:00:00Z';
+        or 'YYYY-MM-DD' of 'date' for all-day events
+    :return: `datetime`; timezone aware for RFC3339 timestamps, naive midnight for dates
+    :raise ValueError: if the value is in neither format
+    """
+    if len(value) == 10:
+        return datetime.strptime(value, '%Y-%m-%d')
+    if value.endswith('Z') or value.endswith('z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+def event_duration_seconds(start_time, end_time):
+    """
+    :param start_time: start of the event, see `parse_event_time`
+    :param end_time: end of the event, see `parse_event_time`
+    :return: duration in seconds, including whole days of multi-day events
+    """
+    return int((parse_event_time(end_time) - parse_event_time(start_time)).total_seconds())
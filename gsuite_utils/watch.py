@@ -0,0 +1,322 @@
+from __future__ import print_function
+import hmac
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from gsuite_utils.retry import default_policy
+from gsuite_utils.telemetry import Telemetry
+
+# Requested lifetime of the channels in seconds; Reports API channels last at most 6 hours
+DEFAULT_TTL = 6 * 3600
+
+# Channels expiring within this number of seconds are renewed
+RENEW_BEFORE = 600
+
+# Default seconds between two checks of the renewer thread
+RENEW_INTERVAL = 60
+
+# Number of (channel, message number) pairs remembered to drop the notifications delivered twice
+DEDUP_SIZE = 10000
+
+# A notification channel; expiration is in seconds since the epoch, None if unknown.
+# kind is 'drive' or 'calendar', key is the calendar ID of calendar channels
+Channel = namedtuple('Channel', ['id', 'token', 'resource_id', 'expiration', 'kind', 'key'])
+
+
+class WatchManager(object):
+    """Opens push notification channels of the Reports and Calendar APIs, and renews them before they expire.
+
+    Each channel comes with the function to call when its resource changed, e.g.
+    `lambda channel: gcalendar.sync_gcalendar_events(channel.key, store)`, so a notification triggers an
+    incremental fetch of that resource only. The API services given to the manager must not be used by
+    other threads, as the channels are renewed in the renewer thread.
+    """
+
+    def __init__(self, address, ttl=DEFAULT_TTL, retry_policy=default_policy, telemetry=None, clock=time.time):
+        """
+        :param address: HTTPS URL the notifications are sent to, e.g. the public URL of a `NotificationReceiver`
+        :param ttl: requested lifetime of the channels in seconds
+        :param retry_policy: `RetryPolicy` of the API calls
+        :param telemetry: optional `Telemetry` recording the errors
+        """
+        self.address = address
+        self.ttl = ttl
+        self.retry_policy = retry_policy
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        self._clock = clock
+        # {channel_id: (Channel, service, on_change, watch arguments)}
+        self._channels = {}
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._renewer = None
+
+    def watch_drive_activities(self, service, on_change, event_name=None):
+        """
+        :param service: a Google Admin SDK Reports API service object
+        :param on_change: function(`Channel`) called when drive activities happened
+        :param event_name: optional Drive event name to watch, e.g. change_user_access
+        :return: `Channel`
+        """
+        return self._watch('drive', None, service, on_change, {'eventName': event_name} if event_name else {})
+
+    def watch_calendar_events(self, service, calendar_id, on_change):
+        """
+        :param service: a Google Calendar API service object
+        :param calendar_id: ID of the calendar
+        :param on_change: function(`Channel`) called when events of the calendar changed
+        :return: `Channel`
+        """
+        return self._watch('calendar', calendar_id, service, on_change, {})
+
+    def _watch(self, kind, key, service, on_change, kwargs):
+        body = {
+            'id': str(uuid.uuid4()),
+            'type': 'web_hook',
+            'address': self.address,
+            'token': uuid.uuid4().hex,
+            'params': {'ttl': str(int(self.ttl))},
+        }
+        if kind == 'drive':
+            request = service.activities().watch(userKey='all', applicationName='drive', body=body, **kwargs)
+        else:
+            request = service.events().watch(calendarId=key, body=body, **kwargs)
+        # not under the lock, so the notifications of the other channels are acknowledged meanwhile
+        response = self.retry_policy.execute(request)
+        expiration = response.get('expiration')
+        channel = Channel(body['id'], body['token'], response.get('resourceId'),
+                          int(expiration) / 1000.0 if expiration else None, kind, key)
+        with self._lock:
+            self._channels[channel.id] = (channel, service, on_change, kwargs)
+        return channel
+
+    def channel(self, channel_id, token):
+        """
+        :return: `Channel` if the channel is open and the token is its own; None otherwise
+        """
+        with self._lock:
+            entry = self._channels.get(channel_id)
+        # compared as bytes, as compare_digest rejects non-ASCII str, e.g. headers decoded as latin-1
+        if entry is None or not hmac.compare_digest(
+                entry[0].token.encode('utf-8'), (token or '').encode('utf-8', 'surrogateescape')):
+            return None
+        return entry[0]
+
+    def channels(self):
+        """
+        :return: list of the open `Channel`
+        """
+        with self._lock:
+            return [entry[0] for entry in self._channels.values()]
+
+    def dispatch(self, channel_id):
+        """Call the on_change function of the channel; errors are recorded in `self.telemetry`
+        :return: True if called and succeeded
+        """
+        with self._lock:
+            entry = self._channels.get(channel_id)
+        if entry is None:
+            return False
+        channel, _, on_change, _ = entry
+        try:
+            on_change(channel)
+        except Exception as e:
+            self.telemetry.log('ERROR: Failed to fetch the changes of {} {}. {}'.format(
+                channel.kind, channel.key or '', e), group=channel.key)
+            return False
+        return True
+
+    def stop(self, channel_id):
+        """Stop receiving the notifications of a channel
+        :return: True if succeeded
+        """
+        with self._lock:
+            entry = self._channels.pop(channel_id, None)
+        if entry is None:
+            return False
+        channel, service = entry[:2]
+        try:
+            self.retry_policy.execute(service.channels().stop(
+                body={'id': channel.id, 'resourceId': channel.resource_id}))
+        except Exception as e:
+            # the channel expires anyway
+            self.telemetry.log('ERROR: Failed to stop channel {}. {}'.format(channel.id, e), group=channel.key)
+            return False
+        return True
+
+    def stop_all(self):
+        for channel in self.channels():
+            self.stop(channel.id)
+
+    def renew_expiring(self, margin=RENEW_BEFORE):
+        """Replace the channels expiring within `margin` seconds with new ones, then stop them
+        :return: list of the new `Channel`
+        """
+        now = self._clock()
+        renewed = []
+        with self._lock:
+            expiring = [entry for entry in self._channels.values()
+                        if entry[0].expiration is not None and entry[0].expiration - margin <= now]
+        for channel, service, on_change, kwargs in expiring:
+            try:
+                renewed.append(self._watch(channel.kind, channel.key, service, on_change, kwargs))
+            except Exception as e:
+                self.telemetry.log('ERROR: Failed to renew channel {} of {} {}. {}'.format(
+                    channel.id, channel.kind, channel.key or '', e), group=channel.key)
+                continue
+            self.stop(channel.id)
+        return renewed
+
+    def start_renewer(self, interval=RENEW_INTERVAL, margin=RENEW_BEFORE):
+        """Renew in a daemon thread the channels before they expire
+        :param interval: seconds between two checks
+        :param margin: seconds; channels expiring within it are renewed
+        """
+        with self._lock:
+            if self._renewer is not None:
+                return
+            self._stop.clear()
+            self._renewer = threading.Thread(target=self._renew_loop, args=(interval, margin))
+            self._renewer.daemon = True
+            self._renewer.start()
+
+    def stop_renewer(self):
+        with self._lock:
+            renewer, self._renewer = self._renewer, None
+        if renewer is not None:
+            self._stop.set()
+            renewer.join()
+
+    def _renew_loop(self, interval, margin):
+        while not self._stop.wait(interval):
+            self.renew_expiring(margin)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class NotificationReceiver(object):
+    """Embedded HTTP server receiving the notifications of the channels of a `WatchManager`.
+
+    Notifications are acknowledged at once and the fetches run in a worker thread. Notifications with an
+    unknown channel or a wrong token are rejected, the ones delivered twice are dropped, and the ones received
+    while the changes of their channel are being fetched are coalesced into a single new fetch.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, dedup_size=DEDUP_SIZE):
+        """
+        :param port: port to listen on; 0 for any free port
+        """
+        self.manager = None
+        self.dedup_size = dedup_size
+        self.stats = {'received': 0, 'rejected': 0, 'duplicates': 0, 'sync': 0, 'fetches': 0}
+        self._seen = OrderedDict()
+        self._pending = OrderedDict()
+        self._busy = False
+        self._condition = threading.Condition()
+        self._running = False
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    # the payload of Reports API notifications is not needed for incremental fetches
+                    self.rfile.read(length)
+                status = receiver.notify(self.headers)
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer((host, port), Handler)
+        self.url = 'http://{}:{}/'.format(host, self._server.server_address[1])
+        self._threads = []
+
+    def start(self, manager):
+        """
+        :param manager: `WatchManager` of the channels
+        """
+        self.manager = manager
+        self._running = True
+        self._threads = [threading.Thread(target=self._server.serve_forever, args=(0.05,)),
+                         threading.Thread(target=self._work)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def notify(self, headers):
+        """Handle a notification
+        :param headers: HTTP headers of the notification, e.g. X-Goog-Channel-ID
+        :return: HTTP status of the response
+        """
+        channel_id = headers.get('X-Goog-Channel-ID')
+        with self._condition:
+            self.stats['received'] += 1
+        channel = self.manager.channel(channel_id, headers.get('X-Goog-Channel-Token')) \
+            if self.manager is not None and channel_id else None
+        with self._condition:
+            if channel is None:
+                self.stats['rejected'] += 1
+                return 403
+            key = (channel_id, headers.get('X-Goog-Message-Number'))
+            if key in self._seen:
+                self.stats['duplicates'] += 1
+                return 200
+            self._seen[key] = True
+            if len(self._seen) > self.dedup_size:
+                self._seen.popitem(last=False)
+            if headers.get('X-Goog-Resource-State') == 'sync':
+                # sent once the channel is open; nothing changed
+                self.stats['sync'] += 1
+                return 200
+            self._pending[channel_id] = True
+            self._condition.notify_all()
+        return 200
+
+    def wait_idle(self, timeout=None):
+        """Wait until the changes of all the notifications received are fetched
+        :return: True if idle; False if the timeout expired
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._running and not self._pending:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                channel_id, _ = self._pending.popitem(last=False)
+                self._busy = True
+            try:
+                self.manager.dispatch(channel_id)
+            finally:
+                with self._condition:
+                    self.stats['fetches'] += 1
+                    self._busy = False
+                    self._condition.notify_all()
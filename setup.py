@@ -23,6 +23,7 @@ entry_points = {
     'console_scripts': [
         'gcalendar-helper = gsuite_utils.gcalendar:main',
         'gdrive-helper = gsuite_utils.gdrive:main',
+        'ggroups-helper = gsuite_utils.ggroups_cli:main',
     ]
 }
 setup(